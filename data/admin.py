@@ -1,5 +1,64 @@
-from django.contrib import admin
-from .models import xy_account, machine, Order
+import re
+
+from django.contrib import admin, messages
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils import timezone
+from django.utils.text import smart_split, unescape_string_literal
+
+from .ingest import DELIVERY_STATE_MAP
+from .models import xy_account, machine, Order, SyncCursor, XYSession, DailyMachineSales
+from .outbound import ERROR, FAILED, SENT
+from .pagination import EstimatedCountPaginator
+
+
+# one token with a digit in it: a uuid, order number or Odoo id rather than words
+ID_TERM = re.compile(r'(?=.*\d)[\w.:/-]{6,}')
+
+
+def values_filter(field, values):
+    """A list filter over a fixed set of values (the default one runs SELECT DISTINCT over the table)."""
+
+    class ValuesFilter(admin.SimpleListFilter):
+        title = field.replace('_', ' ')
+        parameter_name = f'{field}__exact'
+
+        def lookups(self, request, model_admin):
+            return [(v, v) for v in values]
+
+        def queryset(self, request, queryset):
+            return queryset.filter(**{field: self.value()}) if self.value() else queryset
+
+    return ValuesFilter
+
+
+class MachineFilter(admin.SimpleListFilter):
+    """A machine number or name typed in (suggested by the machine autocomplete) instead of a link per machine."""
+    title = 'machine'
+    parameter_name = 'machine'
+    template = 'admin/data/machine_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        ids = list(machine.objects.filter(Q(number=value) | Q(name=value)).values_list('pk', flat=True)[:100])
+        return queryset.filter(machine_id__in=ids)
+
+    def choices(self, changelist):
+        keep = QueryDict(changelist.get_query_string(remove=[self.parameter_name]).lstrip('?'))
+        yield {
+            'value': self.value() or '',
+            'hidden': [(k, v) for k in keep for v in keep.getlist(k)],
+            'clear_query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
 
 @admin.register(xy_account)
 class XYAccountAdmin(admin.ModelAdmin):
@@ -11,6 +70,7 @@ class MachineAdmin(admin.ModelAdmin):
     list_display = ('name', 'number', 'is_online', 'is_broken', 'last_online', 'last_order', 'last_update')
     list_filter = ('is_online', 'is_broken')
     search_fields = ('name', 'number')
+    ordering = ('number',)
     readonly_fields = ('last_update',)
 
 @admin.register(Order)
@@ -21,18 +81,88 @@ class OrderAdmin(admin.ModelAdmin):
         'payment_status', 'delivery_state', 'sync_status',
         'created_at', 'updated_at'
     )
+    list_select_related = ('machine',)
     list_filter = (
-        'provider', 'payment_type', 'payment_status','machine',
-        'delivery_state', 'sync_status', 'payment_time', 'updated_at'
+        values_filter('provider', ('xy',)),
+        values_filter('payment_type', ('card', 'cash')),
+        values_filter('payment_status', ('paid', 'pending')),
+        MachineFilter,
+        values_filter('delivery_state', [*DELIVERY_STATE_MAP.values(), 'Unknown']),
+        values_filter('sync_status', ('pending', SENT, FAILED, ERROR)),
+        'payment_time', 'updated_at'
     )
     search_fields = (
         'uuid', 'source_order_no', 'machine__name', 'machine__number', 'product_name',
         'external_id'
     )
     date_hierarchy = 'payment_time'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('requeue_for_odoo', 'mark_error')
     readonly_fields = (
         'uuid', 'provider', 'source_order_no', 'machine',
         'product_name', 'slot_number', 'payment_amount', 'payment_time',
         'payment_type', 'payment_status', 'delivery_state', 'source_payload',
         'created_at', 'updated_at'
     )
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        An ID-looking term is first matched exactly, then by prefix, on uuid /
+        source_order_no / external_id (btree index scans). Anything else, or an ID with no
+        match, is the usual icontains search, served by the pg_trgm indexes
+        (migration 0011). Machines are matched on their own table first, so
+        data_order is never joined into the OR.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if ID_TERM.fullmatch(term):
+            for lookup in ('exact', 'startswith'):
+                by_id = queryset.filter(
+                    Q(**{f'uuid__{lookup}': term}) | Q(**{f'source_order_no__{lookup}': term}) | Q(**{f'external_id__{lookup}': term})
+                )
+                if by_id.exists():
+                    return by_id, False
+
+        local = [f for f in self.search_fields if '__' not in f]
+        for bit in smart_split(term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            machines = machine.objects.filter(Q(name__icontains=bit) | Q(number__icontains=bit)).values('pk')
+            match = Q(machine__in=machines)
+            for field in local:
+                match |= Q(**{f'{field}__icontains': bit})
+            queryset = queryset.filter(match)
+        return queryset, False
+
+    # actions are one UPDATE each, however many orders are selected
+
+    @admin.action(description='Requeue selected orders for Odoo sync')
+    def requeue_for_odoo(self, request, queryset):
+        updated = queryset.update(
+            sync_status='pending', attempts=0, next_retry_at=None, last_sync_error=None, updated_at=timezone.now(),
+        )
+        self.message_user(request, f'{updated} order(s) requeued for Odoo sync.', messages.SUCCESS)
+
+    @admin.action(description='Mark selected orders as error (no more Odoo retries)')
+    def mark_error(self, request, queryset):
+        updated = queryset.update(sync_status=ERROR, next_retry_at=None, updated_at=timezone.now())
+        self.message_user(request, f'{updated} order(s) marked error; push_orders will not retry them.', messages.SUCCESS)
+
+@admin.register(SyncCursor)
+class SyncCursorAdmin(admin.ModelAdmin):
+    list_display = ('xy_account', 'high_water', 'complete', 'pages_done', 'last_success_at', 'updated_at')
+    readonly_fields = ('updated_at',)
+
+@admin.register(XYSession)
+class XYSessionAdmin(admin.ModelAdmin):
+    list_display = ('xy_account', 'expires_at', 'logins', 'last_login_ms', 'failures', 'consecutive_failures', 'last_failure_at')
+    readonly_fields = ('updated_at',)
+
+@admin.register(DailyMachineSales)
+class DailyMachineSalesAdmin(admin.ModelAdmin):
+    list_display = ('machine', 'date', 'delivery_state', 'total_amount', 'order_count', 'updated_at')
+    list_filter = ('delivery_state',)
+    search_fields = ('machine__number',)
+    readonly_fields = ('updated_at',)
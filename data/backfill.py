@@ -0,0 +1,237 @@
+# data/backfill.py
+"""
+Bulk loading for historical imports (sync_orders --backfill).
+
+Pages are parsed and buffered; every `batch_rows` rows the batch is written
+in one go instead of page by page:
+- PostgreSQL: COPY FROM STDIN into a temporary staging table, then one
+  INSERT ... SELECT ... ON CONFLICT (uuid) DO NOTHING RETURNING uuid into
+  data_order, and the same again for the packed payloads of just the
+  returned uuids into data_orderpayload. A month-partitioned data_order (see data/partitions.py) has no unique
+  index on uuid to conflict on; new rows are picked against data_order_uuid
+  instead.
+- Other databases (the SQLite DEBUG database): existing uuids are looked up
+  in chunks and the rest go in through ingest.insert_orders().
+
+Per-order upkeep is skipped while loading. finish() recomputes last_order
+of the touched machines in one UPDATE, rebuilds the DailyMachineSales rollup
+for the loaded days and clears the sales cache.
+"""
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import cache as sales_cache
+from .ingest import IngestResult, MachineRegistry, insert_orders, parse_row
+from .metrics import metrics
+from .models import machine as Machine, Order, OrderPayload
+from .partitions import UUID_TABLE, is_partitioned
+from .rollup import rebuild
+
+STAGE_SUFFIX = "_stage"
+NULL = r"\N"
+LOOKUP_CHUNK = 900  # stays under SQLite's bound-parameter limit
+
+
+def _copy_value(value):
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return value
+
+
+def copy_in(raw_cursor, sql, data):
+    """Run COPY ... FROM STDIN with `data` (text) on a psycopg2 or psycopg 3 cursor."""
+    if hasattr(raw_cursor, "copy_expert"):  # psycopg2
+        raw_cursor.copy_expert(sql, io.StringIO(data))
+    else:  # psycopg 3
+        with raw_cursor.copy(sql) as copy:
+            copy.write(data)
+
+
+class BulkLoader:
+    """
+    Buffers parsed rows of any number of accounts and writes them in batches.
+    registry(account) returns the account's MachineRegistry (a fresh loaded
+    one per account when omitted).
+    """
+
+    def __init__(self, batch_rows=20000, registry=None, log=None):
+        self.batch_rows = batch_rows
+        self.registry = registry or self._own_registry
+        self.log = log or (lambda msg: None)
+        self.registries = {}
+        self.buffer = {}  # uuid -> Order
+        self.machine_ids = set()
+        self.first = self.last = None
+        self.inserted = self.staged = 0
+
+    def _own_registry(self, account):
+        registry = self.registries.get(account.pk)
+        if registry is None:
+            registry = self.registries[account.pk] = MachineRegistry(account).load()
+        return registry
+
+    def add(self, rows, account):
+        """Stage one page of raw XY rows; flushes when the buffer is full. Returns an IngestResult."""
+        started = time.monotonic()
+        parsed, invalid = [], 0
+        label = account.username if account is not None else ""
+        with metrics.timer("phase", phase="parse", account=label):
+            for row in rows:
+                p = parse_row(row)
+                if p is None:
+                    invalid += 1
+                else:
+                    parsed.append(p)
+        names = {}
+        for p in parsed:
+            if p["machine_number"]:
+                names.setdefault(p["machine_number"], p["machine_name"])
+        machines = self.registry(account).resolve(names) if names else {}
+
+        for p in parsed:
+            m = machines.get(p["machine_number"])
+            if m is not None:
+                self.machine_ids.add(m.pk)
+            self.buffer[p["uuid"]] = Order(
+                uuid=p["uuid"],
+                provider="xy",
+                source_order_no=p["source_order_no"],
+                machine=m,
+                product_name=p["product_name"],
+                slot_number=p["slot_number"],
+                payment_amount=p["payment_amount"],
+                payment_time=p["payment_time"],
+                payment_type=p["payment_type"],
+                payment_status=p["payment_status"],
+                delivery_state=p["delivery_state"],
+                source_payload=p["source_payload"],
+                sync_status="pending",
+            )
+            if self.first is None or p["payment_time"] < self.first:
+                self.first = p["payment_time"]
+            if self.last is None or p["payment_time"] > self.last:
+                self.last = p["payment_time"]
+        inserted = self.flush() if len(self.buffer) >= self.batch_rows else 0
+        latest = max((p["payment_time"] for p in parsed), default=None)
+        return IngestResult(inserted, 0, invalid, latest, (time.monotonic() - started) * 1000)
+
+    def flush(self):
+        """
+        Write the buffered orders. Returns how many were new. The buffer is only
+        emptied once they are committed; if the write fails it keeps them for the
+        next flush and the error propagates.
+        """
+        if not self.buffer:
+            return 0
+        orders = list(self.buffer.values())
+        started = time.monotonic()
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                if is_partitioned():
+                    new = self._copy_merge(Order, orders, None, order_by="payment_time", unique=UUID_TABLE, returning="uuid")
+                else:
+                    new = self._copy_merge(Order, orders, "uuid", order_by="payment_time", returning="uuid")
+                # payloads only for the orders that really went in
+                self._copy_merge(OrderPayload, OrderPayload.for_orders([o for o in orders if o.uuid in new]), "order_uuid")
+                inserted = len(new)
+            else:
+                inserted = self._bulk_insert(orders)
+        self.buffer = {}
+        elapsed = time.monotonic() - started
+        self.staged += len(orders)
+        self.inserted += inserted
+        metrics.observe("phase", elapsed, phase="upsert", account="backfill")
+        metrics.incr("orders", inserted, account="backfill", result="inserted")
+        metrics.incr("orders", len(orders) - inserted, account="backfill", result="skipped")
+        self.log(f"[BULK] {inserted} new of {len(orders)} staged in {elapsed * 1000:.0f}ms ({self.inserted} new so far)")
+        return inserted
+
+    def _copy_merge(self, model, objs, conflict, order_by=None, unique=None, returning=None):
+        """
+        COPY `objs` into a temp copy of model's table, then merge them in. Returns rows inserted,
+        or with `returning` the set of that column's values of the inserted rows.
+        With `unique`, rows whose uuid is already in that table are skipped instead of using ON CONFLICT.
+        """
+        if not objs:
+            return set() if returning else 0
+        # an auto id is left to the table; a primary key that is a real column (OrderPayload.order) is copied
+        fields = [f for f in model._meta.concrete_fields if not (f.primary_key and f.auto_created)]
+        columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for o in objs:
+            writer.writerow([_copy_value(f.pre_save(o, True)) for f in fields])
+
+        table = connection.ops.quote_name(model._meta.db_table)
+        stage = connection.ops.quote_name(model._meta.db_table + STAGE_SUFFIX)
+        with connection.cursor() as cur:
+            # rows vanish at commit; the table itself lives as long as the connection
+            cur.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {stage} ON COMMIT DELETE ROWS "
+                f"AS SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            copy_sql = f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')"
+            copy_in(cur.cursor, copy_sql, buf.getvalue())
+            new_only = f"s WHERE NOT EXISTS (SELECT 1 FROM {unique} u WHERE u.uuid = s.uuid) " if unique else ""
+            cur.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} {new_only}"
+                + (f"ORDER BY {order_by} " if order_by else "")
+                + (f"ON CONFLICT ({conflict}) DO NOTHING " if conflict else "")
+                + (f"RETURNING {connection.ops.quote_name(returning)}" if returning else "")
+            )
+            if returning:
+                return {row[0] for row in cur.fetchall()}
+            return cur.rowcount
+
+    def _bulk_insert(self, orders):
+        existing = set()
+        uuids = [o.uuid for o in orders]
+        for i in range(0, len(uuids), LOOKUP_CHUNK):
+            existing.update(Order.objects.filter(uuid__in=uuids[i:i + LOOKUP_CHUNK]).values_list("uuid", flat=True))
+        new = sorted((o for o in orders if o.uuid not in existing), key=lambda o: o.payment_time)
+        inserted = insert_orders(new)
+        new = [o for o in new if o.uuid in inserted]
+        OrderPayload.objects.bulk_create(OrderPayload.for_orders(new), batch_size=500, ignore_conflicts=True)
+        return len(new)
+
+    def finish(self):
+        """Flush, then machine last_order, the rollup and the sales cache. Returns orders inserted."""
+        self.flush()
+        if self.machine_ids:
+            latest = (
+                Order.objects.filter(machine=OuterRef("pk"))
+                .order_by().values("machine").annotate(latest=Max("payment_time")).values("latest")
+            )
+            updated = Machine.objects.filter(pk__in=self.machine_ids).update(
+                last_order=Coalesce(Subquery(latest), "last_order")
+            )
+            self.log(f"[BULK] last_order recomputed for {updated} machine(s)")
+        if self.inserted and self.first is not None:
+            start, end = timezone.localtime(self.first).date(), timezone.localtime(self.last).date()
+            written = rebuild(start, end, machine_ids=list(self.machine_ids))
+            sales_cache.invalidate_all()
+            self.log(f"[BULK] rollup rebuilt for {start} → {end} ({written} rows)")
+        inserted = self.inserted
+        self.machine_ids = set()
+        self.first = self.last = None
+        self.inserted = self.staged = 0
+        return inserted
@@ -0,0 +1,183 @@
+# data/cache.py
+"""
+Cache for the sales aggregate endpoints.
+
+Entries are keyed on normalized parameters (sorted, de-duplicated machine
+numbers and the local date range). A range that ends before today is
+closed and stays cached until an ingest invalidates it; a range that
+reaches today expires after SALES_CACHE_TTL seconds.
+
+The values live in the `sales` cache, which may cull them at will. What
+says which value is current lives in the database, which never culls and
+updates atomically: SalesCacheKey holds each key's range and version
+token, and SalesCacheMachine indexes the keys by machine. When the sync
+ingest inserts orders for (machine, day), invalidate() replaces the token
+of only the keys of that machine whose range covers that day;
+invalidate_all() replaces every token.
+
+A value is stored under its key plus the version token. Invalidating a key
+replaces its token, so a request that read the rows before an ingest
+committed and stores its result after the invalidation writes it under a
+token nobody reads any more, instead of caching a stale total.
+
+Hit, miss and eviction counts are summed per process and added to
+SalesCacheStat with atomic increments at most every STATS_FLUSH_SECONDS,
+so they add up across processes.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import SalesCacheKey, SalesCacheMachine, SalesCacheStat
+
+
+CACHE_ALIAS = "sales"
+KEY_PREFIX = "sales:v3"
+STAT_NAMES = ("hits", "misses", "evicted")
+STATS_FLUSH_SECONDS = 5
+PRUNE_EVERY = 300  # seconds between sweeps of expired SalesCacheKey rows, per process
+PRUNE_GRACE = 3600  # expired keys are kept this much longer, for requests still computing them
+
+_pending = Counter()  # counts not yet added to SalesCacheStat
+_last = {"flush": 0.0, "prune": 0.0}
+_lock = threading.Lock()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def normalize_machines(numbers):
+    return tuple(sorted({str(n).strip() for n in numbers if str(n).strip()}))
+
+
+def cache_key(kind, machines, start_date, end_date, extra=""):
+    raw = "|".join([kind, ",".join(machines), start_date.isoformat(), end_date.isoformat(), extra])
+    return f"{KEY_PREFIX}:{kind}:{_digest(raw)}"
+
+
+def _version(key):
+    """The key's current version token, or None when it is not registered."""
+    return SalesCacheKey.objects.filter(key=key).values_list("version", flat=True).first()
+
+
+def timeout_for(end_date):
+    """None (no expiry) for closed days (before today, local time); SALES_CACHE_TTL otherwise."""
+    return None if end_date < timezone.localdate() else settings.SALES_CACHE_TTL
+
+
+def _count(name, n=1):
+    with _lock:
+        _pending[name] += n
+        due = time.monotonic() - _last["flush"] >= STATS_FLUSH_SECONDS
+    if due:
+        flush_stats()
+
+
+def flush_stats():
+    """Add this process's pending counts to SalesCacheStat."""
+    with _lock:
+        pending = {name: n for name, n in _pending.items() if n}
+        _pending.clear()
+        _last["flush"] = time.monotonic()
+    for name, n in pending.items():
+        if not SalesCacheStat.objects.filter(name=name).update(value=F("value") + n):
+            SalesCacheStat.objects.bulk_create([SalesCacheStat(name=name)], ignore_conflicts=True)
+            SalesCacheStat.objects.filter(name=name).update(value=F("value") + n)
+
+
+def _register(key, machines, start_date, end_date, timeout):
+    """Record `key`, its range and machines; a new key gets a fresh version token."""
+    expires_at = None if timeout is None else timezone.now() + timedelta(seconds=timeout)
+    SalesCacheKey.objects.bulk_create(
+        [SalesCacheKey(key=key, version=uuid.uuid4().hex, start_date=start_date, end_date=end_date, expires_at=expires_at)],
+        update_conflicts=True, unique_fields=["key"], update_fields=["expires_at"],
+    )
+    SalesCacheMachine.objects.bulk_create(
+        [SalesCacheMachine(key_id=key, machine_number=number) for number in machines], ignore_conflicts=True,
+    )
+
+
+def _prune():
+    """Drop keys that expired more than PRUNE_GRACE ago (closed ranges never expire)."""
+    with _lock:
+        if time.monotonic() - _last["prune"] < PRUNE_EVERY:
+            return
+        _last["prune"] = time.monotonic()
+    SalesCacheKey.objects.filter(expires_at__lt=timezone.now() - timedelta(seconds=PRUNE_GRACE)).delete()
+
+
+def get_or_compute(kind, machines, date_range, compute, extra=""):
+    """
+    Cached value for (kind, machines, date_range, extra), computing and storing it on a miss.
+    `machines` must already be normalized (normalize_machines).
+    """
+    cache = _cache()
+    key = cache_key(kind, machines, date_range.start_date, date_range.end_date, extra)
+    version = _version(key)
+    if version is not None:
+        value = cache.get(f"{key}:{version}")
+        if value is not None:
+            _count("hits")
+            return value
+    _count("misses")
+    # registered before the version is read: an invalidate() from here on finds the key
+    # and changes its version, so a value computed from older rows is never read back
+    timeout = timeout_for(date_range.end_date)
+    _register(key, machines, date_range.start_date, date_range.end_date, timeout)
+    version = _version(key)
+    value = compute()
+    if version is not None:  # None: pruned meanwhile, serve the value uncached
+        cache.set(f"{key}:{version}", value, timeout)
+    return value
+
+
+def invalidate(machine_days):
+    """Evict cached entries covering any of the (machine_number, date) pairs. Returns the number evicted."""
+    by_machine = {}
+    for number, day in machine_days:
+        by_machine.setdefault(number, set()).add(day)
+    if not by_machine:
+        return 0
+
+    covering = Q()
+    for number, days in by_machine.items():
+        on_day = Q()
+        for day in days:
+            on_day |= Q(key__start_date__lte=day, key__end_date__gte=day)
+        covering |= Q(machine_number=number) & on_day
+    live = Q(key__expires_at__isnull=True) | Q(key__expires_at__gt=timezone.now())
+    victims = set(SalesCacheMachine.objects.filter(covering, live).values_list("key_id", flat=True))
+    if victims:
+        stale = SalesCacheKey.objects.filter(key__in=victims).values_list("key", "version")
+        _cache().delete_many([f"{key}:{version}" for key, version in stale])
+        SalesCacheKey.objects.filter(key__in=victims).update(version=uuid.uuid4().hex)
+        _count("evicted", len(victims))
+    _prune()
+    return len(victims)
+
+
+def invalidate_all():
+    """Retire every sales entry (after a rollup rebuild) by replacing every version token; counters are kept."""
+    SalesCacheKey.objects.update(version=uuid.uuid4().hex)
+
+
+def stats():
+    flush_stats()
+    values = dict(SalesCacheStat.objects.values_list("name", "value"))
+    result = {n: values.get(n, 0) for n in STAT_NAMES}
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else None
+    return result
@@ -0,0 +1,98 @@
+# data/chunker.py
+"""
+Adaptive fetch windows for the XY order sync.
+
+Instead of fixed 7-day chunks, windows are sized from the account's order
+rate in the Order table and then from the `total` the API reports for the
+previous window, aiming at one nearly full page (page_size * fill) per
+window: windows that come back with less than that are merged (the next one
+grows), windows that need more than `max_pages` pages of offset paging are
+split back to one page (the next one shrinks). Anything in between is left
+alone, so a window that drifts a little over one page does not resize on
+every step.
+"""
+import math
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Order
+
+
+def _fmt_width(td):
+    hours = td.total_seconds() / 3600
+    return f"{hours / 24:.1f}d" if hours >= 48 else f"{hours:.1f}h"
+
+
+class AdaptiveChunker:
+    MAX_GROWTH = 4      # a window grows at most 4x per step (merging sparse windows)
+    MAX_SHRINK = 8      # and shrinks at most 8x (splitting dense ones)
+    MERGE_TAIL = 0.25   # a last window under 1/4 of the width joins the one before it
+
+    def __init__(self, page_size, rate_per_hour=None, min_width=timedelta(hours=1),
+                 max_width=timedelta(days=7), max_pages=2, fill=0.9, log=None):
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.fill = fill
+        self.target = max(1, int(page_size * fill))  # orders per window: one nearly full page
+        self.min_width = min_width
+        self.max_width = max_width
+        self.log = log or (lambda msg: None)
+        self.width = self._clamp(self._width_for_rate(rate_per_hour))
+
+    @staticmethod
+    def learned_rate(account, lookback_days=14):
+        """Orders/hour for the account's machines over the last `lookback_days`."""
+        since = timezone.now() - timedelta(days=lookback_days)
+        count = Order.objects.filter(machine__xy_account=account, payment_time__gte=since).count()
+        return count / (lookback_days * 24)
+
+    @classmethod
+    def for_account(cls, account, page_size, log=None, **kwargs):
+        rate = cls.learned_rate(account)
+        chunker = cls(page_size, rate_per_hour=rate, log=log, **kwargs)
+        chunker.log(f"[CHUNKER] {account} learned rate {rate:.1f} orders/h → initial width {_fmt_width(chunker.width)}")
+        return chunker
+
+    def _width_for_rate(self, rate_per_hour):
+        if not rate_per_hour:
+            return self.max_width
+        return timedelta(hours=self.target / rate_per_hour)
+
+    def _clamp(self, width):
+        return max(self.min_width, min(self.max_width, width))
+
+    def windows(self, start_dt, end_dt):
+        """
+        Yield (chunk_start, chunk_end) covering [start_dt, end_dt), newest first.
+        The width is re-read on every step, so observe() between steps resizes
+        the following windows. A remainder narrower than MERGE_TAIL of the width
+        is folded into the last window instead of costing a request of its own.
+        """
+        cur = end_dt
+        while cur > start_dt:
+            prev = max(cur - self.width, start_dt)
+            if prev - start_dt < self.width * self.MERGE_TAIL:
+                prev = start_dt
+            yield (prev, cur)
+            cur = prev
+
+    def observe(self, chunk_start, chunk_end, total):
+        """Resize the next window from the `total` the API reported for this one."""
+        span = chunk_end - chunk_start
+        if span <= timedelta(0):
+            return
+        if total < self.page_size * self.fill:
+            # sparse: merge, aiming at one nearly-full page
+            width = span * min(self.MAX_GROWTH, self.page_size / max(total, 1))
+            reason = "sparse"
+        elif math.ceil(total / self.page_size) > self.max_pages:
+            # dense: split back to one page so offset paging stays shallow
+            width = span * max(1 / self.MAX_SHRINK, self.target / total)
+            reason = "dense"
+        else:
+            return
+        width = self._clamp(width)
+        if width != self.width:
+            self.log(f"[CHUNKER] total={total} in {_fmt_width(span)} ({reason}) → next width {_fmt_width(width)}")
+        self.width = width
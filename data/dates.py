@@ -0,0 +1,53 @@
+# data/dates.py
+"""
+Date-range parsing shared by the API views.
+
+`start_date` / `end_date` (YYYY-MM-DD, local TIME_ZONE days, both inclusive)
+become half-open aware bounds, so queries filter
+`payment_time >= start AND payment_time < end` and can use the payment_time
+index; `payment_time__date` lookups cast every row instead.
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+DATE_FORMAT = "%Y-%m-%d"
+
+# start_date/end_date: the local days asked for; start/end: aware [start, end) datetimes
+DateRange = namedtuple("DateRange", ["start_date", "end_date", "start", "end"])
+
+
+class DateRangeError(ValueError):
+    """start_date / end_date are malformed or out of order."""
+
+
+def local_day_bounds(start_date, end_date):
+    """Aware [start, end) datetimes covering local days start_date..end_date inclusive."""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def parse_date(value, name="date"):
+    try:
+        return datetime.strptime(str(value).strip(), DATE_FORMAT).date()
+    except ValueError:
+        raise DateRangeError(f"{name} must be a date in YYYY-MM-DD format.")
+
+
+def parse_date_range(start_value, end_value):
+    """Validate start_date/end_date strings and return a DateRange."""
+    start_date = parse_date(start_value, "start_date")
+    end_date = parse_date(end_value, "end_date")
+    if start_date > end_date:
+        raise DateRangeError("start_date must not be after end_date.")
+    start, end = local_day_bounds(start_date, end_date)
+    return DateRange(start_date, end_date, start, end)
+
+
+def payment_time_filter(date_range, field="payment_time"):
+    """Sargable filter kwargs for a DateRange."""
+    return {f"{field}__gte": date_range.start, f"{field}__lt": date_range.end}
@@ -0,0 +1,362 @@
+# data/ingest.py
+"""
+Page-level ingestion of XY order rows.
+
+A whole API page is parsed first, then existing orders are looked up with
+one IN query and machines come from the cycle's MachineRegistry (no query
+unless the page brings unknown machine numbers); new orders go in with a
+single INSERT ... ON CONFLICT DO NOTHING RETURNING uuid (their raw rows packed
+into OrderPayload with another) and machine upkeep is folded into one
+bulk_update. Only the orders the INSERT really stored (a concurrent ingest
+of the same uuid may win the race) are added to the DailyMachineSales rollup
+in the same transaction, and the cached sales totals for their machines and
+days are evicted on commit. A row whose data the database rejects costs the
+page a second, row-by-row pass; only that row is lost and counted as invalid.
+"""
+import time
+from collections import namedtuple
+from decimal import Decimal
+from datetime import datetime
+
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models.constants import OnConflict
+from django.db.models.sql import InsertQuery
+from django.utils import timezone
+
+from . import cache as sales_cache
+from .metrics import metrics
+from .models import machine as Machine, Order, OrderPayload
+from .partitions import is_partitioned
+from .rollup import apply_orders
+
+DELIVERY_STATE_MAP = {
+    0: "Shipment Not Notified",
+    1: "Shipment Notified",
+    2: "Shipment Result Not Received",
+    3: "Partial shipment",
+    4: "Goods Shipped",
+    5: "Shipment failed",
+    6: "Notification Shipment Failure",
+    7: "Shipment Timeout",
+}
+
+IngestResult = namedtuple("IngestResult", ["inserted", "skipped", "invalid", "latest", "elapsed_ms"])
+
+# errors a row's own data can cause; a page failing with one is retried row by row
+ROW_ERRORS = (DataError, IntegrityError, ValueError, TypeError, ArithmeticError)
+
+
+# -----------------------------
+# Row helpers
+# -----------------------------
+def _parse_decimal(v, default=Decimal("0")) -> Decimal:
+    try:
+        return Decimal(str(v))
+    except Exception:
+        return default
+
+def _parse_dt_strict_zfsj(zfsj: str):
+    """
+    Strictly parse zfsj as the payment_time.
+    If zfsj is missing or bad -> return None (we'll skip the row).
+    """
+    if not zfsj:
+        return None
+    s = str(zfsj).split(".")[0]
+    try:
+        dt = datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+    return timezone.make_aware(dt, timezone.get_current_timezone())
+
+def _extract_slot(row):
+    ext2 = row.get("extend2")
+    if isinstance(ext2, str) and ":" in ext2:
+        return ext2.split(":", 1)[1].strip()
+    return None
+
+def _extract_product_name(row):
+    ext2 = row.get("extend2")
+    if isinstance(ext2, str) and ":" in ext2:
+        return ext2.split(":", 1)[0].strip()
+    return "Unknown"
+
+def _payment_type(zffs):
+    s = (zffs or "").lower()
+    if s == "unionpay":
+        return "card"
+    return "cash" if s else None
+
+def _payment_status(showzfzt, zfzt):
+    if str(showzfzt).lower() == "paid":
+        return "paid"
+    if str(zfzt) in ("1", "paid"):
+        return "paid"
+    return "pending"
+
+def _delivery_state(chzt):
+    try:
+        chzt_int = int(chzt)
+    except (TypeError, ValueError):
+        chzt_int = None
+    return DELIVERY_STATE_MAP.get(chzt_int, "Unknown")
+
+
+def parse_row(row):
+    """
+    Map one raw XY row to Order field values.
+    Returns None if the row has no usable zfsj or provider uuid.
+    """
+    payment_time = _parse_dt_strict_zfsj(row.get("zfsj"))
+    if payment_time is None:
+        return None
+
+    provider_uuid = row.get("uuid") or row.get("dsfjybh") or row.get("dsfshdh") or row.get("ddbh")
+    if not provider_uuid:
+        return None
+
+    source_order_no = row.get("ddbh") or row.get("dsfjybh") or row.get("dsfshdh")
+    return {
+        "uuid": str(provider_uuid),
+        "machine_number": str(row.get("jqbh") or ""),
+        "machine_name": row.get("jqmc") or "",
+        "source_order_no": str(source_order_no) if source_order_no else None,
+        "product_name": _extract_product_name(row),
+        "slot_number": _extract_slot(row),
+        "payment_amount": _parse_decimal(row.get("zfje") or row.get("ddzj") or row.get("spzj") or Decimal("0")),
+        "payment_time": payment_time,
+        "payment_type": _payment_type(row.get("zffs")),
+        "payment_status": _payment_status(row.get("showzfzt"), row.get("zfzt")),
+        "delivery_state": _delivery_state(row.get("chzt")),
+        "source_payload": row,
+    }
+
+
+# -----------------------------
+# Page ingest
+# -----------------------------
+class MachineRegistry:
+    """
+    number -> machine for one account, kept for a whole sync cycle.
+
+    load() reads the account's machines once; numbers it does not know are
+    looked up (or created) in one query per page that brings new ones. Machine
+    upkeep (name, last_order, is_broken) is applied in memory by touch() and
+    written by flush() at the end of each page with a single bulk_update.
+    """
+    FIELDS = ["name", "last_order", "is_broken"]
+
+    def __init__(self, account):
+        self.account = account
+        self.machines = {}
+        self.dirty = {}
+        self.loaded = False
+
+    def load(self):
+        for m in Machine.objects.filter(xy_account=self.account):
+            self.machines.setdefault(m.number, m)
+        self.loaded = True
+        return self
+
+    def resolve(self, names):
+        """Machines for {number: name}, creating missing ones. Returns number -> machine."""
+        missing = [n for n in names if n not in self.machines]
+        if missing:
+            for m in Machine.objects.filter(number__in=missing):
+                self.machines[m.number] = m
+            new = [n for n in missing if n not in self.machines]
+            if new:
+                # another process may create the same numbers: unique number + ignore_conflicts
+                Machine.objects.bulk_create(
+                    [Machine(number=n, name=names[n] or n, xy_account=self.account) for n in new],
+                    ignore_conflicts=True,
+                )
+                for m in Machine.objects.filter(number__in=new):
+                    self.machines[m.number] = m
+        return {n: self.machines[n] for n in names if n in self.machines}
+
+    def touch(self, m, name, payment_time):
+        """Name, last_order and auto-unbreak for an order of machine `m`."""
+        if not m.name and name:
+            m.name = name
+            self.dirty[m.pk] = m
+        if not m.last_order or payment_time > m.last_order:
+            m.last_order = payment_time
+            self.dirty[m.pk] = m
+        if m.is_broken:
+            m.is_broken = False
+            self.dirty[m.pk] = m
+
+    def flush(self):
+        if self.dirty:
+            Machine.objects.bulk_update(list(self.dirty.values()), self.FIELDS)
+        flushed = len(self.dirty)
+        self.dirty = {}
+        return flushed
+
+    def reset(self):
+        """Forget everything (after a rolled-back page the in-memory state may be ahead of the DB)."""
+        self.machines = {}
+        self.dirty = {}
+        self.loaded = False
+
+
+def insert_orders(orders, batch_size=500):
+    """
+    INSERT `orders`, skipping uuids that are already stored, and return the set
+    of uuids that really went in: ON CONFLICT DO NOTHING (INSERT OR IGNORE on
+    SQLite) with RETURNING uuid. Backends without RETURNING on multi-row
+    inserts re-select the uuids afterwards, inside the caller's transaction.
+    """
+    if not orders:
+        return set()
+    uuid_field = Order._meta.get_field("uuid")
+    if not connection.features.can_return_rows_from_bulk_insert:
+        before = set(Order.objects.filter(uuid__in=[o.uuid for o in orders]).values_list("uuid", flat=True))
+        Order.objects.bulk_create(orders, batch_size=batch_size, ignore_conflicts=True)
+        after = set(Order.objects.filter(uuid__in=[o.uuid for o in orders]).values_list("uuid", flat=True))
+        return after - before
+
+    fields = [f for f in Order._meta.concrete_fields if f is not Order._meta.auto_field]
+    batch_size = max(1, min(batch_size, connection.ops.bulk_batch_size(fields, orders)))
+    inserted = set()
+    with connection.cursor() as cur:
+        for i in range(0, len(orders), batch_size):
+            query = InsertQuery(Order, on_conflict=OnConflict.IGNORE)
+            query.insert_values(fields, orders[i:i + batch_size])
+            compiler = query.get_compiler(connection=connection)
+            compiler.returning_fields = [uuid_field]
+            for sql, params in compiler.as_sql():
+                cur.execute(sql, params)
+                inserted.update(row[0] for row in cur.fetchall())
+    return inserted
+
+
+def ingest_page(rows, account, registry=None):
+    """
+    Ingest one page of raw XY rows for `account`.
+    Orders are insert-only (existing uuids are never updated).
+    `registry` is the cycle's MachineRegistry for the account (a throwaway one
+    is used when omitted). Returns an IngestResult with inserted / skipped
+    (already stored) / invalid counts and the latest payment_time seen on the page.
+
+    The page goes in as one transaction. If a row's data makes it fail, the page
+    is ingested again one row per savepoint: rows that still fail are counted as
+    invalid and the rest are stored. Other errors (the database going away) propagate.
+    """
+    registry = registry or MachineRegistry(account)
+    try:
+        with transaction.atomic():
+            return _ingest_page(rows, account, registry)
+    except ROW_ERRORS:
+        registry.reset()
+        if len(rows) <= 1:
+            raise
+    except Exception:
+        registry.reset()
+        raise
+    return _ingest_rows(rows, account, registry)
+
+
+def _ingest_rows(rows, account, registry):
+    """Fallback of ingest_page(): one savepoint per row, failing rows are counted as invalid."""
+    started = time.monotonic()
+    results = []
+    failed = 0
+    for row in rows:
+        try:
+            with transaction.atomic():
+                results.append(_ingest_page([row], account, registry))
+        except ROW_ERRORS:
+            registry.reset()
+            failed += 1
+    if failed:
+        metrics.incr("orders", failed, account=account.username if account is not None else "", result="invalid")
+    return IngestResult(
+        sum(r.inserted for r in results),
+        sum(r.skipped for r in results),
+        sum(r.invalid for r in results) + failed,
+        max((r.latest for r in results if r.latest), default=None),
+        (time.monotonic() - started) * 1000,
+    )
+
+
+def _ingest_page(rows, account, registry):
+    started = time.monotonic()
+    label = account.username if account is not None else ""
+
+    parsed = []
+    seen = set()
+    invalid = 0
+    with metrics.timer("phase", phase="parse", account=label):
+        for row in rows:
+            p = parse_row(row)
+            if p is None:
+                invalid += 1
+                continue
+            if p["uuid"] in seen:
+                continue
+            seen.add(p["uuid"])
+            parsed.append(p)
+    parsed_at = time.monotonic()
+
+    existing = set()
+    if parsed:
+        lookup = Order.objects.filter(uuid__in=list(seen))
+        if is_partitioned():
+            # prune to the page's months; a uuid stored under another payment_time is
+            # missed here but still skipped by the uuid trigger (see data/partitions.py)
+            times = [p["payment_time"] for p in parsed]
+            lookup = lookup.filter(payment_time__gte=min(times), payment_time__lte=max(times))
+        existing = set(lookup.values_list("uuid", flat=True))
+
+    names = {}
+    for p in parsed:
+        if p["machine_number"]:
+            names.setdefault(p["machine_number"], p["machine_name"])
+    machines = registry.resolve(names)
+
+    # Machine upkeep (name, last_order + auto-unbreak), applied in memory.
+    for p in parsed:
+        m = machines.get(p["machine_number"])
+        if m is not None:
+            registry.touch(m, p["machine_name"], p["payment_time"])
+
+    new_orders = [
+        Order(
+            uuid=p["uuid"],
+            provider="xy",
+            source_order_no=p["source_order_no"],
+            machine=machines.get(p["machine_number"]),
+            product_name=p["product_name"],
+            slot_number=p["slot_number"],
+            payment_amount=p["payment_amount"],
+            payment_time=p["payment_time"],
+            payment_type=p["payment_type"],
+            payment_status=p["payment_status"],
+            delivery_state=p["delivery_state"],
+            source_payload=p["source_payload"],
+            sync_status="pending",
+        )
+        for p in parsed if p["uuid"] not in existing
+    ]
+    if new_orders:
+        inserted = insert_orders(new_orders)
+        # orders another ingest stored first are neither rolled up nor counted
+        new_orders = [o for o in new_orders if o.uuid in inserted]
+    if new_orders:
+        OrderPayload.objects.bulk_create(OrderPayload.for_orders(new_orders), batch_size=500, ignore_conflicts=True)
+        apply_orders(new_orders)
+        touched = {(o.machine.number, timezone.localtime(o.payment_time).date()) for o in new_orders if o.machine}
+        transaction.on_commit(lambda: sales_cache.invalidate(touched), robust=True)
+    registry.flush()
+
+    latest = max((p["payment_time"] for p in parsed), default=None)
+    finished = time.monotonic()
+    metrics.observe("phase", finished - parsed_at, phase="upsert", account=label)
+    metrics.incr("orders", len(new_orders), account=label, result="inserted")
+    metrics.incr("orders", len(parsed) - len(new_orders), account=label, result="skipped")
+    if invalid:
+        metrics.incr("orders", invalid, account=label, result="invalid")
+    elapsed_ms = (finished - started) * 1000
+    return IngestResult(len(new_orders), len(parsed) - len(new_orders), invalid, latest, elapsed_ms)
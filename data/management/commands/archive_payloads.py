@@ -0,0 +1,66 @@
+# data/management/commands/archive_payloads.py
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from data.models import Order, OrderPayload
+from data.partitions import add_months, month_start
+from data.payloads import archive_dir, archive_path, write_archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move OrderPayload rows of orders older than --days into PAYLOAD_ARCHIVE_DIR "
+        "(one zip per local month, one member per uuid). Order.source_payload still reads them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=180, help="Archive payloads of orders paid more than this many days ago (default 180)")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Payloads read and deleted per batch (default 5000)")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived")
+        parser.add_argument("--show", metavar="UUID", help="Print the payload of one order (from the table or the archive) and exit")
+
+    def handle(self, *args, **opts):
+        if opts.get("show"):
+            order = Order.objects.filter(uuid=opts["show"]).first()
+            if order is None:
+                raise CommandError(f"no order with uuid {opts['show']}")
+            self.stdout.write(json.dumps(order.source_payload, ensure_ascii=False, indent=2))
+            return
+
+        cutoff = timezone.now() - timedelta(days=max(0, opts["days"]))
+        due = OrderPayload.objects.filter(order__payment_time__lt=cutoff)
+        if opts["dry_run"]:
+            self.stdout.write(f"[DRY RUN] {due.count()} payload(s) older than {cutoff:%Y-%m-%d} would go to {archive_dir()}")
+            return
+
+        batch_size = max(1, opts["batch_size"])
+        archived = 0
+        # month by month, so each month's zip is rewritten once however many rows it gets
+        first = due.aggregate(first=Min("order__payment_time"))["first"]
+        while first is not None:
+            month = month_start(first)
+            end = add_months(month, 1)
+            uuids = []
+            rows = self._rows(due.filter(order__payment_time__gte=month, order__payment_time__lt=end), uuids, batch_size)
+            # the file is written and fsynced before the rows go
+            added = write_archive(archive_path(month), rows)
+            for i in range(0, len(uuids), batch_size):
+                with transaction.atomic():
+                    OrderPayload.objects.filter(order_id__in=uuids[i:i + batch_size]).delete()
+            archived += len(uuids)
+            self.stdout.write(f"  [ARCHIVE] {month:%Y-%m}: {len(uuids)} payload(s) moved ({added} new in the zip)")
+            first = due.filter(order__payment_time__gte=end).aggregate(first=Min("order__payment_time"))["first"]
+
+        self.stdout.write(self.style.SUCCESS(f"[OK] {archived} payload(s) older than {cutoff:%Y-%m-%d} archived to {archive_dir()}"))
+
+    @staticmethod
+    def _rows(qs, uuids, batch_size):
+        """(uuid, packed bytes) of `qs`, streamed; every uuid read is appended to `uuids`."""
+        for uuid, data in qs.order_by("order_id").values_list("order_id", "data").iterator(chunk_size=batch_size):
+            uuids.append(uuid)
+            yield uuid, data
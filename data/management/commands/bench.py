@@ -0,0 +1,441 @@
+# data/management/commands/bench.py
+import io
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from data import synthetic
+from data.admin import OrderAdmin
+from data.dates import parse_date_range, payment_time_filter
+from data.ingest import MachineRegistry, ingest_page
+from data.metrics import metrics
+from data.models import xy_account as XYAccount, Order, OrderPayload, SHIPPED_STATE
+from data.payloads import order_values, unpack
+from data.outbound import push_queue
+from data.serializers import OrderSerializer, OrderReadSerializer
+from data.stubs import XYStubServer
+
+
+def _timed(fn, repeat):
+    """Median and max wall time of fn() in ms over `repeat` runs (after one warm-up)."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def _percentile(samples, p):
+    """Nearest-rank percentile of `samples` (p in 0..100)."""
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))]
+
+
+def _sizes(value):
+    try:
+        sizes = sorted(int(v.replace("_", "")) for v in value.split(",") if v.strip())
+    except ValueError:
+        raise CommandError(f"--orders must be comma separated integers, got {value!r}")
+    if not sizes:
+        raise CommandError("--orders needs at least one size")
+    return sizes
+
+
+class Command(BaseCommand):
+    help = "Query benchmarks against seeded synthetic orders (see data/synthetic.py)."
+
+    def add_arguments(self, parser):
+        sub = parser.add_subparsers(dest="bench", required=True)
+
+        p = sub.add_parser("date-filters", help="payment_time__date casts vs half-open aware bounds: EXPLAIN + timings")
+        self._seed_arguments(p)
+        p.add_argument("--days", type=int, default=7, help="Width of the queried range in days (default 7)")
+
+        p = sub.add_parser("query-plans", help="Check that the view and sync queries use the Order indexes; fails otherwise")
+        self._seed_arguments(p)
+        p.set_defaults(orders=50000)
+
+        p = sub.add_parser("serializers", help="Bytes and ms per --rows rows: full OrderSerializer vs lean OrderReadSerializer")
+        self._seed_arguments(p)
+        p.add_argument("--rows", type=int, default=10000, help="Rows serialized per run (default 10000)")
+
+        p = sub.add_parser("storage", help="data_order / payload table sizes, payload compression and a full data_order scan")
+        self._seed_arguments(p)
+        p.add_argument("--sample", type=int, default=2000, help="Payloads sampled for the compression ratio (default 2000)")
+
+        p = sub.add_parser("ingest", help="Orders/sec through ingest_page for generated XY rows (fresh, then all duplicates)")
+        self._xy_arguments(p)
+
+        p = sub.add_parser("sync", help="Full sync_orders cycles against a local fake XY API: cycle latency, orders/sec, phases")
+        self._xy_arguments(p)
+        p.add_argument("--mode", choices=("range", "cursor", "both"), default="both", help="range: sync_orders --start/--end over all --days; cursor: sync from the account's cursor with new rows between cycles (default both)")
+        p.add_argument("--cycles", type=int, default=3, help="Cycles per mode; in range mode the first inserts and later ones re-fetch (default 3)")
+        p.add_argument("--step-minutes", type=int, default=60, help="Cursor mode: minutes of new rows the API gains before each later cycle (default 60)")
+        p.add_argument("--workers", type=int, default=1, help="sync_orders --workers (default 1)")
+        p.add_argument("--empty-rate", type=float, default=0.0, help="Fraction of pages the fake API answers empty (default 0)")
+        p.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every fake API request (default 0)")
+
+        p = sub.add_parser("api", help="p50/p99 of the three /api/ endpoints at each --orders size")
+        p.add_argument("--orders", default="10000,100000,1000000", help="Comma separated dataset sizes, seeded incrementally (default 10000,100000,1000000)")
+        p.add_argument("--machines", type=int, default=50, help="Bench machines (default 50)")
+        p.add_argument("--history-days", type=int, default=365, help="Spread seeded orders over this many days (default 365)")
+        p.add_argument("--requests", type=int, default=200, help="Requests per endpoint and size (default 200)")
+        p.add_argument("--days", type=int, default=30, help="Width of each requested date range (default 30)")
+        p.add_argument("--fleet", type=int, default=20, help="machine_numbers per machines-total-sales request (default 20)")
+        p.add_argument("--limit", type=int, default=100, help="sales-report page size, 0 = unpaginated list (default 100)")
+        p.add_argument("--cache", action="store_true", help="Keep the sales totals cache on (default: measure the database path)")
+        p.add_argument("--seed", type=int, default=0, help="Random seed for the requests (default 0)")
+
+        p = sub.add_parser("search", help="Admin order search: Django's default icontains search vs OrderAdmin's, per kind of term")
+        self._seed_arguments(p)
+
+        sub.add_parser("clear", help="Remove the synthetic bench data")
+
+    def _xy_arguments(self, p):
+        p.add_argument("--machines", type=int, default=50, help="Machines in the generated rows (default 50)")
+        p.add_argument("--days", type=int, default=30, help="Days of generated rows up to now (default 30)")
+        p.add_argument("--per-day", type=int, default=20, help="Average orders per machine and day (default 20)")
+        p.add_argument("--page-size", type=int, default=100, help="Rows per page (default 100)")
+        p.add_argument("--seed", type=int, default=0, help="Random seed for the rows (default 0)")
+
+    def _seed_arguments(self, p):
+        p.add_argument("--orders", type=int, default=200000, help="Seed the bench account up to this many orders (default 200000)")
+        p.add_argument("--machines", type=int, default=50, help="Bench machines (default 50)")
+        p.add_argument("--history-days", type=int, default=365, help="Spread seeded orders over this many days (default 365)")
+        p.add_argument("--repeat", type=int, default=5, help="Timed runs per query (default 5)")
+
+    def handle(self, *args, **opts):
+        getattr(self, "bench_" + opts["bench"].replace("-", "_"))(opts)
+
+    # ---- helpers ----
+    def _seed(self, opts):
+        added = synthetic.seed_orders(
+            opts["orders"], machines=opts["machines"], days=opts["history_days"], log=self.stdout.write,
+        )
+        if added:
+            with connection.cursor() as cur:
+                cur.execute("ANALYZE")
+        self.stdout.write(f"[SEED] {Order.objects.count()} orders in table ({added} added)")
+
+    def _xy_rows(self, opts):
+        """Clear the bench data and generate raw XY rows for it."""
+        synthetic.clear()
+        rows = list(synthetic.xy_rows(opts["machines"], opts["days"], opts["per_day"], seed=opts["seed"]))
+        self.stdout.write(f"[ROWS] {len(rows)} XY rows, {opts['machines']} machines x {opts['days']} days")
+        return rows
+
+    def _latencies(self, label, samples, errors=0):
+        self.stdout.write(
+            f"-- {label}: p50 {_percentile(samples, 50):.1f} ms, p99 {_percentile(samples, 99):.1f} ms, "
+            f"mean {statistics.mean(samples):.1f} ms, max {max(samples):.1f} ms"
+            + (self.style.ERROR(f", {errors} error(s)") if errors else "")
+        )
+
+    def _explain(self, qs):
+        opts = {"analyze": True} if connection.vendor == "postgresql" else {}
+        return qs.explain(**opts)
+
+    def _compare(self, label, variants, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"== {label}"))
+        for name, qs in variants:
+            med, worst = _timed(lambda: qs.count(), repeat)
+            self.stdout.write(f"-- {name}: median {med:.1f} ms, max {worst:.1f} ms, rows {qs.count()}")
+            for line in self._explain(qs).splitlines():
+                self.stdout.write(f"   {line}")
+
+    # ---- benchmarks ----
+    def bench_date_filters(self, opts):
+        self._seed(opts)
+        end_date = timezone.localdate()
+        start_date = end_date - timedelta(days=opts["days"] - 1)
+        date_range = parse_date_range(start_date.isoformat(), end_date.isoformat())
+        number = "BENCH-0000"
+
+        cast = {"payment_time__date__gte": start_date, "payment_time__date__lte": end_date}
+        bounds = payment_time_filter(date_range)
+        self._compare(f"all machines, {start_date} → {end_date}", [
+            ("payment_time__date (cast)", Order.objects.filter(**cast)),
+            ("half-open bounds", Order.objects.filter(**bounds)),
+        ], opts["repeat"])
+        self._compare(f"sales report for {number}", [
+            ("payment_time__date (cast)", Order.objects.filter(machine__number=number, **cast).order_by("-payment_time")),
+            ("half-open bounds", Order.objects.filter(machine__number=number, **bounds).order_by("-payment_time")),
+        ], opts["repeat"])
+
+    def bench_query_plans(self, opts):
+        self._seed(opts)
+        date_range = parse_date_range((timezone.localdate() - timedelta(days=6)).isoformat(), timezone.localdate().isoformat())
+        bounds = payment_time_filter(date_range)
+        number = "BENCH-0000"
+        now = timezone.now()
+
+        # (name, queryset, index that must appear in its plan, vendors the check applies to)
+        checks = [
+            ("sales report (machine + range)",
+             Order.objects.filter(machine__number=number, **bounds).order_by("-payment_time"),
+             "order_machine_paytime_idx", None),
+            ("shipped sales sum (machine + range + state)",
+             Order.objects.filter(machine__number=number, delivery_state=SHIPPED_STATE, **bounds).values_list("payment_amount"),
+             "order_shipped_sales_idx", None),
+            ("push queue (pending/failed by next_retry_at)",
+             push_queue(now)[:100],
+             # SQLite only matches an IN partial-index predicate against literals, not bound parameters
+             "order_push_queue_idx", ("postgresql",)),
+        ]
+        failed = []
+        for name, qs, index, vendors in checks:
+            if vendors and connection.vendor not in vendors:
+                self.stdout.write(self.style.WARNING("[SKIP] ") + f"{name}: {index} is not usable on {connection.vendor}")
+                continue
+            plan = self._explain(qs)
+            ok = index in plan
+            med, _ = _timed(lambda: list(qs.all()), opts["repeat"])
+            self.stdout.write((self.style.SUCCESS("[OK]  ") if ok else self.style.ERROR("[BAD] ")) + f"{name}: {index} ({med:.1f} ms)")
+            if not ok:
+                failed.append(name)
+                for line in plan.splitlines():
+                    self.stdout.write(f"   {line}")
+        if failed:
+            raise CommandError(f"{len(failed)} query plan(s) do not use their index: {', '.join(failed)}")
+
+    def bench_serializers(self, opts):
+        self._seed(opts)
+        base = Order.objects.filter(uuid__startswith=synthetic.UUID_PREFIX).order_by("-payment_time", "-id")
+        rows = opts["rows"]
+        renderer = JSONRenderer()
+        lean = list(OrderReadSerializer.DEFAULT_FIELDS)
+        expanded = lean + ["source_payload"]
+
+        variants = [
+            ("OrderSerializer (__all__, before)", lambda: OrderSerializer(base.prefetch_related("payload")[:rows], many=True).data),
+            ("OrderReadSerializer default", lambda: OrderReadSerializer(
+                OrderReadSerializer.optimize(base, lean)[:rows], many=True, fields=lean).data),
+            ("OrderReadSerializer expand=source_payload", lambda: OrderReadSerializer(
+                OrderReadSerializer.optimize(base, expanded)[:rows], many=True, fields=expanded).data),
+        ]
+        self.stdout.write(self.style.MIGRATE_HEADING(f"== {rows} rows, query + serialize + render"))
+        for name, build in variants:
+            size = len(renderer.render(build()))
+            med, worst = _timed(lambda: renderer.render(build()), opts["repeat"])
+            self.stdout.write(f"-- {name}: median {med:.0f} ms, max {worst:.0f} ms, {size / 1024:.0f} KiB")
+
+    def _table_bytes(self, table):
+        with connection.cursor() as cur:
+            if connection.vendor == "postgresql":
+                cur.execute("SELECT pg_relation_size(%s), pg_total_relation_size(%s)", [table, table])
+                return cur.fetchone()
+            if connection.vendor == "sqlite":
+                cur.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s", [table])
+                return cur.fetchone()[0] or 0, None
+        return None, None
+
+    def bench_storage(self, opts):
+        self._seed(opts)
+        self.stdout.write(self.style.MIGRATE_HEADING("== table sizes"))
+        for model in (Order, OrderPayload):
+            table = model._meta.db_table
+            heap, total = self._table_bytes(table)
+            if heap is None:
+                self.stdout.write(f"-- {table}: size not available on {connection.vendor}")
+                continue
+            self.stdout.write(f"-- {table}: {model.objects.count()} rows, {heap / 2**20:.1f} MiB"
+                              + (f" ({total / 2**20:.1f} MiB with indexes and TOAST)" if total else ""))
+
+        payloads = list(OrderPayload.objects.select_related("order")[:opts["sample"]])
+        if payloads:
+            raw = sum(len(JSONRenderer().render(unpack(p.data, order_values(p.order)))) for p in payloads)
+            packed = sum(len(p.data) for p in payloads)
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {len(payloads)} sampled payloads"))
+            self.stdout.write(f"-- raw JSON {raw / len(payloads):.0f} B, packed {packed / len(payloads):.0f} B per order ({raw / packed:.1f}x)")
+
+        scan = Order.objects.filter(product_name__contains="~")  # no index: reads every row
+        med, worst = _timed(lambda: scan.count(), opts["repeat"])
+        self.stdout.write(self.style.MIGRATE_HEADING("== full data_order scan"))
+        self.stdout.write(f"-- median {med:.1f} ms, max {worst:.1f} ms")
+
+    def bench_ingest(self, opts):
+        rows = self._xy_rows(opts)
+        account, _ = XYAccount.objects.get_or_create(username=synthetic.BENCH_ACCOUNT, defaults={"password": ""})
+        size = opts["page_size"]
+        pages = [rows[i:i + size] for i in range(0, len(rows), size)]
+
+        for label in ("fresh rows", "already stored (overlap re-fetch)"):
+            registry = MachineRegistry(account).load()
+            samples, inserted, skipped = [], 0, 0
+            started = time.perf_counter()
+            for page in pages:
+                res = ingest_page(page, account, registry)
+                samples.append(res.elapsed_ms)
+                inserted += res.inserted
+                skipped += res.skipped
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== ingest_page, {label}"))
+            self.stdout.write(f"-- {len(rows)} rows in {elapsed:.2f} s: {len(rows) / elapsed:.0f} orders/s "
+                              f"(inserted {inserted}, skipped {skipped})")
+            self._latencies(f"per {size}-row page", samples)
+
+    def bench_sync(self, opts):
+        rows = self._xy_rows(opts)
+        server = XYStubServer(accounts={synthetic.BENCH_ACCOUNT: "bench"}, empty_rate=opts["empty_rate"],
+                              latency=opts["latency_ms"] / 1000, seed=opts["seed"]).start()
+        try:
+            with override_settings(XY_BASE_URL=server.url):
+                if opts["mode"] in ("range", "both"):
+                    self._sync_range(server, rows, opts)
+                if opts["mode"] in ("cursor", "both"):
+                    self._sync_cursor(server, rows, opts)
+        finally:
+            server.stop()
+        self.stdout.write(f"[STUB] {len(server.requests)} requests, {server.empties} transient empty page(s)")
+
+    def _bench_account(self):
+        account, _ = XYAccount.objects.get_or_create(username=synthetic.BENCH_ACCOUNT, defaults={"password": "bench"})
+        if account.password != "bench":
+            account.password = "bench"
+            account.save(update_fields=["password"])
+        return account
+
+    def _sync_args(self, account, opts):
+        return [
+            "--once", "--account", account.username, "--page-delay", "0", "--page-size", str(opts["page_size"]),
+            "--workers", str(opts["workers"]),
+        ]
+
+    def _sync_range(self, server, rows, opts):
+        """Every cycle re-fetches the whole --days range (--start/--end): the first inserts, later ones skip."""
+        server.set_rows(rows)
+        today = timezone.localdate()
+        args = self._sync_args(self._bench_account(), opts) + [
+            "--start", (today - timedelta(days=opts["days"])).isoformat(), "--end", today.isoformat(),
+        ]
+        for cycle in range(1, opts["cycles"] + 1):
+            metrics.reset()
+            started = time.perf_counter()
+            call_command("sync_orders", *args, stdout=io.StringIO(), stderr=io.StringIO())
+            self._report_cycle(f"range cycle {cycle}", time.perf_counter() - started, len(rows) if cycle == 1 else 0)
+
+    def _sync_cursor(self, server, rows, opts):
+        """
+        Steady-state sync from the account's cursor: the rows of the last (cycles - 1)
+        --step-minutes are held back and one step more reaches the API before each
+        following cycle, like orders arriving between runs.
+        """
+        synthetic.clear()
+        args = self._sync_args(self._bench_account(), opts)
+        step = timedelta(minutes=max(1, opts["step_minutes"]))
+        now = timezone.localtime()
+        shown = 0
+        for cycle in range(1, opts["cycles"] + 1):
+            # zfsj is local "%Y-%m-%d %H:%M:%S", so it compares like the time
+            cut = (now - step * (opts["cycles"] - cycle)).strftime("%Y-%m-%d %H:%M:%S")
+            visible = [r for r in rows if r["zfsj"] <= cut]
+            server.set_rows(visible)
+            arriving, shown = len(visible) - shown, len(visible)
+            metrics.reset()
+            started = time.perf_counter()
+            call_command("sync_orders", *args, stdout=io.StringIO(), stderr=io.StringIO())
+            self._report_cycle(f"cursor cycle {cycle}", time.perf_counter() - started, arriving)
+
+    def _report_cycle(self, title, elapsed, expected):
+        """One cycle's timings from the metrics; `expected` is how many of its rows were new."""
+        snap = metrics.snapshot()
+        counts = {}
+        for c in snap["counters"]:
+            key = c["labels"].get("result") or c["labels"].get("outcome") or ""
+            counts[(c["name"], key)] = counts.get((c["name"], key), 0) + c["value"]
+        processed = counts.get(("orders", "inserted"), 0) + counts.get(("orders", "skipped"), 0)
+        failed = counts.get(("chunks", "failed"), 0)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"== {title}"))
+        self.stdout.write(
+            f"-- {elapsed:.2f} s, {processed} rows ({processed / elapsed:.0f} orders/s), "
+            f"inserted {counts.get(('orders', 'inserted'), 0)}/{expected} new, requests {counts.get(('requests', ''), 0)}, "
+            f"chunks {counts.get(('chunks', 'ok'), 0)}"
+            + (self.style.ERROR(f" + {failed} failed") if failed else "")
+        )
+        phases = {}
+        for t in snap["timers"]:
+            if t["name"] == "phase":
+                phases[t["labels"]["phase"]] = phases.get(t["labels"]["phase"], 0) + t["sum"]
+        if phases:
+            self.stdout.write("   phases: " + ", ".join(f"{k} {v:.2f} s" for k, v in sorted(phases.items(), key=lambda kv: -kv[1])))
+
+    def bench_api(self, opts):
+        caches = settings.CACHES
+        if not opts["cache"]:
+            caches = {**caches, "sales": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+        rng = random.Random(opts["seed"])
+        client = Client()
+        numbers = synthetic.machine_numbers(opts["machines"])
+        span = max(0, opts["history_days"] - opts["days"])
+
+        def date_params():
+            start = timezone.localdate() - timedelta(days=opts["days"] - 1 + rng.randint(0, span))
+            return {"start_date": start.isoformat(), "end_date": (start + timedelta(days=opts["days"] - 1)).isoformat()}
+
+        def report_params():
+            params = {"machine_number": rng.choice(numbers), **date_params()}
+            if opts["limit"]:
+                params["limit"] = opts["limit"]
+            return params
+
+        endpoints = [
+            ("GET total-sales", lambda: client.get("/api/total-sales/", {"machine_number": rng.choice(numbers), **date_params()})),
+            (f"POST machines-total-sales ({opts['fleet']} machines)", lambda: client.post(
+                "/api/machines-total-sales/",
+                {"machine_numbers": rng.sample(numbers, min(opts["fleet"], len(numbers))), **date_params()},
+                content_type="application/json")),
+            (f"GET sales-report ({'limit=%d' % opts['limit'] if opts['limit'] else 'full list'})",
+             lambda: client.get("/api/sales-report/", report_params())),
+        ]
+
+        with override_settings(CACHES=caches):
+            for size in _sizes(opts["orders"]):
+                self._seed({**opts, "orders": size})
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"== {size} orders, {opts['requests']} requests per endpoint, {opts['days']}-day ranges"
+                    + ("" if opts["cache"] else ", sales cache off")))
+                for label, call in endpoints:
+                    call()  # warm-up
+                    samples, errors = [], 0
+                    for _ in range(opts["requests"]):
+                        t0 = time.perf_counter()
+                        response = call()
+                        samples.append((time.perf_counter() - t0) * 1000)
+                        errors += response.status_code != 200
+                    self._latencies(label, samples, errors)
+
+    def bench_search(self, opts):
+        self._seed(opts)
+        order_admin = OrderAdmin(Order, admin.site)
+        n = opts["orders"] // 2
+        terms = [
+            ("exact uuid", f"{synthetic.UUID_PREFIX}{n}"),
+            ("source order no", f"B{n}"),
+            ("machine number", "BENCH-0007"),
+            ("product words", "bench item"),
+            ("no match", "zz-nothing-9"),
+        ]
+        if connection.vendor != "postgresql":
+            self.stdout.write("(not PostgreSQL: no pg_trgm indexes here, only the ID lookups and the machine subquery differ)")
+        for label, term in terms:
+            base = Order.objects.order_by("-pk")
+            self._compare(f"{label}: {term!r}", [
+                ("default search", admin.ModelAdmin.get_search_results(order_admin, None, base, term)[0]),
+                ("OrderAdmin search", order_admin.get_search_results(None, base, term)[0]),
+            ], opts["repeat"])
+
+    def bench_clear(self, opts):
+        synthetic.clear()
+        self.stdout.write(self.style.SUCCESS("[OK] bench data removed"))
@@ -0,0 +1,81 @@
+# data/management/commands/partition_orders.py
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from data import partitions
+from data.dates import DateRangeError, parse_date_range, payment_time_filter
+from data.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "PostgreSQL only: month range partitioning of data_order on payment_time. "
+        "convert once, then run ensure (e.g. daily) and detach (e.g. monthly) from cron."
+    )
+
+    def add_arguments(self, parser):
+        sub = parser.add_subparsers(dest="action", required=True)
+
+        p = sub.add_parser("convert", help="Rebuild data_order as a partitioned table (locks it for the copy; run it in a quiet window)")
+        p.add_argument("--ahead", type=int, default=3, help="Also create partitions for this many future months (default 3)")
+
+        p = sub.add_parser("ensure", help="Create the partitions of this month and the next --ahead months")
+        p.add_argument("--ahead", type=int, default=3, help="Future months to pre-create (default 3)")
+
+        p = sub.add_parser("detach", help="Detach (or archive and drop) the partitions older than --months")
+        p.add_argument("--months", type=int, default=12, help="Keep this month and the previous N-1 months attached (default 12)")
+        p.add_argument("--archive-dir", help="Write each detached partition to <dir>/<name>.csv.gz, move its payloads to the payload archive and drop it")
+        p.add_argument("--dry-run", action="store_true", help="Only list what would be detached")
+
+        p = sub.add_parser("status", help="List the partitions and show which ones a sales-report query scans")
+        p.add_argument("--start-date", help="Report range start, YYYY-MM-DD (default: 7 days ago)")
+        p.add_argument("--end-date", help="Report range end, YYYY-MM-DD (default: today)")
+
+    def handle(self, *args, **opts):
+        if connection.vendor != "postgresql":
+            raise CommandError(f"partition_orders needs PostgreSQL (this database is {connection.vendor})")
+        if opts["action"] != "convert" and not partitions.is_partitioned():
+            raise CommandError("data_order is not partitioned yet; run `partition_orders convert` first")
+        getattr(self, "do_" + opts["action"])(opts)
+
+    def do_convert(self, opts):
+        if partitions.is_partitioned():
+            raise CommandError("data_order is already partitioned")
+        partitions.convert(ahead=max(0, opts["ahead"]), log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS("[OK] data_order converted"))
+
+    def do_ensure(self, opts):
+        created = partitions.ensure(ahead=max(0, opts["ahead"]), log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"[OK] {len(created)} partition(s) created"))
+
+    def do_detach(self, opts):
+        before = partitions.add_months(partitions.month_start(timezone.now()), 1 - max(1, opts["months"]))
+        if opts["dry_run"]:
+            due = [name for name, month, _ in partitions.partitions() if month is not None and partitions.add_months(month, 1) <= before]
+            self.stdout.write(f"[DRY RUN] {len(due)} partition(s) before {before:%Y-%m}: {', '.join(due) or '-'}")
+            return
+        done = partitions.detach(before, archive_dir=opts.get("archive_dir"), log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"[OK] {len(done)} partition(s) before {before:%Y-%m} detached"))
+
+    def do_status(self, opts):
+        for name, month, rows in partitions.partitions():
+            self.stdout.write(f"  {name:<28} {'default' if month is None else f'{month:%Y-%m}':>8} ~{rows} rows")
+
+        today = timezone.localdate()
+        try:
+            date_range = parse_date_range(
+                opts.get("start_date") or (today - timedelta(days=7)).isoformat(),
+                opts.get("end_date") or today.isoformat(),
+            )
+        except DateRangeError as exc:
+            raise CommandError(str(exc))
+        # the same filter SalesReportView applies
+        plan = Order.objects.filter(**payment_time_filter(date_range)).order_by("-payment_time", "-id").explain()
+        scanned = sorted(set(re.findall(rf"\b({partitions.PARENT}_(?:p\d{{4}}_\d{{2}}|default))\b", plan)))
+        self.stdout.write(
+            f"[PLAN] {date_range.start_date} → {date_range.end_date} scans {len(scanned)} partition(s): {', '.join(scanned) or '-'}"
+        )
@@ -0,0 +1,114 @@
+# data/management/commands/push_orders.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from data.dates import DateRangeError, local_day_bounds, parse_date
+from data.odoo_client import OdooClient
+from data.outbound import GROUP_BY, claim_batch, push, record_results, renew_lease
+from data.retry import RetryPolicy
+
+
+class Command(BaseCommand):
+    help = "Push pending/failed orders to Odoo (create_order_by_name), many per request. Workers claim batches with SELECT ... FOR UPDATE SKIP LOCKED, oldest next_retry_at first; failures are retried with exponential backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit (no loop)")
+        parser.add_argument("--workers", type=int, default=4, help="Parallel push workers (default 4)")
+        parser.add_argument("--batch-size", type=int, default=50, help="Orders claimed per batch (default 50)")
+        parser.add_argument("--interval", type=int, default=10, help="Seconds to wait when the queue is empty (default 10)")
+        parser.add_argument("--push-size", type=int, default=50, help="Orders per Odoo request (default 50; 1 = one request per order)")
+        parser.add_argument("--group-by", choices=GROUP_BY, default="machine", help="Build requests per machine or in payment_time order (default machine)")
+        parser.add_argument("--lease", type=int, default=300, help="Seconds a claimed batch stays invisible to other workers (default 300)")
+        parser.add_argument("--max-attempts", type=int, default=8, help="Attempts before an order is marked error (default 8)")
+        parser.add_argument("--retry-base", type=float, default=30, help="First retry delay in seconds, doubled per attempt (default 30)")
+        parser.add_argument("--retry-max", type=float, default=3600, help="Largest retry delay in seconds (default 3600)")
+        window = parser.add_mutually_exclusive_group()
+        window.add_argument("--days", type=int, default=7, help="Only push orders paid in the last N days (default 7)")
+        window.add_argument("--since", type=str, help="Only push orders paid on or after this local date (YYYY-MM-DD)")
+        window.add_argument("--all", action="store_true", help="Push the whole pending history, however old")
+        parser.add_argument("--machine", action="append", dest="machines", help="Only push orders of this machine number (repeatable)")
+        parser.add_argument("--base-url", type=str, help="Odoo base URL (default ODOO_BASE_URL)")
+
+    def handle(self, *args, **opts):
+        self.client = OdooClient(base_url=opts.get("base_url"))
+        self.retry = RetryPolicy(base_delay=opts["retry_base"], max_delay=opts["retry_max"])
+        self.max_attempts = max(1, opts["max_attempts"])
+        self.batch_size = max(1, opts["batch_size"])
+        self.lease = max(1, opts["lease"])
+        self.machines = opts.get("machines")
+        self.push_size = max(1, opts["push_size"])
+        self.group_by = opts["group_by"]
+        self.since = self._since(opts)
+        workers = max(1, opts["workers"])
+        self.db_lock = threading.Lock()  # SQLite has one writer and no row locks: serialize queue writes there
+        self.totals = {"sent": 0, "failed": 0, "error": 0}
+        self.totals_lock = threading.Lock()
+
+        window = f"paid since {self.since:%Y-%m-%d %H:%M}" if self.since else "all pending history"
+        self.stdout.write(self.style.SUCCESS(f"--- Odoo order push ({self.client.base_url}, {workers} workers, {window}) ---"))
+
+        while True:
+            try:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="push") as pool:
+                    pushed = sum(pool.map(lambda _: self._drain(), range(workers)))
+                self.stdout.write(self.style.SUCCESS(
+                    f"[OK] pass complete: {pushed} pushed, sent={self.totals['sent']} failed={self.totals['failed']} error={self.totals['error']}"
+                ))
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"[ERR] {e}"))
+                pushed = 0
+            finally:
+                connection.close()
+
+            if opts.get("once"):
+                break
+            if not pushed:
+                time.sleep(opts["interval"])
+
+        self.client.close()
+
+    def _since(self, opts):
+        """Start of the pushed window: --since, else --days back from now; None with --all."""
+        if opts.get("all"):
+            return None
+        if opts.get("since"):
+            try:
+                day = parse_date(opts["since"], "--since")
+            except DateRangeError as e:
+                raise CommandError(str(e))
+            return local_day_bounds(day, day)[0]
+        return timezone.now() - timedelta(days=max(0, opts["days"]))
+
+    def _locked(self, fn, *args):
+        if connection.vendor == "sqlite":
+            with self.db_lock:
+                return fn(*args)
+        return fn(*args)
+
+    def _drain(self):
+        """Worker loop: claim, push, record until nothing is due. Returns orders handled."""
+        handled = 0
+        try:
+            while True:
+                batch = self._locked(claim_batch, self.batch_size, self.lease, self.machines, self.since)
+                if not batch:
+                    return handled
+                results = push(
+                    self.client, batch, self.push_size, self.group_by,
+                    lease=self.lease, renew=lambda group, lease: self._locked(renew_lease, group, lease),
+                )
+                sent, failed, error = self._locked(record_results, results, self.retry, self.max_attempts, self.client.order_path)
+                handled += len(batch)
+                with self.totals_lock:
+                    self.totals["sent"] += sent
+                    self.totals["failed"] += failed
+                    self.totals["error"] += error
+                self.stdout.write(f"  [PUSH] {threading.current_thread().name}: batch={len(batch)} sent={sent} failed={failed} error={error}")
+        finally:
+            connections.close_all()
@@ -0,0 +1,60 @@
+# data/management/commands/rebuild_sales_rollup.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from data import cache as sales_cache
+from data.dates import DateRangeError, parse_date
+from data.models import machine as Machine, Order
+from data.rollup import rebuild
+
+
+def _parse_date(value, name):
+    try:
+        return parse_date(value, f"--{name}")
+    except DateRangeError as e:
+        raise CommandError(str(e))
+
+
+class Command(BaseCommand):
+    help = "Recompute the DailyMachineSales rollup from orders for a date range (default: all history)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=str, help="First local day YYYY-MM-DD (default: oldest order)")
+        parser.add_argument("--end", type=str, help="Last local day YYYY-MM-DD (default: today)")
+        parser.add_argument("--machine", action="append", dest="machines", help="Machine number (repeatable); default all machines")
+        parser.add_argument("--step-days", type=int, default=31, help="Days rebuilt per transaction (default 31)")
+
+    def handle(self, *args, **opts):
+        end = _parse_date(opts["end"], "end") if opts.get("end") else timezone.localdate()
+        if opts.get("start"):
+            start = _parse_date(opts["start"], "start")
+        else:
+            oldest = Order.objects.aggregate(m=Min("payment_time"))["m"]
+            if oldest is None:
+                self.stdout.write("No orders; nothing to rebuild.")
+                return
+            start = timezone.localtime(oldest).date()
+        if start > end:
+            raise CommandError("--start is after --end")
+
+        machine_ids = None
+        if opts.get("machines"):
+            machine_ids = list(Machine.objects.filter(number__in=opts["machines"]).values_list("id", flat=True))
+            if not machine_ids:
+                raise CommandError("No matching machines")
+
+        step = timedelta(days=max(1, opts["step_days"]))
+        cur, written = start, 0
+        while cur <= end:
+            chunk_end = min(cur + step - timedelta(days=1), end)
+            n = rebuild(cur, chunk_end, machine_ids)
+            written += n
+            if n or opts["verbosity"] > 1:
+                self.stdout.write(f"  [ROLLUP] {cur} → {chunk_end}: {n} rows")
+            cur = chunk_end + timedelta(days=1)
+
+        sales_cache.invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f"[OK] rollup rebuilt {start} → {end}: {written} rows"))
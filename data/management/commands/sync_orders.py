@@ -1,195 +1,35 @@
-# data/management/commands/sync_xy_orders.py
-import os
+# data/management/commands/sync_orders.py
+import io
 import time
-import hashlib
-import requests
-from decimal import Decimal
+import cProfile
+import pstats
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from django.db import transaction, connection
+from django.db import connection
+from django.db.models import F, Q
 
-from data.models import xy_account as XYAccount, machine as Machine, Order  # adjust app label if different
+from data.models import xy_account as XYAccount, machine as Machine, Order, SyncCursor  # adjust app label if different
+from data.backfill import BulkLoader
+from data.ingest import MachineRegistry, ingest_page
+from data.xy_client import XYApiClient, AsyncXYApiClient, RateLimiter, AsyncRateLimiter, AsyncLoopThread, SessionCache
+from data.retry import RetryPolicy, CircuitBreaker, BudgetExceeded
+from data.chunker import AdaptiveChunker
+from data.metrics import metrics
 
 
-# -----------------------------
-# XY API client (login + orders)   (unchanged from previous message)
-# -----------------------------
-class XYApiClient:
-    BASE_URL = "https://xcx.xynetweb.com"
-    HEADERS = {
-        "Accept": "application/json, text/plain, */*",
-        "Origin": "https://www.xynetweb.com",
-        "Referer": "https://www.xynetweb.com/",
-        "Content-Type": "application/json;charset=UTF-8",
-    }
-
-    def __init__(self, username, password, logger):
-        self.username = username
-        self.password = password
-        self.session = requests.Session()
-        self.session.headers.update(self.HEADERS)
-        self.session_key = None
-        self.logger = logger
-
-    @staticmethod
-    def _md5(s: str) -> str:
-        return hashlib.md5(s.encode("utf-8")).hexdigest()
-
-    def _get_check_code(self):
-        url = f"{self.BASE_URL}/sram/comm/login/getCheckCode"
-        r = self.session.get(url, timeout=10)
-        r.raise_for_status()
-        j = r.json()
-        return j.get("data")
-
-    def authenticate(self) -> bool:
-        if self.session_key:
-            return True
-        try:
-            check_code = self._get_check_code()
-        except Exception as e:
-            self.logger(f"[AUTH] getCheckCode failed: {e}")
-            return False
-
-        try:
-            i1 = self._md5(self.username + self.password)
-            hashed_password = self._md5(self.username + i1 + str(check_code))
-            url = f"{self.BASE_URL}/sram/comm/login/onLogin"
-            payload = {
-                "password": hashed_password,
-                "account": self.username,
-                "checkCode": str(check_code),
-                "language": "en",
-                "channel": "1",
-            }
-            r = self.session.post(url, json=payload, timeout=15)
-            r.raise_for_status()
-            data = r.json()
-            if data.get("code") == "H0000" and data.get("data", {}).get("session_key"):
-                self.session_key = data["data"]["session_key"]
-                self.session.headers.update({"Authorization": self.session_key})
-                self.logger(f"[AUTH] OK for {self.username}")
-                return True
-            self.logger(f"[AUTH] Failed: {data.get('msg')} (code={data.get('code')})")
-            return False
-        except Exception as e:
-            self.logger(f"[AUTH] onLogin failed: {e}")
-            return False
-
-    def query_orders(self, start: str, end: str, page_num=1, page_size=100, shbh=None, userid=None):
-        """
-        Returns (rows, total).
-        Raises Exception if all retries fail.
-        """
-        max_retries = 5
-        base_delay = 5  # seconds
-        
-        for attempt in range(1, max_retries + 1):
-            if not self.authenticate():
-                self.logger(f"[ORDERS] Auth failed, retrying... ({attempt}/{max_retries})")
-                time.sleep(base_delay * attempt)
-                continue
-                
-            url = f"{self.BASE_URL}/service-order/ddxx/queryDdxx"
-            payload = {
-                "jyz": -1, "ycd": -1, "orderBy": "cjsj desc",
-                "pageNum": page_num, "pageSize": page_size,
-                "shmc": "", "zjzt": "", "ywlx": "", "queryType": 0,
-                "dsfshdh": "", "dsfjybh": "", "zfzt": "", "zffs": "", "zfzh": "",
-                "chzt": "", "starttime": start, "endtime": end,
-                "spxx": "", "language": "en", "channel": "1",
-            }
-            if shbh:
-                payload["shbh"] = shbh
-            if userid:
-                payload["userid"] = userid
-                
-            try:
-                r = self.session.post(url, json=payload, timeout=60)
-                r.raise_for_status()
-                data = r.json() or {}
-                
-                if data.get("code") != "H0000":
-                    msg = data.get("msg")
-                    code = data.get("code")
-                    self.logger(f"[ORDERS] API error: {msg} (code={code}). Retrying... ({attempt}/{max_retries})")
-                    time.sleep(base_delay * attempt)
-                    continue
-
-                block = data.get("data") or {}
-                rows = block.get("data") or block.get("list") or []
-                total = block.get("total") or len(rows)
-                # drop summary row ""
-                rows = [r for r in rows if r.get("shmc") != "本页小计"]
-                return rows, int(total)
-
-            except Exception as e:
-                self.logger(f"[ORDERS] Request failed: {e}. Retrying... ({attempt}/{max_retries})")
-                time.sleep(base_delay * attempt)
-        
-        raise Exception(f"Failed to query orders after {max_retries} attempts")
+# Everything a chunk fetch needs for one account (shared by its chunks).
+AccountFetch = namedtuple("AccountFetch", ["client", "breaker", "shbh", "userid"])
+# One fetch window; start/end are the strings sent to the API, expected = orders already stored in it.
+Chunk = namedtuple("Chunk", ["start_dt", "end_dt", "start", "end", "expected"])
 
 
 # -----------------------------
 # Helpers (UPDATED)
 # -----------------------------
-def _parse_decimal(v, default=Decimal("0")) -> Decimal:
-    try:
-        return Decimal(str(v))
-    except Exception:
-        return default
-
-def _parse_dt_strict_zfsj(zfsj: str):
-    """
-    Strictly parse zfsj as the payment_time.
-    If zfsj is missing or bad -> return None (we'll skip the row).
-    """
-    if not zfsj:
-        return None
-    s = str(zfsj).split(".")[0]
-    try:
-        dt = datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        return None
-    return timezone.make_aware(dt, timezone.get_current_timezone())
-
-def _extract_slot(row):
-    ext2 = row.get("extend2")
-    if isinstance(ext2, str) and ":" in ext2:
-        return ext2.split(":", 1)[1].strip()
-    return None
-
-def _extract_product_name(row):
-    ext2 = row.get("extend2")
-    if isinstance(ext2, str) and ":" in ext2:
-        return ext2.split(":", 1)[0].strip()
-    return "Unknown"
-
-def _payment_type(zffs):
-    s = (zffs or "").lower()
-    if s == "unionpay":
-        return "card"
-    return "cash" if s else None
-
-def _payment_status(showzfzt, zfzt):
-    if str(showzfzt).lower() == "paid":
-        return "paid"
-    if str(zfzt) in ("1", "paid"):
-        return "paid"
-    return "pending"
-
-def _seven_day_chunks(start_dt, end_dt):
-    """Yield (chunk_start, chunk_end) pairs covering [start_dt, end_dt), each <= 7 days,
-    starting from end_dt and going backwards to start_dt."""
-    cur = end_dt
-    while cur > start_dt:
-        prev = max(cur - timedelta(days=7), start_dt)
-        yield (prev, cur)
-        cur = prev
-
-
 def _three_months_ago():
     # simple 90-day window
     return timezone.now() - timedelta(days=30)
@@ -199,58 +39,169 @@ def _three_months_ago():
 # Command (UPDATED)
 # -----------------------------
 class Command(BaseCommand):
-    help = "Fetch XY orders using provider uuid. Uses zfsj only. Splits into 7-day windows from oldest non-broken machine last_order to now. Auto-mark broken machines."
+    async_runner = None  # AsyncLoopThread when --async
+    retry = RetryPolicy()
+    breakers = {}  # account pk -> CircuitBreaker, kept across cycles
+    breaker_opts = {}
+    fixed_chunks = False
+    max_window = timedelta(days=7)
+    online_window = timedelta(minutes=60)
+    registries = {}  # account pk -> MachineRegistry, rebuilt every cycle
+    page_delay = 2
+    usernames = None  # --account filter
+    loader = None  # BulkLoader when --backfill
+
+    help = "Fetch XY orders using provider uuid. Uses zfsj only. Fetches forward from each account's sync cursor in adaptive windows sized to ~one page (--backfill for historical ranges). Auto-mark broken machines."
 
     def add_arguments(self, parser):
         parser.add_argument("--page-size", type=int, default=100, help="Page size (default 100)")
+        parser.add_argument("--page-delay", type=float, default=2, help="Seconds between pages of a chunk in serial mode (default 2)")
+        parser.add_argument("--account", action="append", dest="accounts", help="Only sync this XY username (repeatable)")
         parser.add_argument("--once", action="store_true", help="Run once and exit (no loop)")
         parser.add_argument("--start", type=str, help="Start date YYYY-MM-DD")
         parser.add_argument("--end", type=str, help="End date YYYY-MM-DD")
+        parser.add_argument("--backfill", action="store_true", help="Fetch the historical --start/--end range once with bulk writes; sync cursors are left untouched")
+        parser.add_argument("--batch-rows", type=int, default=20000, help="Rows per bulk write in --backfill mode (default 20000)")
+        parser.add_argument("--overlap-minutes", type=int, default=60, help="Re-fetch this many minutes before the cursor to catch late rows (default 60)")
+        parser.add_argument("--workers", type=int, default=1, help="Fetch accounts/chunks with this many threads (default 1 = serial)")
+        parser.add_argument("--per-account", type=int, default=2, help="Max in-flight XY requests per account in concurrent mode (default 2)")
+        parser.add_argument("--rate", type=float, default=2.0, help="Max XY requests/sec across all accounts in concurrent mode (default 2)")
+        parser.add_argument("--async", action="store_true", dest="use_async", help="Concurrent mode on asyncio with pooled HTTP/2 connections kept across cycles")
+        parser.add_argument("--fixed-chunks", action="store_true", help="Always use 7-day windows instead of adaptive ones")
+        parser.add_argument("--max-window-days", type=int, default=7, help="Largest adaptive window in days (default 7)")
+        parser.add_argument("--cycle-budget", type=int, default=600, help="Max seconds per cycle; unfinished windows resume next cycle (default 600, 0 = unbounded)")
+        parser.add_argument("--online-minutes", type=int, default=60, help="A machine counts as online while its last order is this recent (default 60)")
+        parser.add_argument("--breaker-threshold", type=int, default=3, help="Consecutive failed chunks before an account is skipped (default 3)")
+        parser.add_argument("--breaker-cooldown", type=int, default=300, help="Seconds an account stays skipped once its breaker opens (default 300)")
+        parser.add_argument("--metrics-file", type=str, help="Write phase timers/counters after every cycle: Prometheus text for .prom/.txt, JSON otherwise")
+        parser.add_argument("--profile", action="store_true", help="Run one cycle under cProfile and print the top functions (implies --once)")
+        parser.add_argument("--profile-out", type=str, default="sync_orders.prof", help="Where --profile dumps its stats (default sync_orders.prof)")
 
     def handle(self, *args, **opts):
         page_size = int(opts.get("page_size") or 100)
         loop_forever = not opts.get("once")
         start_arg = opts.get("start")
         end_arg = opts.get("end")
+        overlap = timedelta(minutes=int(opts.get("overlap_minutes") or 0))
+        concurrency = {
+            "workers": max(1, int(opts.get("workers") or 1)),
+            "per_account": max(1, int(opts.get("per_account") or 1)),
+            "rate": float(opts.get("rate") or 2.0),
+        }
+        self.async_runner = AsyncLoopThread() if opts.get("use_async") else None
+        self.retry = RetryPolicy(budget=int(opts.get("cycle_budget") or 0) or None)
+        self.fixed_chunks = bool(opts.get("fixed_chunks"))
+        self.max_window = timedelta(days=max(1, int(opts.get("max_window_days") or 7)))
+        self.online_window = timedelta(minutes=max(1, int(opts.get("online_minutes") or 60)))
+        self.page_delay = max(0.0, float(opts.get("page_delay", 2) or 0))
+        self.usernames = opts.get("accounts") or None
+        self.breakers = {}
+        self.breaker_opts = {
+            "threshold": max(1, int(opts.get("breaker_threshold") or 1)),
+            "cooldown": int(opts.get("breaker_cooldown") or 0),
+        }
+
+        metrics_file = opts.get("metrics_file")
+        profiler = cProfile.Profile() if opts.get("profile") else None
+
+        if opts.get("backfill"):
+            if not start_arg:
+                raise CommandError("--backfill requires --start")
+            loop_forever = False
+        if profiler is not None:
+            loop_forever = False
 
-        self.stdout.write(self.style.SUCCESS("--- XY Orders sync (7-day chunks, zfsj-only) ---"))
+        self.stdout.write(self.style.SUCCESS("--- XY Orders sync (adaptive chunks, zfsj-only) ---"))
 
         def log(msg):  # tiny logger
             self.stdout.write(f"  {msg}")
 
+        # --backfill: pages are staged and written in bulk batches (data/backfill.py)
+        self.loader = BulkLoader(max(1, int(opts.get("batch_rows") or 20000)), registry=self._registry, log=log) if opts.get("backfill") else None
+
         while True:
+            self.registries = {}
+            started = time.monotonic()
+            outcome = "ok"
+            if profiler is not None:
+                profiler.enable()
             try:
-                self._run_cycle(page_size, log, start_arg, end_arg)
+                try:
+                    self._run_cycle(page_size, log, start_arg, end_arg, overlap, **concurrency)
+                finally:
+                    # a failed cycle still writes what it staged and refreshes last_order / rollup / cache
+                    if self.loader is not None:
+                        self.loader.finish()
                 self.stdout.write(self.style.SUCCESS("[OK] cycle complete"))
             except Exception as e:
+                outcome = "error"
                 self.stderr.write(self.style.ERROR(f"[ERR] {e}"))
             finally:
+                if profiler is not None:
+                    profiler.disable()
                 connection.close()
+            self._cycle_metrics(time.monotonic() - started, outcome, metrics_file)
 
             if loop_forever:
                 time.sleep(30)
             else:
                 break
 
+        if self.async_runner is not None:
+            self.async_runner.close()
+        if profiler is not None:
+            self._report_profile(profiler, opts.get("profile_out"))
+
+    def _cycle_metrics(self, seconds, outcome, path):
+        metrics.incr("cycles", outcome=outcome)
+        metrics.observe("cycle", seconds)
+        metrics.gauge("last_cycle_seconds", round(seconds, 3))
+        metrics.gauge("last_cycle_timestamp", int(time.time()))
+        if path:
+            try:
+                metrics.write(path)
+            except OSError as e:
+                self.stderr.write(self.style.ERROR(f"[METRICS] cannot write {path}: {e}"))
+
+    def _report_profile(self, profiler, path, top=25):
+        """Dump the cycle's profile and print the hottest functions by cumulative time.
+        Only this thread is profiled: in --workers/--async mode the fetches show up as waits."""
+        if path:
+            profiler.dump_stats(path)
+            self.stdout.write(f"[PROFILE] stats written to {path} (python -m pstats {path})")
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        self.stdout.write(out.getvalue())
+
     def _mark_broken_flags(self, account):
         """
-        Mark machines as broken if last_order < now-90d OR last_order is NULL.
-        If you prefer NULL to be considered 'not broken', tweak here.
+        Mark machines as broken if last_order < now-90d OR last_order is NULL,
+        un-break the rest. Set-based: two UPDATEs whatever the fleet size,
+        counts come back from the DB.
         """
         cutoff = _three_months_ago()
         qs = Machine.objects.filter(xy_account=account)
-        updated_broken = 0
-        updated_ok = 0
-        for m in qs:
-            was_broken = getattr(m, "is_broken", False)
-            is_broken = (m.last_order is None) or (m.last_order < cutoff)
-            if is_broken != was_broken:
-                m.is_broken = is_broken
-                m.save(update_fields=["is_broken"])
-                updated_broken += 1 if is_broken else 0
-                updated_ok += 0 if is_broken else 1
+        updated_broken = qs.filter(is_broken=False).filter(
+            Q(last_order__isnull=True) | Q(last_order__lt=cutoff)
+        ).update(is_broken=True)
+        updated_ok = qs.filter(is_broken=True, last_order__gte=cutoff).update(is_broken=False)
         return updated_broken, updated_ok
 
+    def _mark_online_flags(self, account):
+        """
+        A machine is online while it has sold within --online-minutes;
+        last_online follows its last_order. Two UPDATEs, like the broken flags.
+        """
+        cutoff = timezone.now() - self.online_window
+        qs = Machine.objects.filter(xy_account=account)
+        updated_online = qs.filter(last_order__gte=cutoff).filter(
+            Q(is_online=False) | Q(last_online__isnull=True) | Q(last_online__lt=F("last_order"))
+        ).update(is_online=True, last_online=F("last_order"))
+        updated_offline = qs.filter(is_online=True).filter(
+            Q(last_order__isnull=True) | Q(last_order__lt=cutoff)
+        ).update(is_online=False)
+        return updated_online, updated_offline
+
     def _compute_window(self, account, start_str=None, end_str=None):
         """
         If start_str/end_str provided, use them.
@@ -288,161 +239,337 @@ class Command(BaseCommand):
         else:
             start_dt = tz_now - timedelta(days=90)
 
+        # minute-aligned like end_dt, so the oldest chunk is not a sliver of seconds
+        return start_dt.replace(second=0, microsecond=0), end_dt
+
+    def _cursor_window(self, account, cursor, overlap):
+        """
+        Incremental window: from the cursor's high-water mark (minus overlap) forward.
+        Accounts without a high-water mark yet fall back to the auto window.
+        """
+        start_dt, end_dt = self._compute_window(account)
+        if cursor.high_water:
+            start_dt = (cursor.high_water - overlap).replace(second=0, microsecond=0)
         return start_dt, end_dt
 
-    @transaction.atomic
-    def _upsert_row(self, row, acc):
-        # 1) Strict payment time from zfsj (skip if missing)
-        payment_time = _parse_dt_strict_zfsj(row.get("zfsj"))
-        if payment_time is None:
-            # temporary debug print
-            # remove later if noisy
-            self.stdout.write("    [SKIP] No zfsj in row with ddbh={}".format(row.get("ddbh")))
-            return None, False
-
-        # 2) Required unique key: provider UUID (simple)
-        provider_uuid = row.get("uuid") or row.get("dsfjybh") or row.get("dsfshdh") or row.get("ddbh")
-        if not provider_uuid:
-            return None, False
-
-        # 3) Extract fields
-        machine_number = str(row.get("jqbh") or "")
-        product_name = _extract_product_name(row)
-        slot_number = _extract_slot(row)
-
-        from decimal import Decimal
-        payment_amount = _parse_decimal(row.get("zfje") or row.get("ddzj") or row.get("spzj") or Decimal("0"))
-        payment_type = _payment_type(row.get("zffs"))
-        payment_status = _payment_status(row.get("showzfzt"), row.get("zfzt"))
-        source_order_no = row.get("ddbh") or row.get("dsfjybh") or row.get("dsfshdh")
-
-        DELIVERY_STATE_MAP = {
-            0: "Shipment Not Notified",
-            1: "Shipment Notified",
-            2: "Shipment Result Not Received",
-            3: "Partial shipment",
-            4: "Goods Shipped",
-            5: "Shipment failed",
-            6: "Notification Shipment Failure",
-            7: "Shipment Timeout",
-        }
-        raw_chzt = row.get("chzt")
+    def _page_steps(self, fetch, chunk, page_size, log):
+        """
+        Paging of one chunk without the I/O, shared by the blocking and the async fetch.
+        Yields what the caller must do next and is sent back the outcome:
+          ("query", page)         -> (rows, total) from client.query_orders
+          ("backoff", attempt)    -> seconds slept by retry.backoff / abackoff
+          ("page", (page, rows, total)) one fetched page, the last one included
+          ("pause", None)         between pages
+        A failed call is thrown back in. Raises if a page cannot be fetched after the
+        client's retries, if the account's circuit is open or if the cycle budget runs out.
+        """
+        fetch.breaker.check()
+        page = 1
+        while True:
+            try:
+                rows, total = yield "query", page
+
+                # Empty page: only retry when the evidence says rows are missing
+                # (total reaches this page, or orders in this window are already stored).
+                if not rows and self.retry.empty_is_suspect(page, page_size, total, chunk.expected):
+                    for attempt in range(1, self.retry.empty_attempts + 1):
+                        delay = yield "backoff", attempt
+                        metrics.observe("phase", delay, phase="sleep_backoff", account=fetch.client.username)
+                        log(f"       [EMPTY RETRY] Got 0 rows (total={total}). Retried {attempt}/{self.retry.empty_attempts} after {delay:.1f}s")
+                        rows, total = yield "query", page
+                        if rows:
+                            log(f"       [EMPTY RETRY SUCCESS] Got {len(rows)} rows on attempt {attempt}")
+                            break
+                    else:
+                        raise Exception(f"still 0 rows after {self.retry.empty_attempts} retries but data is expected")
+            except BudgetExceeded:
+                raise
+            except Exception:
+                fetch.breaker.record_failure()
+                raise
+
+            log(f"[PAGE] {chunk.start} page={page} got={len(rows)} total={total}")
+            if rows:
+                uuid_ex = rows[0].get('uuid') or rows[0].get('dsfjybh') or "N/A"
+                log(f"       first uuid={uuid_ex} jqbh={rows[0].get('jqbh')} zfsj={rows[0].get('zfsj')}")
+
+            last = not rows or page * page_size >= total
+            if last:
+                fetch.breaker.record_success()
+            yield "page", (page, rows, total)
+
+            if last:
+                return
+            page += 1
+            yield "pause", None
+
+    def _iter_pages(self, fetch, chunk, page_size, log, page_delay=2):
+        """Yield (page, rows, total) for one chunk (see _page_steps)."""
+        steps = self._page_steps(fetch, chunk, page_size, log)
+        reply = None
+        while True:
+            try:
+                step, arg = steps.send(reply)
+            except StopIteration:
+                return
+            reply = None
+            try:
+                if step == "query":
+                    reply = fetch.client.query_orders(chunk.start, chunk.end, page_num=arg, page_size=page_size, shbh=fetch.shbh, userid=fetch.userid)
+                elif step == "backoff":
+                    reply = self.retry.backoff(arg)
+            except Exception as err:
+                steps.throw(err)
+            if step == "page":
+                yield arg
+            elif step == "pause" and page_delay:
+                with metrics.timer("phase", phase="sleep_page", account=fetch.client.username):
+                    time.sleep(page_delay) # mild polite delay between pages
+
+    def _prefetch_chunk(self, fetch, chunk, page_size, log):
+        """Worker side of concurrent mode: fetch every page of a chunk, no DB access."""
+        pages = []
+        try:
+            for item in self._iter_pages(fetch, chunk, page_size, log, page_delay=0):
+                pages.append(item)
+        except Exception as err:
+            return pages, err
+        return pages, None
+
+    async def _aprefetch_chunk(self, fetch, chunk, page_size, log):
+        """_prefetch_chunk for AsyncXYApiClient; runs on the async loop thread."""
+        steps = self._page_steps(fetch, chunk, page_size, log)
+        pages, reply = [], None
+        try:
+            while True:
+                try:
+                    step, arg = steps.send(reply)
+                except StopIteration:
+                    break
+                reply = None
+                try:
+                    if step == "query":
+                        reply = await fetch.client.query_orders(chunk.start, chunk.end, page_num=arg, page_size=page_size, shbh=fetch.shbh, userid=fetch.userid)
+                    elif step == "backoff":
+                        reply = await self.retry.abackoff(arg)
+                except Exception as err:
+                    steps.throw(err)
+                if step == "page":
+                    pages.append(arg)
+        except Exception as err:
+            return pages, err
+        return pages, None
+
+    def _ingest_pages(self, acc, pages, log):
+        """
+        Ingest pages of one chunk in order.
+        Returns (complete, latest zfsj ingested, pages ingested, API total).
+        """
+        latest = None
+        done = 0
+        total = 0
         try:
-            chzt_int = int(raw_chzt)
-        except (TypeError, ValueError):
-            chzt_int = None
-        delivery_state = DELIVERY_STATE_MAP.get(chzt_int, "Unknown")
-
-        # 4) Machine upkeep (last_order + auto-unbreak)
-        if machine_number:
-            m, _ = Machine.objects.get_or_create(
-                number=machine_number,
-                defaults={"name": row.get("jqmc") or machine_number,"xy_account": acc}
-            )
-            if not m.name and row.get("jqmc"):
-                m.name = row["jqmc"]
-                m.save(update_fields=["name"])
-            if not m.last_order or payment_time > m.last_order:
-                m.last_order = payment_time
-                m.save(update_fields=["last_order"])
-            if getattr(m, "is_broken", False):
-                m.is_broken = False
-                m.save(update_fields=["is_broken"])
-
-        # 5) SIMPLE idempotent upsert by uuid
-        # Only create if it doesn't exist, do not update existing records
-        obj, created = Order.objects.get_or_create(
-            uuid=str(provider_uuid),
-            defaults={
-                "provider": "xy",
-                "source_order_no": str(source_order_no) if source_order_no else None,
-                "machine": Machine.objects.get(number=machine_number) if machine_number else None,
-                "product_name": product_name,
-                "slot_number": slot_number,
-                "payment_amount": payment_amount,
-                "payment_time": payment_time,
-                "payment_type": payment_type,
-                "payment_status": payment_status,
-                "delivery_state": delivery_state,
-                "source_payload": row,
-                "sync_status": "pending",
-            },
-        ) 
-        return obj, created
-    def _run_cycle(self, page_size, log, start_str=None, end_str=None):
+            for page, rows, total in pages:
+                done = page
+                if not rows:
+                    break
+                try:
+                    if self.loader is not None:
+                        res = self.loader.add(rows, acc)
+                        log(f"[STAGED] page={page} rows={len(rows)} invalid={res.invalid}")
+                    else:
+                        res = ingest_page(rows, acc, self._registry(acc))
+                        log(f"[INGEST] page={page} inserted={res.inserted} skipped={res.skipped} invalid={res.invalid} in {res.elapsed_ms:.0f}ms")
+                except Exception as ex:
+                    self.stderr.write(self.style.ERROR(f"    [PAGE ERR] {ex} | page={page} rows={len(rows)}"))
+                    return False, latest, done, total
+                if res.latest and (latest is None or res.latest > latest):
+                    latest = res.latest
+        except Exception as err:
+            log(f"[CHUNK ERR] {err}. Moving to next chunk/cycle.")
+            return False, latest, done, total # Stop pagination for this chunk if we fully fail, move to next
+        return True, latest, done, total
+
+    def _chunk_metrics(self, acc, chunk, seconds, done, total, ok):
+        outcome = "ok" if ok else "failed"
+        metrics.incr("chunks", account=acc.username, outcome=outcome)
+        metrics.observe("chunk", seconds, account=acc.username)
+        metrics.record("chunk", account=acc.username, start=chunk.start, end=chunk.end,
+                       pages=done, total=total, seconds=round(seconds, 3), outcome=outcome)
+
+    def _plan_account(self, acc, log, start_str, end_str, overlap, page_size):
+        """
+        Broken flags + fetch window for one account.
+        Returns (cursor or None, start_dt, end_dt, chunker).
+        """
+        log(f"[ACCOUNT] {acc.username}")
+
+        # 1) mark broken / online flags first
+        broken_upd, ok_upd = self._mark_broken_flags(acc)
+        if broken_upd or ok_upd:
+            log(f"[MACHINES] broken updated: {broken_upd}, un-broken updated: {ok_upd}")
+        online_upd, offline_upd = self._mark_online_flags(acc)
+        if online_upd or offline_upd:
+            log(f"[MACHINES] online updated: {online_upd}, offline updated: {offline_upd}")
+
+        # 2) compute window: explicit range (backfill) or forward from the cursor
+        cursor = None
+        if start_str or end_str:
+            start_dt, end_dt = self._compute_window(acc, start_str, end_str)
+        else:
+            cursor, _ = SyncCursor.objects.get_or_create(xy_account=acc)
+            start_dt, end_dt = self._cursor_window(acc, cursor, overlap)
+            cursor.window_start, cursor.window_end = start_dt, end_dt
+            cursor.pages_done = 0
+            cursor.complete = False
+            cursor.save()
+        log(f"[WINDOW] {start_dt} → {end_dt} ({'explicit' if cursor is None else f'cursor={cursor.high_water}'})")
+
+        # 3) window sizing: learned from the account's order rate unless fixed
+        if self.fixed_chunks:
+            chunker = AdaptiveChunker(page_size, min_width=timedelta(days=7), max_width=timedelta(days=7), log=log)
+        else:
+            chunker = AdaptiveChunker.for_account(acc, page_size, log=log, max_width=self.max_window)
+        return cursor, start_dt, end_dt, chunker
+
+    def _chunk(self, acc, chunk_start, chunk_end):
+        """Chunk for [chunk_start, chunk_end); `expected` = orders in it are already stored,
+        so an empty answer from the API is transient rather than a quiet window."""
+        expected = Order.objects.filter(
+            machine__xy_account=acc, payment_time__gte=chunk_start, payment_time__lt=chunk_end,
+        ).exists()
+        return Chunk(
+            chunk_start, chunk_end,
+            chunk_start.strftime("%Y-%m-%d %H:%M:%S"), chunk_end.strftime("%Y-%m-%d %H:%M:%S"),
+            expected,
+        )
+
+    def _registry(self, acc):
+        """The account's machines for this cycle, loaded on first use (after its flags were updated)."""
+        registry = self.registries.get(acc.pk)
+        if registry is None or not registry.loaded:
+            registry = self.registries[acc.pk] = MachineRegistry(acc).load()
+        return registry
+
+    def _account_fetch(self, acc, client):
+        breaker = self.breakers.get(acc.pk)
+        if breaker is None:
+            breaker = self.breakers[acc.pk] = CircuitBreaker(**self.breaker_opts)
+        return AccountFetch(client, breaker, (acc.shbh or "").strip(), (acc.userid or "").strip())
+
+    def _session_cache(self, acc, log):
+        """Cached session key for the account; login only happens again when it expires or is rejected."""
+        sessions = SessionCache(acc)
+        if sessions.load():
+            log(f"[AUTH] reusing cached session for {acc.username}")
+        return sessions
+
+    def _finish_account(self, acc, cursor, complete, latest, log):
+        """Advance the high-water mark only over a fully-ingested window."""
+        breaker = self.breakers.get(acc.pk)
+        if breaker is not None and breaker.state != "closed":
+            log(f"[BREAKER] {acc.username} {breaker.state} after {breaker.failures} consecutive failures")
+        if cursor is None:
+            return
+        cursor.complete = complete
+        if complete:
+            if latest and (cursor.high_water is None or latest > cursor.high_water):
+                cursor.high_water = latest
+            cursor.last_success_at = timezone.now()
+        cursor.save()
+        log(f"[CURSOR] complete={complete} high_water={cursor.high_water}")
+
+    def _run_cycle(self, page_size, log, start_str=None, end_str=None, overlap=timedelta(0),
+                   workers=1, per_account=2, rate=2.0):
         accounts = XYAccount.objects.all()
-        if not accounts.exists():
+        if self.usernames:
+            accounts = accounts.filter(username__in=self.usernames)
+        accounts = list(accounts)
+        if not accounts:
             log("[WARN] No XY accounts configured.")
             return
 
-        for acc in accounts:
-            log(f"[ACCOUNT] {acc.username}")
-
-            # 1) mark broken flags first
-            broken_upd, ok_upd = self._mark_broken_flags(acc)
-            if broken_upd or ok_upd:
-                log(f"[MACHINES] broken updated: {broken_upd}, un-broken updated: {ok_upd}")
+        self.retry.start_cycle()
+        if workers > 1 or self.async_runner is not None:
+            self._run_concurrent(accounts, page_size, log, start_str, end_str, overlap, workers, per_account, rate)
+            return
 
-            # 2) compute window 
-            start_dt, end_dt = self._compute_window(acc, start_str, end_str)
-            log(f"[WINDOW] {start_dt} → {end_dt} (split by 7 days)")
-
-            client = XYApiClient(acc.username, acc.password, log)
-            acc_shbh = (acc.shbh or "").strip()
-            acc_userid = (acc.userid or "").strip()
-
-            # 3) iterate 7-day chunks
-            for chunk_start, chunk_end in _seven_day_chunks(start_dt, end_dt):
-                s = chunk_start.strftime("%Y-%m-%d %H:%M:%S")
-                e = chunk_end.strftime("%Y-%m-%d %H:%M:%S")
-                log(f"[CHUNK] {s} → {e}")
-
-                page = 1
-                while True:
-                    try:
-                        rows, total = client.query_orders(s, e, page_num=page, page_size=page_size, shbh=acc_shbh, userid=acc_userid)
-                        
-                        # AGGRESSIVE RETRY FOR EMPTY RESULTS
-                        # The user suspects API returns 0 rows due to load, even if data exists.
-                        # We retry 5 times with increasing backoff if we get 0 rows but page < total? 
-                        # Or just if we get 0 rows at all? 
-                        # "if success and no data try 5 times"
-                        if not rows:
-                           max_empty_retries = 5
-                           for attempt in range(1, max_empty_retries + 1):
-                               delay = attempt * 5 if attempt < 3 else 30 # 5, 10, 30, 30, 30
-                               log(f"       [EMPTY RETRY] Got 0 rows. Retrying {attempt}/{max_empty_retries} in {delay}s...")
-                               time.sleep(delay)
-                               
-                               # Retry the query
-                               r_rows, r_total = client.query_orders(s, e, page_num=page, page_size=page_size, shbh=acc_shbh, userid=acc_userid)
-                               if r_rows:
-                                   rows = r_rows
-                                   total = r_total
-                                   log(f"       [EMPTY RETRY SUCCESS] Got {len(rows)} rows on attempt {attempt}")
-                                   break
-                           else:
-                               log("       [EMPTY RETRY GAVE UP] Still 0 rows.")
-
-                    except Exception as err:
+        for acc in accounts:
+            cursor, start_dt, end_dt, chunker = self._plan_account(acc, log, start_str, end_str, overlap, page_size)
+            sessions = self._session_cache(acc, log)
+            client = XYApiClient(acc.username, acc.password, log, session_cache=sessions, retry_policy=self.retry)
+            fetch = self._account_fetch(acc, client)
+
+            # 4) iterate chunks; each observed total resizes the next window
+            complete, latest, requests = True, None, 0
+            for chunk_start, chunk_end in chunker.windows(start_dt, end_dt):
+                chunk = self._chunk(acc, chunk_start, chunk_end)
+                log(f"[CHUNK] {chunk.start} → {chunk.end}")
+                chunk_started = time.monotonic()
+                pages = self._iter_pages(fetch, chunk, page_size, log, page_delay=self.page_delay)
+                ok, chunk_latest, done, total = self._ingest_pages(acc, pages, log)
+                self._chunk_metrics(acc, chunk, time.monotonic() - chunk_started, done, total, ok)
+                requests += done
+                if ok:
+                    chunker.observe(chunk_start, chunk_end, total)
+                complete = complete and ok
+                if chunk_latest and (latest is None or chunk_latest > latest):
+                    latest = chunk_latest
+                if cursor is not None:
+                    cursor.pages_done += done
+                    cursor.save(update_fields=["pages_done", "updated_at"])
+
+            sessions.flush()
+            log(f"[CHUNKER] {acc.username} fetched {requests} page(s)")
+            self._finish_account(acc, cursor, complete, latest, log)
+
+    def _run_concurrent(self, accounts, page_size, log, start_str, end_str, overlap, workers, per_account, rate):
+        """
+        Fetch every (account, chunk) in a thread pool; HTTP only in the workers.
+        A global token bucket caps requests/sec, each account's client caps its
+        in-flight requests, and this thread stays the single ordered DB writer.
+        With --async the chunks run as coroutines on the long-lived loop thread
+        instead of pool threads.
+        """
+        runner = self.async_runner
+        limiter = AsyncRateLimiter(rate) if runner is not None else RateLimiter(rate)
+        log(f"[CONCURRENT] {'async' if runner is not None else f'workers={workers}'} per-account={per_account} rate={rate}/s")
+
+        jobs = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="xy-fetch") as pool:
+            for acc in accounts:
+                cursor, start_dt, end_dt, chunker = self._plan_account(acc, log, start_str, end_str, overlap, page_size)
+                # planned up front from the learned rate (no per-window feedback here)
+                chunks = [self._chunk(acc, cs, ce) for cs, ce in chunker.windows(start_dt, end_dt)]
+                sessions = self._session_cache(acc, log)
+                client_cls = AsyncXYApiClient if runner is not None else XYApiClient
+                client = client_cls(acc.username, acc.password, log, rate_limiter=limiter, max_in_flight=per_account,
+                                    session_cache=sessions, retry_policy=self.retry)
+                fetch = self._account_fetch(acc, client)
+                if runner is not None:
+                    futures = [(chunk, runner.submit(self._aprefetch_chunk(fetch, chunk, page_size, log))) for chunk in chunks]
+                else:
+                    futures = [(chunk, pool.submit(self._prefetch_chunk, fetch, chunk, page_size, log)) for chunk in chunks]
+                jobs.append((acc, cursor, sessions, futures))
+
+            for acc, cursor, sessions, futures in jobs:
+                complete, latest = True, None
+                for chunk, fut in futures:
+                    chunk_started = time.monotonic()
+                    pages, err = fut.result()
+                    log(f"[CHUNK] {acc.username} {chunk.start} → {chunk.end} pages={len(pages)}")
+                    ok, chunk_latest, done, total = self._ingest_pages(acc, pages, log)
+                    if err is not None:
                         log(f"[CHUNK ERR] {err}. Moving to next chunk/cycle.")
-                        break # Stop pagination for this chunk if we fully fail, move to next
-
-                    log(f"[PAGE] page={page} got={len(rows)} total={total}")
-                    if rows:
-                        uuid_ex = rows[0].get('uuid') or rows[0].get('dsfjybh') or "N/A"
-                        log(f"       first uuid={uuid_ex} jqbh={rows[0].get('jqbh')} zfsj={rows[0].get('zfsj')}")
-
-                    if not rows:
-                        break
-
-                    for r in rows:
-                        try:
-                            _, _ = self._upsert_row(r, acc)
-                        except Exception as ex:
-                            self.stderr.write(self.style.ERROR(f"    [ROW ERR] {ex} | payload={str(r)[:300]}"))
-
-                    if page * page_size >= total:
-                        break
-                    page += 1
-                    time.sleep(2) # mild polite delay between pages
+                        ok = False
+                    # fetching overlaps other chunks here: this is the wait for the fetch + the ingest
+                    self._chunk_metrics(acc, chunk, time.monotonic() - chunk_started, done, total, ok)
+                    complete = complete and ok
+                    if chunk_latest and (latest is None or chunk_latest > latest):
+                        latest = chunk_latest
+                    if cursor is not None:
+                        cursor.pages_done += done
+                        cursor.save(update_fields=["pages_done", "updated_at"])
+
+                sessions.flush()
+                self._finish_account(acc, cursor, complete, latest, log)
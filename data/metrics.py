@@ -0,0 +1,152 @@
+# data/metrics.py
+"""
+In-process metrics for the XY sync.
+
+    from data.metrics import metrics
+    with metrics.timer("phase", phase="fetch", account=username):
+        ...
+    metrics.incr("orders", 100, account=username, result="inserted")
+
+Timers record count / sum / max seconds, counters add up and gauges keep
+the last value, each per name + label set. Everything is thread-safe and
+cumulative for the life of the process (Prometheus semantics). The most
+recent chunk records are kept for the JSON export. write() saves a snapshot
+as Prometheus text (.prom / .txt) or JSON (anything else), atomically, so a
+node_exporter textfile collector or a dashboard can read it at any time.
+
+Phases used by sync_orders:
+- auth: XY login
+- throttle: waiting on the rate limiter or the in-flight gate
+- fetch: HTTP round trips
+- parse: row parsing
+- upsert: DB writes for a page
+- sleep_backoff: retry sleeps
+- sleep_page: the polite delay between pages
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PREFIX = "xy_sync"
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prom_labels(key):
+    if not key:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in key)
+    return "{" + inner + "}"
+
+
+class Metrics:
+    def __init__(self, recent=200):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}    # (name, labels) -> value
+        self.timers = {}    # (name, labels) -> [count, sum, max]
+        self.recent = deque(maxlen=recent)
+
+    def incr(self, name, n=1, **labels):
+        key = (name, _labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels_key(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels_key(labels))
+        with self.lock:
+            t = self.timers.setdefault(key, [0, 0.0, 0.0])
+            t[0] += 1
+            t[1] += seconds
+            t[2] = max(t[2], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def record(self, kind, **fields):
+        """Keep a structured event (e.g. one chunk) for the JSON export."""
+        fields.update(kind=kind, at=time.time())
+        with self.lock:
+            self.recent.append(fields)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+            self.recent.clear()
+
+    # ---- export ----
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.gauges.items())],
+                "timers": [
+                    {"name": n, "labels": dict(l), "count": c, "sum": round(s, 6), "max": round(m, 6),
+                     "avg": round(s / c, 6) if c else None}
+                    for (n, l), (c, s, m) in sorted(self.timers.items())
+                ],
+                "recent": list(self.recent),
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            timers = sorted(self.timers.items())
+        typed = set()
+
+        def header(metric, kind):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            header(metric, "counter")
+            lines.append(f"{metric}{_prom_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            metric = f"{PREFIX}_{name}"
+            header(metric, "gauge")
+            lines.append(f"{metric}{_prom_labels(labels)} {value}")
+        for (name, labels), (count, total, _) in timers:
+            metric = f"{PREFIX}_{name}_seconds"
+            header(metric, "summary")
+            lines.append(f"{metric}_count{_prom_labels(labels)} {count}")
+            lines.append(f"{metric}_sum{_prom_labels(labels)} {total:.6f}")
+        # a metric family's lines must be contiguous: maxima come as separate gauges
+        for (name, labels), (_, _, peak) in timers:
+            metric = f"{PREFIX}_{name}_seconds_max"
+            header(metric, "gauge")
+            lines.append(f"{metric}{_prom_labels(labels)} {peak:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write a snapshot to `path`: Prometheus text for .prom/.txt, JSON otherwise."""
+        if path.endswith((".prom", ".txt")):
+            body = self.to_prometheus()
+        else:
+            body = json.dumps(self.snapshot(), indent=2, default=str)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_remove_order_machine_number_order_machine'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='slot_number',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('high_water', models.DateTimeField(blank=True, null=True)),
+                ('window_start', models.DateTimeField(blank=True, null=True)),
+                ('window_end', models.DateTimeField(blank=True, null=True)),
+                ('pages_done', models.PositiveIntegerField(default=0)),
+                ('complete', models.BooleanField(default=False)),
+                ('last_success_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('xy_account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sync_cursor', to='data.xy_account')),
+            ],
+        ),
+    ]
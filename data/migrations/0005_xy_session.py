@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_sync_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='XYSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('obtained_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('logins', models.PositiveIntegerField(default=0)),
+                ('last_login_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('consecutive_failures', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('last_failure_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('xy_account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='xy_session', to='data.xy_account')),
+            ],
+        ),
+    ]
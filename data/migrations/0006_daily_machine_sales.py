@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:30
+
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_rollup(apps, schema_editor):
+    Order = apps.get_model('data', 'Order')
+    DailyMachineSales = apps.get_model('data', 'DailyMachineSales')
+    rows = (
+        Order.objects.filter(machine__isnull=False)
+        .annotate(day=TruncDate('payment_time', tzinfo=timezone.get_current_timezone()))
+        .values('machine_id', 'day', 'delivery_state')
+        .annotate(total=Sum('payment_amount'), count=Count('id'))
+        .order_by()
+    )
+    merged = defaultdict(lambda: [Decimal('0'), 0])
+    for r in rows.iterator():
+        key = (r['machine_id'], r['day'], r['delivery_state'] or '')
+        merged[key][0] += r['total'] or 0
+        merged[key][1] += r['count']
+    DailyMachineSales.objects.bulk_create(
+        [
+            DailyMachineSales(machine_id=m, date=d, delivery_state=state, total_amount=amount, order_count=count)
+            for (m, d, state), (amount, count) in merged.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0005_xy_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMachineSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('delivery_state', models.CharField(default='', max_length=64)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('machine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='data.machine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'delivery_state'], name='data_dailym_date_38a8cd_idx')],
+                'constraints': [models.UniqueConstraint(fields=('machine', 'date', 'delivery_state'), name='daily_sales_machine_date_state')],
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
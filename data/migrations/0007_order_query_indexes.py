@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:34
+
+from django.db import migrations, models
+
+from data.schema import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY on PostgreSQL cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('data', '0006_daily_machine_sales'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['machine', 'payment_time'], name='order_machine_paytime_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('delivery_state', 'Goods Shipped')), fields=['machine', 'payment_time', 'payment_amount'], name='order_shipped_sales_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('sync_status__in', ('pending', 'failed'))), fields=['next_retry_at'], name='order_push_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Merge machines sharing a number before machine.number becomes unique (0009).
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def _rebuild_rollup(Order, DailyMachineSales, machine_id):
+    rows = (
+        Order.objects.filter(machine_id=machine_id)
+        .annotate(day=TruncDate('payment_time', tzinfo=timezone.get_current_timezone()))
+        .values('day', 'delivery_state')
+        .annotate(total=Sum('payment_amount'), count=Count('id'))
+        .order_by()
+    )
+    merged = defaultdict(lambda: [Decimal('0'), 0])
+    for r in rows:
+        key = (r['day'], r['delivery_state'] or '')
+        merged[key][0] += r['total'] or 0
+        merged[key][1] += r['count']
+    DailyMachineSales.objects.bulk_create([
+        DailyMachineSales(machine_id=machine_id, date=d, delivery_state=state, total_amount=amount, order_count=count)
+        for (d, state), (amount, count) in merged.items()
+    ])
+
+
+def dedupe_machines(apps, schema_editor):
+    Machine = apps.get_model('data', 'machine')
+    Order = apps.get_model('data', 'Order')
+    DailyMachineSales = apps.get_model('data', 'DailyMachineSales')
+
+    numbers = (
+        Machine.objects.values('number').annotate(n=Count('id')).filter(n__gt=1).values_list('number', flat=True)
+    )
+    for number in list(numbers):
+        machines = list(Machine.objects.filter(number=number).order_by('id'))
+        keeper, extras = machines[0], machines[1:]
+        extra_ids = [m.id for m in extras]
+
+        Order.objects.filter(machine_id__in=extra_ids).update(machine_id=keeper.id)
+
+        keeper.name = keeper.name or next((m.name for m in extras if m.name), '')
+        keeper.xy_account_id = keeper.xy_account_id or next((m.xy_account_id for m in extras if m.xy_account_id), None)
+        keeper.last_order = max((m.last_order for m in machines if m.last_order), default=None)
+        keeper.last_online = max((m.last_online for m in machines if m.last_online), default=None)
+        keeper.is_online = any(m.is_online for m in machines)
+        keeper.is_broken = all(m.is_broken for m in machines)
+        keeper.save()
+
+        DailyMachineSales.objects.filter(machine_id__in=[keeper.id] + extra_ids).delete()
+        _rebuild_rollup(Order, DailyMachineSales, keeper.id)
+        Machine.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0007_order_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_machines, migrations.RunPython.noop),
+    ]
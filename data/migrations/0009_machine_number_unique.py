@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0008_dedupe_machine_numbers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='machine',
+            name='number',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
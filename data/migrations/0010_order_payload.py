@@ -0,0 +1,111 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:00
+# Move Order.source_payload into the packed OrderPayload side table.
+
+import json
+import zlib
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH = 2000
+
+# Frozen copies of data.payloads.pack() / unpack() / mapped_values() and of
+# ingest.DELIVERY_STATE_MAP as of this migration, so later changes there
+# cannot change what this migration writes or reads back.
+DROPPED = '~mapped'
+DELIVERY_STATE_MAP = {
+    0: 'Shipment Not Notified',
+    1: 'Shipment Notified',
+    2: 'Shipment Result Not Received',
+    3: 'Partial shipment',
+    4: 'Goods Shipped',
+    5: 'Shipment failed',
+    6: 'Notification Shipment Failure',
+    7: 'Shipment Timeout',
+}
+
+
+def order_values(order):
+    values = {'uuid': order.uuid, 'ddbh': order.source_order_no}
+    if order.payment_time is not None:
+        values['zfsj'] = timezone.localtime(order.payment_time).strftime('%Y-%m-%d %H:%M:%S')
+    if order.payment_amount is not None:
+        values['zfje'] = f'{Decimal(order.payment_amount):.2f}'
+    for code, state in DELIVERY_STATE_MAP.items():
+        if state == order.delivery_state:
+            values['chzt'] = code
+    return values
+
+
+def pack(row, mapped):
+    dropped = [k for k, v in mapped.items() if k in row and row[k] == v and v is not None]
+    rest = {k: v for k, v in row.items() if k not in dropped}
+    if dropped:
+        rest[DROPPED] = dropped
+    return zlib.compress(json.dumps(rest, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack(data, mapped):
+    row = json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+    for k in row.pop(DROPPED, ()):
+        row[k] = mapped[k]
+    return row
+
+
+def pack_payloads(apps, schema_editor):
+    Order = apps.get_model('data', 'Order')
+    OrderPayload = apps.get_model('data', 'OrderPayload')
+    orders = Order.objects.filter(source_payload__isnull=False).only(
+        'id', 'uuid', 'source_order_no', 'payment_time', 'payment_amount', 'delivery_state', 'source_payload',
+    ).order_by('id')
+    last = 0
+    while True:
+        batch = list(orders.filter(id__gt=last)[:BATCH])
+        if not batch:
+            break
+        OrderPayload.objects.bulk_create(
+            [OrderPayload(order_id=o.uuid, data=pack(o.source_payload, order_values(o))) for o in batch],
+            ignore_conflicts=True,
+        )
+        last = batch[-1].id
+
+
+def unpack_payloads(apps, schema_editor):
+    Order = apps.get_model('data', 'Order')
+    OrderPayload = apps.get_model('data', 'OrderPayload')
+    payloads = OrderPayload.objects.select_related('order').order_by('order_id')
+    last = ''
+    while True:
+        batch = list(payloads.filter(order_id__gt=last)[:BATCH])
+        if not batch:
+            break
+        orders = []
+        for p in batch:
+            p.order.source_payload = unpack(p.data, order_values(p.order))
+            orders.append(p.order)
+        Order.objects.bulk_update(orders, ['source_payload'])
+        last = batch[-1].order_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0009_machine_number_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderPayload',
+            fields=[
+                ('order', models.OneToOneField(db_column='order_uuid', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='data.order', to_field='uuid')),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.RunPython(pack_payloads, unpack_payloads),
+        migrations.RemoveField(
+            model_name='order',
+            name='source_payload',
+        ),
+    ]
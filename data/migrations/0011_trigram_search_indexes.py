@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-17 14:00
+# pg_trgm GIN indexes for the admin search fields (PostgreSQL only).
+#
+# Django's icontains on PostgreSQL is UPPER("col"::text) LIKE UPPER('%term%'),
+# so the indexes are on that same expression. Other databases are left alone.
+# The indexes are built CONCURRENTLY, outside a transaction, so writes to the
+# tables go on meanwhile; an INVALID index left by an interrupted build is
+# dropped and built again.
+
+from django.db import migrations
+
+# (table, column, index name)
+INDEXES = [
+    ('data_order', 'uuid', 'order_uuid_trgm'),
+    ('data_order', 'source_order_no', 'order_source_order_no_trgm'),
+    ('data_order', 'product_name', 'order_product_name_trgm'),
+    ('data_order', 'external_id', 'order_external_id_trgm'),
+    ('data_machine', 'name', 'machine_name_trgm'),
+    ('data_machine', 'number', 'machine_number_trgm'),
+    ('data_xy_account', 'username', 'xy_account_username_trgm'),
+    ('data_xy_account', 'shbh', 'xy_account_shbh_trgm'),
+    ('data_xy_account', 'userid', 'xy_account_userid_trgm'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column, name in INDEXES:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                'WHERE c.relname = %s AND pg_table_is_visible(c.oid)',
+                [name],
+            )
+            row = cursor.fetchone()
+        if row and not row[0]:
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY {name}')
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, _, name in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('data', '0010_order_payload'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:54
+
+import data.schema
+from django.db import migrations, models
+
+from data.schema import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY on PostgreSQL cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('data', '0011_trigram_search_indexes'),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name='order',
+            name='order_push_queue_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=data.schema.NullsOrderedIndex(models.OrderBy(models.F('next_retry_at'), nulls_first=True), models.F('id'), condition=models.Q(('sync_status__in', ('pending', 'failed'))), name='order_push_queue_idx'),
+        ),
+    ]
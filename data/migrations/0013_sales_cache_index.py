@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0012_push_queue_nulls_first'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesCacheKey',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.CharField(default='0', max_length=32)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesCacheStat',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesCacheMachine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('machine_number', models.CharField(db_index=True, max_length=100)),
+                ('key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='machines', to='data.salescachekey')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('key', 'machine_number'), name='sales_cache_key_machine')],
+            },
+        ),
+    ]
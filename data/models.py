@@ -1,9 +1,15 @@
 from django.db import models
 from django.utils import timezone
 
+from .payloads import order_values, pack, read_archived, unpack
+from .schema import NullsOrderedIndex
+
 
 # Create your models here.
 
+SHIPPED_STATE = "Goods Shipped"
+PUSH_QUEUE_STATES = ("pending", "failed")  # orders the outbound push still has to send
+
 class xy_account(models.Model):
     username = models.CharField(max_length=100)
     password = models.CharField(max_length=100)
@@ -17,7 +23,7 @@ class xy_account(models.Model):
 
 class machine (models.Model):
     name = models.CharField(max_length=100)
-    number = models.CharField(max_length=100)
+    number = models.CharField(max_length=100, unique=True)
     is_online = models.BooleanField(default=False)
     is_broken = models.BooleanField(default=False)
     last_online = models.DateTimeField(null=True, blank=True)
@@ -47,8 +53,7 @@ class Order(models.Model):
     payment_status = models.CharField(max_length=20, default="paid")
     delivery_state = models.CharField(max_length=64, null=True, blank=True)
 
-    # Debug / re-mapping
-    source_payload = models.JSONField(null=True, blank=True)
+    # Debug / re-mapping: the raw XY row lives in OrderPayload (see source_payload below)
 
     # Outbound sync tracking
     sync_status = models.CharField(max_length=20, default="pending", db_index=True)
@@ -67,4 +72,158 @@ class Order(models.Model):
             models.Index(fields=["provider", "source_order_no"]),
             models.Index(fields=["payment_time"]),
             models.Index(fields=["sync_status"]),
-        ]
\ No newline at end of file
+            # per-machine date ranges (sales report, rollup rebuilds)
+            models.Index(fields=["machine", "payment_time"], name="order_machine_paytime_idx"),
+            # shipped-sales sums: payment_amount as trailing key so they are index-only
+            models.Index(
+                fields=["machine", "payment_time", "payment_amount"],
+                condition=models.Q(delivery_state=SHIPPED_STATE),
+                name="order_shipped_sales_idx",
+            ),
+            # outbound push queue: never-tried orders first, then oldest retry
+            NullsOrderedIndex(
+                models.F("next_retry_at").asc(nulls_first=True),
+                models.F("id"),
+                condition=models.Q(sync_status__in=PUSH_QUEUE_STATES),
+                name="order_push_queue_idx",
+            ),
+        ]
+
+    @property
+    def source_payload(self):
+        """
+        Raw XY row, loaded on first access from OrderPayload (prefetch_related("payload")
+        avoids a query per order) or, once archived, from the payload archive.
+        """
+        if "_source_payload" not in self.__dict__:
+            self.__dict__["_source_payload"] = self._load_payload()
+        return self.__dict__["_source_payload"]
+
+    @source_payload.setter
+    def source_payload(self, row):
+        self.__dict__["_source_payload"] = row
+
+    def _load_payload(self):
+        if self.pk is None:
+            return None
+        try:
+            data = self.payload.data
+        except OrderPayload.DoesNotExist:
+            data = read_archived(self.uuid, self.payment_time)
+        return unpack(data, order_values(self)) if data is not None else None
+
+
+class OrderPayload(models.Model):
+    """Raw XY row of an order, packed by data.payloads (mapped keys dropped, zlib-compressed)."""
+    order = models.OneToOneField(
+        Order, to_field="uuid", db_column="order_uuid", on_delete=models.CASCADE,
+        primary_key=True, related_name="payload",
+    )
+    data = models.BinaryField()
+
+    @classmethod
+    def for_orders(cls, orders):
+        """Unsaved payload rows for orders whose source_payload was set in memory."""
+        return [
+            cls(order_id=o.uuid, data=pack(o.__dict__["_source_payload"], order_values(o)))
+            for o in orders if o.__dict__.get("_source_payload") is not None
+        ]
+
+    def __str__(self):
+        return f"payload of {self.order_id}"
+
+
+class SyncCursor(models.Model):
+    """High-water mark of the XY order sync, one row per account."""
+    xy_account = models.OneToOneField(xy_account, on_delete=models.CASCADE, related_name="sync_cursor")
+    # last fully-ingested zfsj (payment_time)
+    high_water = models.DateTimeField(null=True, blank=True)
+
+    # page state of the window currently being fetched
+    window_start = models.DateTimeField(null=True, blank=True)
+    window_end = models.DateTimeField(null=True, blank=True)
+    pages_done = models.PositiveIntegerField(default=0)
+    complete = models.BooleanField(default=False)
+
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.xy_account} @ {self.high_water}"
+
+
+
+class XYSession(models.Model):
+    """Cached XY session key per account, reused across cycles until it expires or is rejected."""
+    xy_account = models.OneToOneField(xy_account, on_delete=models.CASCADE, related_name="xy_session")
+    session_key = models.CharField(max_length=255, null=True, blank=True)
+    obtained_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    # login bookkeeping
+    logins = models.PositiveIntegerField(default=0)
+    last_login_ms = models.PositiveIntegerField(null=True, blank=True)
+    failures = models.PositiveIntegerField(default=0)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    last_failure_at = models.DateTimeField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.xy_account} (expires {self.expires_at})"
+
+
+
+class DailyMachineSales(models.Model):
+    """Sales rollup per machine, local (TIME_ZONE) day and delivery_state; kept current by the sync ingest."""
+    machine = models.ForeignKey(machine, on_delete=models.CASCADE, related_name="daily_sales")
+    date = models.DateField()
+    delivery_state = models.CharField(max_length=64, default="")
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["machine", "date", "delivery_state"], name="daily_sales_machine_date_state"),
+        ]
+        indexes = [
+            models.Index(fields=["date", "delivery_state"]),
+        ]
+
+    def __str__(self):
+        return f"{self.machine} {self.date} {self.delivery_state}: {self.total_amount}"
+
+
+
+class SalesCacheKey(models.Model):
+    """
+    A sales total cached by data.cache: the range it covers and its current version token.
+    Kept in the database so the index and the tokens are never culled and change atomically.
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.CharField(max_length=32, default="0")
+    start_date = models.DateField()
+    end_date = models.DateField()
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)  # None: closed range, kept until invalidated
+
+    def __str__(self):
+        return f"{self.key} {self.start_date}..{self.end_date}"
+
+
+class SalesCacheMachine(models.Model):
+    """Machine index of SalesCacheKey: which cached totals include a machine."""
+    key = models.ForeignKey(SalesCacheKey, on_delete=models.CASCADE, related_name="machines")
+    machine_number = models.CharField(max_length=100, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key", "machine_number"], name="sales_cache_key_machine"),
+        ]
+
+
+class SalesCacheStat(models.Model):
+    """Hit / miss / eviction counters of the sales cache, summed over every process."""
+    name = models.CharField(max_length=32, primary_key=True)
+    value = models.BigIntegerField(default=0)
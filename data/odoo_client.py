@@ -0,0 +1,149 @@
+# data/odoo_client.py
+"""
+Odoo vending endpoint client (create_order_by_name), used by push_orders.
+
+Replaces the per-save webhook in data/signals.py: same payload, but sent
+from a background command with a pooled keep-alive session per worker
+thread instead of a fresh connection inside Order.save().
+
+push_batch() sends many orders in one request to ODOO_BATCH_PATH:
+
+    {"orders": [<order payload>, ...]}
+    -> {"results": [{"uuid": ..., "id": ...} | {"uuid": ..., "error": ..., "retryable": bool}, ...]}
+
+If that endpoint does not exist (404), the client falls back to one request
+per order for the rest of its life.
+"""
+import threading
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+
+DEFAULT_ORDER_PATH = "/vending/create_order_by_name"
+DEFAULT_BATCH_PATH = "/vending/create_orders_by_name"
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class OdooError(Exception):
+    """A push failed; `retryable` says whether sending the same payload later can succeed."""
+
+    def __init__(self, message, retryable=True, status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+
+
+def order_payload(order):
+    """create_order_by_name body for one Order (same shape the old webhook sent)."""
+    return {
+        "uuid": order.uuid,
+        "machine_number": order.machine.number if order.machine_id else None,
+        "pos_id": settings.ODOO_POS_ID,
+        "product_name": settings.ODOO_PRODUCT_NAME or order.product_name,
+        "delivery_state": order.delivery_state,
+        "purchase_date": timezone.localtime(order.payment_time).strftime('%Y-%m-%d %H:%M:%S') if order.payment_time else None,
+        "price": float(order.payment_amount or 0),
+        "payment_method_id": settings.ODOO_PAYMENT_METHOD_ID,
+        "created": True,
+    }
+
+
+def _result(data):
+    """Unwrap a JSON-RPC style {"result": ...} answer and raise on {"error": ...}."""
+    if isinstance(data, dict) and "result" in data:
+        data = data["result"]
+    if isinstance(data, dict) and data.get("error"):
+        error = data["error"]
+        message = error.get("message") if isinstance(error, dict) else str(error)
+        raise OdooError(f"Odoo error: {message}", retryable=bool(data.get("retryable")))
+    return data
+
+
+def _external_id(data):
+    if isinstance(data, dict):
+        for key in ("id", "order_id", "name"):
+            if data.get(key) not in (None, ""):
+                return str(data[key])
+    return None
+
+
+class OdooClient:
+    def __init__(self, base_url=None, api_key=None, order_path=None, batch_path=None, timeout=None):
+        self.base_url = (base_url or settings.ODOO_BASE_URL or "").rstrip("/")
+        if not self.base_url:
+            raise OdooError("ODOO_BASE_URL is not configured", retryable=False)
+        self.api_key = api_key if api_key is not None else settings.ODOO_API_KEY
+        self.order_path = order_path or settings.ODOO_ORDER_PATH or DEFAULT_ORDER_PATH
+        self.batch_path = batch_path if batch_path is not None else settings.ODOO_BATCH_PATH
+        self.timeout = timeout or settings.ODOO_TIMEOUT
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session is not thread-safe: one keep-alive session per worker thread
+        s = getattr(self.local, "session", None)
+        if s is None:
+            s = self.local.session = requests.Session()
+            s.headers.update({"Authorization": f"{self.api_key}", "Content-Type": "application/json"})
+        return s
+
+    def post(self, path, payload):
+        try:
+            r = self.session.post(self.base_url + path, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise OdooError(f"{type(e).__name__}: {e}")
+        if r.status_code >= 400:
+            raise OdooError(f"HTTP {r.status_code}: {r.text[:200]}", retryable=r.status_code in RETRYABLE_STATUS, status=r.status_code)
+        try:
+            return _result(r.json())
+        except ValueError:
+            raise OdooError(f"non-JSON answer: {r.text[:200]}")
+
+    def push_order(self, order):
+        """Send one order; returns Odoo's id for it (or None if it does not return one)."""
+        return _external_id(self.post(self.order_path, order_payload(order)))
+
+    def push_batch(self, orders):
+        """
+        Send `orders` in one request. Returns {uuid: (external_id, error, retryable)};
+        an order Odoo did not answer for gets a retryable error. Raises OdooError
+        when the whole request fails.
+        """
+        if not self.batch_path or len(orders) == 1:
+            return self._push_each(orders)
+        try:
+            data = self.post(self.batch_path, {"orders": [order_payload(o) for o in orders]})
+        except OdooError as e:
+            if e.status != 404:
+                raise
+            self.batch_path = None  # no batch endpoint on this Odoo
+            return self._push_each(orders)
+
+        outcomes = {}
+        for item in (data or {}).get("results") or []:
+            if not isinstance(item, dict) or not item.get("uuid"):
+                continue
+            if item.get("error"):
+                outcomes[item["uuid"]] = (None, f"Odoo error: {item['error']}", bool(item.get("retryable")))
+            else:
+                outcomes[item["uuid"]] = (_external_id(item), None, False)
+        for o in orders:
+            outcomes.setdefault(o.uuid, (None, "no result for this order in the batch answer", True))
+        return outcomes
+
+    def _push_each(self, orders):
+        outcomes = {}
+        for o in orders:
+            try:
+                outcomes[o.uuid] = (self.push_order(o), None, False)
+            except OdooError as e:
+                outcomes[o.uuid] = (None, str(e), e.retryable)
+        return outcomes
+
+    def close(self):
+        s = getattr(self.local, "session", None)
+        if s is not None:
+            s.close()
+            self.local.session = None
@@ -0,0 +1,173 @@
+# data/outbound.py
+"""
+Outbound order queue for the Odoo push.
+
+An order is due when its sync_status is in PUSH_QUEUE_STATES and its
+next_retry_at is empty or in the past. claim_batch() picks due orders,
+never-tried first and then oldest retry first, with SELECT ... FOR UPDATE
+SKIP LOCKED and leases them by moving next_retry_at `lease` seconds ahead. Parallel workers, and
+several push_orders processes, never get the same order. A worker that
+dies simply lets its lease run out, and the orders become due again.
+`since` limits the queue to orders paid from then on.
+push() sends a claimed batch in requests of up to `size` orders, grouped by
+machine or kept in payment_time order, and maps Odoo's per-item answers
+back to the orders. Given the lease, it renews it before every request and
+drops the orders whose lease was lost to another worker. record_results()
+stores each order's outcome: sent, failed with a backoff retry, or error
+once attempts run out or Odoo rejects the payload. It only writes orders
+whose lease is still the one the caller holds. Only the failed items of a
+batch come back for a retry.
+"""
+from collections import namedtuple
+from itertools import groupby
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Order, PUSH_QUEUE_STATES
+from .odoo_client import OdooError
+
+
+# Outcome of one push: external_id on success, error (+ retryable) otherwise.
+PushResult = namedtuple("PushResult", ["order", "external_id", "error", "retryable"])
+
+SENT = "sent"
+FAILED = "failed"    # will be retried (still in PUSH_QUEUE_STATES)
+ERROR = "error"      # given up; needs a human (or a manual reset to pending)
+
+GROUP_BY = ("machine", "time")
+
+
+def push_queue(now=None, machines=None, since=None):
+    """Due orders, never-tried first, then oldest retry (matches the order_push_queue_idx partial index)."""
+    now = now or timezone.now()
+    qs = Order.objects.filter(
+        Q(next_retry_at__isnull=True) | Q(next_retry_at__lte=now),
+        sync_status__in=PUSH_QUEUE_STATES,
+    )
+    if machines:
+        qs = qs.filter(machine__number__in=machines)
+    if since is not None:
+        qs = qs.filter(payment_time__gte=since)
+    return qs.order_by(F("next_retry_at").asc(nulls_first=True), "id")
+
+
+def claim_batch(size, lease=300, machines=None, since=None):
+    """Lease up to `size` due orders to the caller and return them (machine loaded)."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            push_queue(now, machines, since).select_for_update(skip_locked=True, of=("self",)).values_list("id", flat=True)[:size]
+        )
+        if not ids:
+            return []
+        Order.objects.filter(id__in=ids).update(
+            next_retry_at=now + timedelta(seconds=lease),
+            attempts=F("attempts") + 1,
+        )
+    return list(Order.objects.filter(id__in=ids).select_related("machine").order_by("payment_time", "id"))
+
+
+def _held(orders):
+    """Orders among `orders` still leased to the caller: queued, with the next_retry_at it claimed or renewed."""
+    held = Q()
+    for leased_until in {o.next_retry_at for o in orders}:
+        held |= Q(id__in=[o.id for o in orders if o.next_retry_at == leased_until], next_retry_at=leased_until)
+    return Order.objects.filter(held, sync_status__in=PUSH_QUEUE_STATES)
+
+
+def renew_lease(orders, lease):
+    """
+    Move the lease of the `orders` still held `lease` seconds ahead. Returns
+    those orders (with next_retry_at updated); the others now belong to another worker.
+    """
+    if not orders:
+        return []
+    until = timezone.now() + timedelta(seconds=lease)
+    with transaction.atomic():
+        ids = set(_held(orders).select_for_update(of=("self",)).values_list("id", flat=True))
+        Order.objects.filter(id__in=ids).update(next_retry_at=until)
+    kept = [o for o in orders if o.id in ids]
+    for o in kept:
+        o.next_retry_at = until
+    return kept
+
+
+def request_groups(orders, size, group_by="machine"):
+    """Split a claimed batch into per-request lists of at most `size` orders."""
+    size = max(1, size)
+    if group_by == "machine":
+        ordered = sorted(orders, key=lambda o: (o.machine_id or 0, o.payment_time, o.id))
+        runs = [list(g) for _, g in groupby(ordered, key=lambda o: o.machine_id)]
+    else:
+        runs = [sorted(orders, key=lambda o: (o.payment_time, o.id))]
+    return [run[i:i + size] for run in runs for i in range(0, len(run), size)]
+
+
+def push(client, orders, size=50, group_by="machine", lease=None, renew=renew_lease):
+    """
+    Send `orders` to Odoo in batched requests; returns one PushResult per order sent.
+    With `lease`, the lease is renewed before each request and orders it was lost on are not sent.
+    """
+    results = []
+    for group in request_groups(orders, size, group_by):
+        if lease:
+            group = renew(group, lease)
+            if not group:
+                continue
+        try:
+            outcomes = client.push_batch(group)
+        except OdooError as e:
+            outcomes = {o.uuid: (None, str(e), e.retryable) for o in group}
+        for o in group:
+            external_id, error, retryable = outcomes[o.uuid]
+            results.append(PushResult(o, external_id, error, retryable))
+    return results
+
+
+def record_results(results, retry, max_attempts, endpoint=None):
+    """
+    Write push outcomes back with one bulk_update; `retry` (a RetryPolicy) spaces the
+    attempts. Orders whose lease ran out and were claimed again are left to their new
+    worker. Returns (sent, failed, error) counts.
+    """
+    with transaction.atomic():
+        # locked, so no other worker can claim them between the check and the write
+        held = set(_held([r.order for r in results]).select_for_update(of=("self",)).values_list("id", flat=True)) if results else set()
+        return _record(results, held, retry, max_attempts, endpoint)
+
+
+def _record(results, held, retry, max_attempts, endpoint):
+    now = timezone.now()
+    counts = {SENT: 0, FAILED: 0, ERROR: 0}
+    orders = []
+    for r in results:
+        o = r.order
+        if o.id not in held:
+            continue
+        if r.error is None:
+            o.sync_status = SENT
+            o.external_id = r.external_id or o.external_id
+            o.last_sync_error = None
+            o.next_retry_at = None
+            if endpoint:
+                o.sync_endpoint = endpoint
+        elif r.retryable and o.attempts < max_attempts:
+            o.sync_status = FAILED
+            o.last_sync_error = r.error
+            o.next_retry_at = now + timedelta(seconds=retry.delay(o.attempts))
+        else:
+            o.sync_status = ERROR
+            o.last_sync_error = r.error
+            o.next_retry_at = None
+        o.updated_at = now  # bulk_update skips auto_now
+        counts[o.sync_status] += 1
+        orders.append(o)
+    if orders:
+        Order.objects.bulk_update(
+            orders, ["sync_status", "external_id", "last_sync_error", "next_retry_at", "sync_endpoint", "updated_at"],
+        )
+    return counts[SENT], counts[FAILED], counts[ERROR]
+
@@ -0,0 +1,289 @@
+# data/partitions.py
+"""
+Optional PostgreSQL range partitioning of data_order on payment_time by
+local (TIME_ZONE) month; driven by `python manage.py partition_orders`.
+
+Layout after convert():
+- data_order: partitioned parent, primary key (id, payment_time), ids from
+  the data_order_id_seq sequence; Django's indexes and foreign keys are
+  recreated on it and inherited by every partition.
+- data_order_pYYYY_MM: one partition per month, data_order_default catches
+  rows outside them (ensure() moves those into new partitions).
+- data_order_uuid: uuid -> payment_time, one row per order ever stored. A
+  unique index on a partitioned table has to include the partition key, so
+  this table keeps uuid globally unique instead. A BEFORE INSERT trigger on
+  data_order claims the uuid there and skips the row (RETURN NULL) when it is
+  taken, which is what ON CONFLICT DO NOTHING did for the plain table: the
+  row is neither stored nor returned by RETURNING. An AFTER trigger follows
+  updates and deletes. OrderPayload references it instead of data_order.
+
+Needs PostgreSQL 13+ (BEFORE ROW triggers on partitioned tables). Django's
+model state still says uuid is unique=True; never let a migration alter or
+drop that constraint on a converted database, it only exists through this
+trigger now. Rows only move between partitions through ensure(); the app
+never changes an order's payment_time.
+"""
+import gzip
+import os
+import re
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, OrderPayload
+from .payloads import archive_path, write_archive
+
+PARENT = Order._meta.db_table
+LEGACY = f"{PARENT}_legacy"
+UUID_TABLE = f"{PARENT}_uuid"
+DEFAULT_PARTITION = f"{PARENT}_default"
+SEQUENCE = f"{PARENT}_id_seq"
+TRIGGER = f"{PARENT}_uuid_sync"
+CLAIM_TRIGGER = f"{PARENT}_uuid_claim"
+FETCH_SIZE = 5000  # rows per round trip when streaming payloads out of a partition
+MOVE_FLAG = "data.partition_move"  # set locally while ensure() moves rows out of the default partition
+NAME_RE = re.compile(rf"^{PARENT}_p(\d{{4}})_(\d{{2}})$")
+
+TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION {CLAIM_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('{MOVE_FLAG}', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    INSERT INTO {UUID_TABLE} (uuid, payment_time) VALUES (NEW.uuid, NEW.payment_time)
+        ON CONFLICT (uuid) DO NOTHING;
+    IF NOT FOUND THEN
+        RETURN NULL;  -- uuid already stored: skip the row
+    END IF;
+    RETURN NEW;
+END $$;
+CREATE TRIGGER {CLAIM_TRIGGER} BEFORE INSERT ON {PARENT}
+    FOR EACH ROW EXECUTE FUNCTION {CLAIM_TRIGGER}();
+
+CREATE OR REPLACE FUNCTION {TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('{MOVE_FLAG}', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM {UUID_TABLE} WHERE uuid = OLD.uuid;
+    ELSIF NEW.uuid IS DISTINCT FROM OLD.uuid OR NEW.payment_time IS DISTINCT FROM OLD.payment_time THEN
+        UPDATE {UUID_TABLE} SET uuid = NEW.uuid, payment_time = NEW.payment_time WHERE uuid = OLD.uuid;
+    END IF;
+    RETURN NULL;
+END $$;
+CREATE TRIGGER {TRIGGER} AFTER UPDATE OR DELETE ON {PARENT}
+    FOR EACH ROW EXECUTE FUNCTION {TRIGGER}();
+"""
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [PARENT])
+        return cur.fetchone() is not None
+
+
+# -----------------------------
+# Months
+# -----------------------------
+def month_start(value):
+    """Aware local midnight of the first day of value's month."""
+    local = timezone.localtime(value) if isinstance(value, datetime) else value
+    return timezone.make_aware(datetime(local.year, local.month, 1))
+
+
+def add_months(month, n):
+    y, m = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return timezone.make_aware(datetime(y, m + 1, 1))
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month:%Y_%m}"
+
+
+def month_of(name):
+    match = NAME_RE.match(name)
+    return timezone.make_aware(datetime(int(match.group(1)), int(match.group(2)), 1)) if match else None
+
+
+def _literal(dt):
+    return f"'{dt.isoformat()}'"
+
+
+def partitions():
+    """[(name, month or None for the default partition, estimated rows)] oldest first."""
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT c.relname, c.reltuples::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+            [PARENT],
+        )
+        return [(name, month_of(name), max(0, rows)) for name, rows in cur.fetchall()]
+
+
+# -----------------------------
+# Operations
+# -----------------------------
+def ensure_partition(cur, month):
+    """
+    Create the partition of `month` unless it exists. Rows of that month already
+    in the default partition are moved into it first (their uuids stay put).
+    Returns True if it was created.
+    """
+    name = partition_name(month)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    if cur.fetchone()[0]:
+        return False
+    start, end = _literal(month), _literal(add_months(month, 1))
+    cur.execute(f"SET LOCAL {MOVE_FLAG} = 'on'")
+    cur.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)")
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", [DEFAULT_PARTITION])
+    if cur.fetchone()[0]:
+        cur.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE payment_time >= {start} AND payment_time < {end} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        )
+    cur.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})")
+    cur.execute(f"SET LOCAL {MOVE_FLAG} = 'off'")
+    return True
+
+
+def ensure(ahead=3, log=None):
+    """Partitions for this month and the next `ahead` ones. Returns the names created."""
+    log = log or (lambda msg: None)
+    first = month_start(timezone.now())
+    created = []
+    with transaction.atomic(), connection.cursor() as cur:
+        for n in range(ahead + 1):
+            month = add_months(first, n)
+            if ensure_partition(cur, month):
+                created.append(partition_name(month))
+                log(f"[PARTITION] created {partition_name(month)}")
+    return created
+
+
+def convert(ahead=3, log=None):
+    """
+    Turn a plain data_order into the partitioned layout, in one transaction
+    (data_order is locked for the whole copy).
+    """
+    log = log or (lambda msg: None)
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(f"ALTER TABLE {PARENT} RENAME TO {LEGACY}")
+        # index definitions and foreign keys to recreate on the new parent; uniques can't be global any more
+        cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexdef NOT LIKE 'CREATE UNIQUE%%'", [LEGACY])
+        indexes = [row[0] for row in cur.fetchall()]
+        cur.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [LEGACY],
+        )
+        foreign_keys = cur.fetchall()
+
+        # CONSTRAINTS: the CHECKs behind PositiveIntegerField etc.; NOT NULLs always come along
+        cur.execute(
+            f"CREATE TABLE {PARENT} (LIKE {LEGACY} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+            "PARTITION BY RANGE (payment_time)"
+        )
+
+        cur.execute(f"SELECT min(payment_time), count(*) FROM {LEGACY}")
+        oldest, total = cur.fetchone()
+        month, last = month_start(oldest or timezone.now()), add_months(month_start(timezone.now()), ahead)
+        while month <= last:
+            cur.execute(
+                f"CREATE TABLE {partition_name(month)} PARTITION OF {PARENT} "
+                f"FOR VALUES FROM ({_literal(month)}) TO ({_literal(add_months(month, 1))})"
+            )
+            month = add_months(month, 1)
+        cur.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT")
+
+        log(f"[CONVERT] copying {total} orders")
+        cur.execute(f"INSERT INTO {PARENT} SELECT * FROM {LEGACY}")
+        cur.execute(f"CREATE TABLE {UUID_TABLE} (uuid varchar(64) PRIMARY KEY, payment_time timestamptz NOT NULL)")
+        cur.execute(f"INSERT INTO {UUID_TABLE} (uuid, payment_time) SELECT uuid, payment_time FROM {LEGACY}")
+
+        # drops the legacy identity sequence and the OrderPayload -> data_order(uuid) key with it,
+        # and frees the index and constraint names for the new parent
+        cur.execute(f"DROP TABLE {LEGACY} CASCADE")
+        cur.execute(f"ALTER TABLE {PARENT} ADD CONSTRAINT {PARENT}_pkey PRIMARY KEY (id, payment_time)")
+        for indexdef in indexes:
+            cur.execute(indexdef.replace(f" ON public.{LEGACY} ", f" ON public.{PARENT} ").replace(f" ON {LEGACY} ", f" ON {PARENT} "))
+        for conname, definition in foreign_keys:
+            cur.execute(f"ALTER TABLE {PARENT} ADD CONSTRAINT {conname} {definition}")
+
+        cur.execute(f"CREATE SEQUENCE {SEQUENCE} OWNED BY {PARENT}.id")
+        cur.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT max(id) FROM {PARENT}), 0) + 1, false)")
+        cur.execute(f"ALTER TABLE {PARENT} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+
+        cur.execute(TRIGGER_SQL)
+        payload_table = OrderPayload._meta.db_table
+        cur.execute(
+            f"ALTER TABLE {payload_table} ADD CONSTRAINT {payload_table}_order_uuid_fk "
+            f"FOREIGN KEY (order_uuid) REFERENCES {UUID_TABLE} (uuid) DEFERRABLE INITIALLY DEFERRED"
+        )
+        cur.execute(f"ANALYZE {PARENT}")
+    log(f"[CONVERT] {PARENT} is partitioned by month ({len(partitions())} partitions)")
+
+
+def detach(before, archive_dir=None, log=None):
+    """
+    Detach the monthly partitions that end on or before `before` (aware datetime).
+    Detached tables stay in the database as plain tables; with `archive_dir`
+    each one is written to <archive_dir>/<name>.csv.gz, its payloads go to the
+    payload archive and the table is dropped. Their uuids stay in data_order_uuid,
+    so those orders are never imported again. Returns the names detached.
+    """
+    log = log or (lambda msg: None)
+    done = []
+    for name, month, _ in partitions():
+        if month is None or add_months(month, 1) > before:
+            continue
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+            if archive_dir:
+                path = _dump(cur, name, archive_dir)
+                moved = _archive_payloads(cur, name)
+                cur.execute(f"DROP TABLE {name}")
+                log(f"[PARTITION] {name} archived to {path} ({moved} payloads to the payload archive)")
+            else:
+                log(f"[PARTITION] {name} detached")
+        done.append(name)
+    return done
+
+
+def _dump(cur, name, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    sql = f"COPY (SELECT * FROM {name} ORDER BY payment_time, id) TO STDOUT WITH (FORMAT csv, HEADER)"
+    raw = cur.cursor
+    with open(path, "wb") as fh:
+        with gzip.GzipFile(fileobj=fh, mode="wb") as gz:
+            if hasattr(raw, "copy_expert"):  # psycopg2
+                raw.copy_expert(sql, gz)
+            else:  # psycopg 3
+                with raw.copy(sql) as copy:
+                    for data in copy:
+                        gz.write(bytes(data))
+        fh.flush()
+        os.fsync(fh.fileno())
+    return path
+
+
+def _archive_payloads(cur, name):
+    payload_table = OrderPayload._meta.db_table
+    # a server-side cursor streams the month's payloads into its zip instead of loading them at once
+    with connection.connection.cursor(name=f"{name}_payloads") as stream:
+        stream.execute(f"SELECT p.order_uuid, p.data FROM {payload_table} p JOIN {name} o ON o.uuid = p.order_uuid")
+        write_archive(archive_path(month_of(name)), _fetched(stream))
+    cur.execute(f"DELETE FROM {payload_table} p USING {name} o WHERE o.uuid = p.order_uuid")
+    return cur.rowcount
+
+
+def _fetched(cursor, size=FETCH_SIZE):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
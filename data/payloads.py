@@ -0,0 +1,177 @@
+# data/payloads.py
+"""
+Compact storage of the raw XY rows behind Order.source_payload.
+
+pack() drops the keys that can be rebuilt exactly from the order's own
+columns (uuid, ddbh, zfsj, zfje, chzt) and zlib-compresses the rest as JSON;
+unpack() reverses it. A key is only dropped when rebuilding it gives back the
+identical value, so unpack(pack(row)) == row.
+
+Payloads older than a cutoff can be moved out of the database by
+`python manage.py archive_payloads` into one zip per local month under
+PAYLOAD_ARCHIVE_DIR, one member per order uuid holding the same packed bytes;
+read_archived() gets them back. Each month's zip is rewritten once per run
+(write_archive() streams the rows in), and readers keep the zips they opened
+until the file is replaced.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+DROPPED = "~mapped"  # keys dropped by pack(), restored by unpack()
+OPEN_ARCHIVES = 12  # month zips read_archived() keeps open per process
+
+
+def mapped_values(uuid, source_order_no, payment_time, payment_amount, delivery_state):
+    """The XY row keys an order's columns can rebuild, with their rebuilt values."""
+    from .ingest import DELIVERY_STATE_MAP  # ingest imports the models, which import this module
+
+    values = {"uuid": uuid, "ddbh": source_order_no}
+    if payment_time is not None:
+        values["zfsj"] = timezone.localtime(payment_time).strftime("%Y-%m-%d %H:%M:%S")
+    if payment_amount is not None:
+        values["zfje"] = f"{Decimal(payment_amount):.2f}"
+    for code, state in DELIVERY_STATE_MAP.items():
+        if state == delivery_state:
+            values["chzt"] = code
+    return values
+
+
+def order_values(order):
+    return mapped_values(order.uuid, order.source_order_no, order.payment_time, order.payment_amount, order.delivery_state)
+
+
+def pack(row, mapped):
+    """Compressed bytes for `row`, without the keys whose value equals mapped[key]."""
+    dropped = [k for k, v in mapped.items() if k in row and row[k] == v and v is not None]
+    rest = {k: v for k, v in row.items() if k not in dropped}
+    if dropped:
+        rest[DROPPED] = dropped
+    return zlib.compress(json.dumps(rest, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack(data, mapped):
+    row = json.loads(zlib.decompress(bytes(data)).decode("utf-8"))
+    for k in row.pop(DROPPED, ()):
+        row[k] = mapped[k]
+    return row
+
+
+# -----------------------------
+# Archive files
+# -----------------------------
+def archive_dir():
+    return getattr(settings, "PAYLOAD_ARCHIVE_DIR", None) or os.path.join(settings.BASE_DIR, "archive", "payloads")
+
+
+def archive_path(payment_time):
+    return os.path.join(archive_dir(), f"{timezone.localtime(payment_time):%Y-%m}.zip")
+
+
+def write_archive(path, items):
+    """
+    Add `items` ({uuid: packed bytes}, or an iterable of (uuid, bytes) pairs
+    that is consumed once) to the zip at `path`; uuids already in it are
+    skipped. The new zip is written to a temp file next to it, fsynced and
+    moved over `path` with os.replace(), so a crash leaves either the old or
+    the new archive, never a torn one; the rows can be deleted once this
+    returns. The old zip is copied once per call, so callers pass a whole
+    month at a time. Returns members added.
+    """
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=folder)
+    added = 0
+    try:
+        with os.fdopen(fd, "w+b") as fh:
+            if os.path.exists(path):
+                with open(path, "rb") as old:
+                    shutil.copyfileobj(old, fh)
+            # members are already zlib-compressed: stored as-is
+            with zipfile.ZipFile(fh, "a", compression=zipfile.ZIP_STORED) as zf:
+                present = set(zf.namelist())
+                for uuid, data in (items.items() if isinstance(items, dict) else items):
+                    if uuid not in present:
+                        zf.writestr(uuid, bytes(data))
+                        present.add(uuid)
+                        added += 1
+            fh.flush()
+            os.fsync(fh.fileno())
+        _forget_archive(path)  # Windows cannot replace a file that is still open
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _fsync_dir(folder)
+    return added
+
+
+def _fsync_dir(folder):
+    """Make the rename itself durable (not supported on Windows)."""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_archives = OrderedDict()  # path -> ((mtime_ns, size, inode), ZipFile), least recently used first
+_archives_lock = threading.Lock()
+
+
+def _open_archive(path):
+    """
+    The open ZipFile for `path` (its central directory is read once), reopened
+    when the file was replaced; None if there is no such file. Call with
+    _archives_lock held.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _archives.pop(path, None)
+    if cached is not None and cached[0] == key:
+        _archives[path] = cached
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    _archives[path] = (key, zipfile.ZipFile(path))
+    while len(_archives) > OPEN_ARCHIVES:
+        _, (_, old) = _archives.popitem(last=False)
+        old.close()
+    return _archives[path][1]
+
+
+def _forget_archive(path):
+    with _archives_lock:
+        cached = _archives.pop(path, None)
+    if cached is not None:
+        cached[1].close()
+
+
+def read_archived(uuid, payment_time):
+    """Packed bytes of an archived payload, or None."""
+    with _archives_lock:
+        zf = _open_archive(archive_path(payment_time))
+        if zf is None:
+            return None
+        try:
+            return zf.read(uuid)
+        except KeyError:
+            return None
@@ -0,0 +1,131 @@
+# data/retry.py
+"""
+Retry / backoff policy for the XY sync.
+
+RetryPolicy gives jittered exponential delays bounded by a per-cycle time
+budget, and decides whether an empty queryDdxx page is worth retrying at all.
+CircuitBreaker stops hammering an account that keeps failing.
+"""
+import asyncio
+import random
+import threading
+import time
+
+
+class BudgetExceeded(Exception):
+    """The cycle's time budget ran out; the remaining work waits for the next cycle."""
+
+
+class CircuitOpen(Exception):
+    """The account's circuit breaker is open; its requests are skipped for now."""
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay=2.0, max_delay=30.0, jitter=0.5,
+                 empty_attempts=3, budget=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.empty_attempts = empty_attempts
+        self.budget = budget
+        self.deadline = None
+
+    def start_cycle(self):
+        """Arm the per-cycle budget (seconds); None means unbounded."""
+        self.deadline = time.monotonic() + self.budget if self.budget else None
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check_budget(self):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise BudgetExceeded("cycle time budget exhausted")
+
+    def delay(self, attempt):
+        """Exponential delay for `attempt` (1-based), randomly shortened by up to `jitter`."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return ceiling * (1 - self.jitter * random.random())
+
+    def _next_delay(self, attempt):
+        d = self.delay(attempt)
+        remaining = self.remaining()
+        if remaining is not None and remaining < d:
+            raise BudgetExceeded(f"cycle time budget exhausted ({remaining:.0f}s left, backoff {d:.0f}s)")
+        return d
+
+    def backoff(self, attempt):
+        """Sleep before retry `attempt`; raises BudgetExceeded instead of overrunning the budget."""
+        d = self._next_delay(attempt)
+        time.sleep(d)
+        return d
+
+    async def abackoff(self, attempt):
+        d = self._next_delay(attempt)
+        await asyncio.sleep(d)
+        return d
+
+    def empty_is_suspect(self, page, page_size, total, expected=False):
+        """
+        Should an empty page be retried?
+        Only when the evidence says rows are missing: the API's own `total`
+        reaches this page, or orders in this window are already stored
+        (`expected`). A page-1 total of 0 with no stored orders is a truly
+        empty window.
+        """
+        if total and total > (page - 1) * page_size:
+            return True
+        return bool(expected) and page == 1
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and skips the account for
+    `cooldown` seconds; then a single probe is let through (half-open).
+    """
+
+    def __init__(self, threshold=3, cooldown=300):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(f"circuit open after {self.failures} consecutive failures")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
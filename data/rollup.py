@@ -0,0 +1,150 @@
+# data/rollup.py
+"""
+DailyMachineSales maintenance.
+
+apply_orders() folds freshly inserted orders into the rollup with an atomic
+upsert (called from the sync ingest, inside its transaction); rebuild() recomputes a date range from
+the Order table. sales_by_machine_day() / breakdown() serve the reporting
+endpoints from it.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .dates import local_day_bounds
+from .models import DailyMachineSales, Order, SHIPPED_STATE
+
+BREAKDOWNS = ("machine", "day")
+
+
+def apply_orders(orders):
+    """
+    Add new (unsaved or just-inserted) Order objects to the rollup.
+    Only call this with orders that were really inserted, or they are counted twice.
+    """
+    deltas = defaultdict(lambda: [Decimal("0"), 0])
+    for o in orders:
+        if o.machine_id is None:
+            continue
+        key = (o.machine_id, timezone.localtime(o.payment_time).date(), o.delivery_state or "")
+        deltas[key][0] += o.payment_amount or Decimal("0")
+        deltas[key][1] += 1
+    if not deltas:
+        return 0
+
+    # one INSERT ... ON CONFLICT DO UPDATE adding the deltas (PostgreSQL and
+    # SQLite 3.24+): concurrent ingests never lose an increment or collide on
+    # the unique constraint. Sorted keys take the row locks in the same order.
+    ops = connection.ops
+    qn = ops.quote_name
+    table = qn(DailyMachineSales._meta.db_table)
+    columns = ["machine_id", "date", "delivery_state", "total_amount", "order_count", "updated_at"]
+    now = ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (machine_id, ops.adapt_datefield_value(day), state, ops.adapt_decimalfield_value(amount), count, now)
+        for (machine_id, day, state), (amount, count) in sorted(deltas.items())
+    ]
+    insert = f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) VALUES "
+    upsert = (
+        f" ON CONFLICT ({qn('machine_id')}, {qn('date')}, {qn('delivery_state')}) DO UPDATE SET "
+        + ", ".join(f"{qn(c)} = {table}.{qn(c)} + EXCLUDED.{qn(c)}" for c in ("total_amount", "order_count"))
+        + f", {qn('updated_at')} = EXCLUDED.{qn('updated_at')}"
+    )
+    batch_size = max(1, ops.bulk_batch_size(columns, rows))
+    with connection.cursor() as cur:
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            cur.execute(insert + ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(batch)) + upsert, [v for row in batch for v in row])
+    return len(deltas)
+
+
+def aggregate_orders(start_date, end_date, machine_ids=None):
+    """(machine_id, day, delivery_state, total, count) rows computed from Order."""
+    start, end = local_day_bounds(start_date, end_date)
+    qs = Order.objects.filter(payment_time__gte=start, payment_time__lt=end, machine__isnull=False)
+    if machine_ids is not None:
+        qs = qs.filter(machine_id__in=machine_ids)
+    return (
+        qs.annotate(day=TruncDate("payment_time", tzinfo=timezone.get_current_timezone()))
+        .values("machine_id", "day", "delivery_state")
+        .annotate(total=Sum("payment_amount"), count=Count("id"))
+        .order_by()
+    )
+
+
+@transaction.atomic
+def rebuild(start_date, end_date, machine_ids=None, batch_size=1000):
+    """Recompute the rollup for local days start_date..end_date (inclusive). Returns rows written."""
+    stale = DailyMachineSales.objects.filter(date__gte=start_date, date__lte=end_date)
+    if machine_ids is not None:
+        stale = stale.filter(machine_id__in=machine_ids)
+    stale.delete()
+
+    # NULL and "" delivery states share a rollup row
+    merged = defaultdict(lambda: [Decimal("0"), 0])
+    for r in aggregate_orders(start_date, end_date, machine_ids).iterator():
+        key = (r["machine_id"], r["day"], r["delivery_state"] or "")
+        merged[key][0] += r["total"] or 0
+        merged[key][1] += r["count"]
+
+    DailyMachineSales.objects.bulk_create(
+        [
+            DailyMachineSales(machine_id=m, date=d, delivery_state=state, total_amount=amount, order_count=count)
+            for (m, d, state), (amount, count) in merged.items()
+        ],
+        batch_size=batch_size,
+    )
+    return len(merged)
+
+
+def sales_by_machine_day(machine_numbers, start_date, end_date, delivery_state=SHIPPED_STATE):
+    """[(machine_number, date, total, count)] from one GROUP BY machine, day query."""
+    rows = (
+        DailyMachineSales.objects.filter(
+            machine__number__in=machine_numbers,
+            date__gte=start_date,
+            date__lte=end_date,
+            delivery_state=delivery_state,
+        )
+        .values("machine__number", "date")
+        .annotate(total=Sum("total_amount"), count=Sum("order_count"))
+        .order_by("machine__number", "date")
+    )
+    return [(r["machine__number"], r["date"], r["total"], r["count"]) for r in rows]
+
+
+def breakdown(rows, machine_numbers, by):
+    """
+    Shape sales_by_machine_day() rows into totals plus the `by` breakdowns
+    ("machine" and/or "day"). Every requested machine is listed, with zeros
+    when it sold nothing; with both, each machine also carries its days.
+    """
+    zero = Decimal("0.00")
+    per_machine = {n: {"machine_number": n, "total_sales": zero, "order_count": 0} for n in machine_numbers}
+    machine_days = defaultdict(list)
+    per_day = {}
+    for number, day, total, count in rows:
+        m = per_machine.setdefault(number, {"machine_number": number, "total_sales": zero, "order_count": 0})
+        m["total_sales"] += total
+        m["order_count"] += count
+        machine_days[number].append({"date": day, "total_sales": total, "order_count": count})
+        d = per_day.setdefault(day, {"date": day, "total_sales": zero, "order_count": 0})
+        d["total_sales"] += total
+        d["order_count"] += count
+
+    result = {
+        "total_sales": sum((r[2] for r in rows), zero),
+        "order_count": sum(r[3] for r in rows),
+    }
+    if "machine" in by:
+        result["machines"] = list(per_machine.values())
+        if "day" in by:
+            for m in result["machines"]:
+                m["days"] = machine_days.get(m["machine_number"], [])
+    elif "day" in by:
+        result["days"] = [per_day[d] for d in sorted(per_day)]
+    return result
@@ -0,0 +1,64 @@
+# data/schema.py
+"""
+Index definitions and migration operations that work on PostgreSQL and on
+the SQLite DEBUG database alike.
+
+NullsOrderedIndex keeps NULLS FIRST/LAST in its expressions on PostgreSQL.
+SQLite rejects the modifier in CREATE INDEX (ascending order already puts
+NULLs first there), so other databases get the plain order.
+
+The migration operations build indexes without blocking writes. On
+PostgreSQL they are django.contrib.postgres's AddIndexConcurrently /
+RemoveIndexConcurrently (CREATE/DROP INDEX CONCURRENTLY), so sync_orders
+and push_orders keep writing data_order while a large index is built.
+Other databases get the plain AddIndex / RemoveIndex. Migrations using
+them must set atomic = False.
+"""
+from copy import copy
+
+from django.contrib.postgres.operations import AddIndexConcurrently as PGAddIndexConcurrently
+from django.contrib.postgres.operations import RemoveIndexConcurrently as PGRemoveIndexConcurrently
+from django.db import models
+from django.db.migrations import AddIndex, RemoveIndex
+from django.db.models.expressions import OrderBy
+
+
+class NullsOrderedIndex(models.Index):
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if schema_editor.connection.vendor == "postgresql":
+            return super().create_sql(model, schema_editor, using, **kwargs)
+        index = copy(self)
+        index.expressions = tuple(
+            OrderBy(e.expression, descending=e.descending) if isinstance(e, OrderBy) else e
+            for e in self.expressions
+        )
+        return models.Index.create_sql(index, model, schema_editor, using, **kwargs)
+
+
+class AddIndexConcurrently(PGAddIndexConcurrently):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+
+class RemoveIndexConcurrently(PGRemoveIndexConcurrently):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            RemoveIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            RemoveIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
@@ -2,6 +2,85 @@ from rest_framework import serializers
 from .models import Order
 
 class OrderSerializer(serializers.ModelSerializer):
+    source_payload = serializers.JSONField(read_only=True)
+
     class Meta:
         model = Order
         fields = '__all__'
+
+
+class InvalidFields(ValueError):
+    """Unknown name in the `fields` / `expand` query parameters."""
+
+
+class OrderReadSerializer(serializers.ModelSerializer):
+    """
+    Lean read-only order rows for the report endpoints.
+
+    Serializes DEFAULT_FIELDS unless given `fields=[...]` (any Order field or
+    machine_number). source_payload is heavy and only included on request
+    (expand=source_payload). Pair with optimize() so only those columns are read.
+    """
+    DEFAULT_FIELDS = (
+        'id', 'uuid', 'source_order_no', 'machine_number', 'product_name', 'slot_number',
+        'payment_amount', 'payment_time', 'payment_type', 'payment_status', 'delivery_state',
+    )
+    EXPANDABLE = ('source_payload',)
+
+    # columns Order.source_payload needs to rebuild the keys packing dropped
+    PAYLOAD_COLUMNS = ('uuid', 'source_order_no', 'payment_time', 'payment_amount', 'delivery_state')
+
+    machine_number = serializers.CharField(source='machine.number', read_only=True, allow_null=True)
+    source_payload = serializers.JSONField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            name for f in Order._meta.concrete_fields
+            for name in ((f.name, 'machine_number') if f.name == 'machine' else (f.name,))
+        ] + ['source_payload']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def available_fields(cls):
+        return cls.Meta.fields
+
+    @classmethod
+    def select_fields(cls, fields_param=None, expand_param=None):
+        """Field list from the comma separated `fields` / `expand` query parameters."""
+        def split(value):
+            return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+        fields = split(fields_param) or list(cls.DEFAULT_FIELDS)
+        expand = split(expand_param)
+        unknown = [f for f in fields if f not in cls.available_fields()]
+        unknown += [e for e in expand if e not in cls.EXPANDABLE]
+        if unknown:
+            raise InvalidFields(f"Unknown field(s): {', '.join(unknown)}.")
+        return fields + [e for e in expand if e not in fields]
+
+    @staticmethod
+    def optimize(queryset, fields):
+        """
+        Restrict the queryset to the columns `fields` need (payment_time/id are kept
+        for ordering and cursors); source_payload comes from one prefetch query per batch.
+        """
+        columns = {'id', 'payment_time'}
+        for name in fields:
+            if name == 'machine_number':
+                columns.add('machine__number')
+            elif name == 'machine':
+                columns.add('machine_id')
+            elif name == 'source_payload':
+                columns.update(OrderReadSerializer.PAYLOAD_COLUMNS)
+                queryset = queryset.prefetch_related('payload')
+            else:
+                columns.add(name)
+        if 'machine__number' in columns:
+            queryset = queryset.select_related('machine')
+        return queryset.only(*columns)
@@ -1,3 +1,5 @@
+# Superseded by `python manage.py push_orders` (data/outbound.py, data/odoo_client.py),
+# which sends the same payload from a background queue instead of inside save().
 # # data/signals.py
 # import requests
 # from django.db.models.signals import post_save
@@ -0,0 +1,256 @@
+# data/stubs.py
+"""
+Local stand-ins for the XY vending API and the Odoo order endpoint, for
+exercising the clients offline.
+
+    server = XYStubServer(rows, accounts={"demo": "secret"}).start()
+    client = XYApiClient("demo", "secret", print, base_url=server.url)
+    ...
+    server.stop()
+
+XYStubServer implements getCheckCode / onLogin (same md5 scheme as the real
+API) and queryDdxx with zfsj range filtering, cjsj-desc pagination and the
+"本页小计" summary row appended to every page. It can also answer transient
+empty pages (with the real total, as the XY API does under load) and add a
+fixed latency to every request. data.synthetic.xy_rows() generates rows for it.
+
+OdooStubServer implements create_order_by_name and its batch variant: it
+checks the API key, returns a stable id per uuid (so re-sends are
+idempotent) and can be told to fail requests or single items, to exercise
+push_orders' retries.
+"""
+import bisect
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .odoo_client import DEFAULT_BATCH_PATH, DEFAULT_ORDER_PATH
+from .xy_client import CHECK_CODE_PATH, LOGIN_PATH, ORDERS_PATH, SUMMARY_ROW, _login_payload
+
+
+class _StubServer:
+    """Threaded JSON-over-HTTP server; subclasses implement handle_get / handle_post."""
+
+    thread_name = "stub"
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.requests = []  # (path, payload) log, handy for assertions
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=self.thread_name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle_get(self, path, headers):
+        """(status, payload) or None for 404."""
+        return None
+
+    def handle_post(self, path, body, headers):
+        return None
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def _reply(self, result):
+                if result is None:
+                    return self.send_error(404)
+                code, payload = result
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json;charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests.append((self.path, None))
+                self._reply(stub.handle_get(self.path, self.headers))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with stub.lock:
+                    stub.requests.append((self.path, body))
+                self._reply(stub.handle_post(self.path, body, self.headers))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class XYStubServer(_StubServer):
+    """
+    empty_next: answer the next N queryDdxx requests with an empty page.
+    empty_rate: answer this fraction of queryDdxx requests with an empty page (seeded).
+    latency: seconds added to every request.
+    """
+    thread_name = "xy-stub"
+
+    def __init__(self, rows=None, accounts=None, empty_next=0, empty_rate=0.0, latency=0.0, seed=0,
+                 host="127.0.0.1", port=0):
+        self.accounts = dict(accounts or {})
+        self.check_codes = {}
+        self.sessions = {}
+        self.empty_next = empty_next
+        self.empty_rate = empty_rate
+        self.empties = 0
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.set_rows(rows or [])
+        super().__init__(host, port)
+
+    def set_rows(self, rows):
+        """Replace the rows queryDdxx serves (e.g. new orders arriving between sync cycles; not while requests run)."""
+        self.rows = sorted(rows, key=lambda r: str(r.get("cjsj") or r.get("zfsj") or ""), reverse=True)
+        # ascending zfsj of the rows when they are also in zfsj order (generated data): ranges by bisect
+        keys = [str(r.get("zfsj") or "") for r in reversed(self.rows)]
+        self.zfsj_keys = keys if all(a <= b for a, b in zip(keys, keys[1:])) else None
+
+    # ---- API behaviour ----
+    def check_code(self):
+        code = str(secrets.randbelow(9000) + 1000)
+        with self.lock:
+            self.check_codes[code] = True
+        return {"code": "H0000", "data": code}
+
+    def login(self, body):
+        username = body.get("account") or ""
+        check_code = body.get("checkCode") or ""
+        with self.lock:
+            known = self.check_codes.pop(check_code, False)
+        password = self.accounts.get(username)
+        if not known or password is None:
+            return {"code": "H0001", "msg": "login failed"}
+        if _login_payload(username, password, check_code)["password"] != body.get("password"):
+            return {"code": "H0001", "msg": "wrong password"}
+        key = secrets.token_hex(16)
+        with self.lock:
+            self.sessions[key] = username
+        return {"code": "H0000", "data": {"session_key": key}}
+
+    def matching_rows(self, body):
+        start, end = body.get("starttime") or "", body.get("endtime") or "9999"
+        shbh = body.get("shbh")
+        if self.zfsj_keys is not None:
+            n = len(self.rows)
+            rows = self.rows[n - bisect.bisect_left(self.zfsj_keys, end):n - bisect.bisect_left(self.zfsj_keys, start)]
+            return [r for r in rows if r.get("shbh", shbh) == shbh] if shbh else rows
+        return [
+            r for r in self.rows
+            if start <= str(r.get("zfsj") or "") < end and (not shbh or r.get("shbh", shbh) == shbh)
+        ]
+
+    def _transient_empty(self):
+        with self.lock:
+            if self.empty_next > 0:
+                self.empty_next -= 1
+            elif not (self.empty_rate and self.rng.random() < self.empty_rate):
+                return False
+            self.empties += 1
+            return True
+
+    def query_orders(self, body, session_key):
+        if session_key not in self.sessions:
+            return {"code": "H0401", "msg": "session expired"}
+        rows = self.matching_rows(body)
+        page_num = int(body.get("pageNum") or 1)
+        page_size = int(body.get("pageSize") or 100)
+        page = rows[(page_num - 1) * page_size:page_num * page_size]
+        if page and self._transient_empty():
+            page = []
+        if page:
+            page = page + [{"shmc": SUMMARY_ROW, "zfje": sum(float(r.get("zfje") or 0) for r in page)}]
+        return {"code": "H0000", "data": {"data": page, "total": len(rows)}}
+
+    def handle_get(self, path, headers):
+        if self.latency:
+            time.sleep(self.latency)
+        if path == CHECK_CODE_PATH:
+            return 200, self.check_code()
+        return None
+
+    def handle_post(self, path, body, headers):
+        if self.latency:
+            time.sleep(self.latency)
+        if path == LOGIN_PATH:
+            return 200, self.login(body)
+        if path == ORDERS_PATH:
+            return 200, self.query_orders(body, headers.get("Authorization"))
+        return None
+
+
+class OdooStubServer(_StubServer):
+    """
+    fail_next: answer the next N requests (single or batch) with HTTP 503.
+    reject: uuids answered with a non-retryable error.
+    flaky: {uuid: n} items answered with a retryable error n times.
+    batch_path=None: no batch endpoint (404), like an Odoo without it.
+    """
+    thread_name = "odoo-stub"
+
+    def __init__(self, api_key="", order_path=DEFAULT_ORDER_PATH, batch_path=DEFAULT_BATCH_PATH,
+                 fail_next=0, reject=(), flaky=None, host="127.0.0.1", port=0):
+        self.api_key = api_key
+        self.order_path = order_path
+        self.batch_path = batch_path
+        self.fail_next = fail_next
+        self.reject = set(reject)
+        self.flaky = dict(flaky or {})
+        self.orders = {}  # uuid -> (id, payload)
+        self.posts = {}   # uuid -> times received
+        super().__init__(host, port)
+
+    def _unavailable(self):
+        with self.lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+        return False
+
+    def create_item(self, body):
+        """Result dict for one order payload."""
+        uuid = body.get("uuid")
+        with self.lock:
+            self.posts[uuid] = self.posts.get(uuid, 0) + 1
+            if not uuid or not body.get("machine_number"):
+                return {"uuid": uuid, "error": "uuid and machine_number are required", "retryable": False}
+            if uuid in self.reject:
+                return {"uuid": uuid, "error": f"order {uuid} rejected", "retryable": False}
+            if self.flaky.get(uuid, 0) > 0:
+                self.flaky[uuid] -= 1
+                return {"uuid": uuid, "error": "could not serialize access, try again", "retryable": True}
+            if uuid not in self.orders:
+                self.orders[uuid] = (len(self.orders) + 1, body)
+            order_id = self.orders[uuid][0]
+        return {"uuid": uuid, "id": order_id, "name": f"POS/{order_id:05d}"}
+
+    def handle_post(self, path, body, headers):
+        if path not in (self.order_path, self.batch_path):
+            return None
+        if self.api_key and headers.get("Authorization") != self.api_key:
+            return 401, {"error": "invalid api key"}
+        if self._unavailable():
+            return 503, {"error": "temporarily unavailable"}
+        if path == self.order_path:
+            return 200, {"jsonrpc": "2.0", "result": self.create_item(body)}
+        return 200, {"jsonrpc": "2.0", "result": {"results": [self.create_item(o) for o in body.get("orders") or []]}}
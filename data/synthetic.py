@@ -0,0 +1,126 @@
+# data/synthetic.py
+"""
+Synthetic orders for benchmarks.
+
+Everything lives under one "bench" xy_account with BENCH-nnnn machines and
+"bench-" uuids, so it can sit next to real data and be removed with clear().
+seed_orders() writes Order rows directly; xy_rows() makes raw queryDdxx rows
+for data.stubs.XYStubServer, to go through the real sync and ingest.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .ingest import DELIVERY_STATE_MAP
+from .models import SHIPPED_STATE, xy_account as XYAccount, machine as Machine, Order, OrderPayload
+from .rollup import rebuild
+
+
+BENCH_ACCOUNT = "bench"
+UUID_PREFIX = "bench-"
+SHIPPED_CHZT = next(code for code, state in DELIVERY_STATE_MAP.items() if state == SHIPPED_STATE)
+OTHER_CHZT = [code for code in DELIVERY_STATE_MAP if code != SHIPPED_CHZT]
+
+
+def _payload(n, number, name, amount, payment_time, chzt, slot="1"):
+    """A queryDdxx-shaped row, roughly the size of a real one."""
+    ts = timezone.localtime(payment_time).strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "uuid": f"{UUID_PREFIX}{n}", "ddbh": f"B{n}", "dsfjybh": f"T{str(n).zfill(12)}", "dsfshdh": None,
+        "jqbh": number, "jqmc": name, "shbh": BENCH_ACCOUNT, "shmc": "Bench merchant",
+        "spmc": "Bench item", "spbh": "SKU-0001", "hdbh": slot, "extend2": f"Bench item:{slot}",
+        "zfje": str(amount), "ddzj": str(amount), "spzj": str(amount), "yhje": "0.00",
+        "zfsj": ts, "cjsj": ts, "zffs": "unionpay", "zfzt": "1", "showzfzt": "paid",
+        "chzt": str(chzt), "tkzt": "0", "tkje": "0.00", "sl": 1, "bz": "",
+    }
+
+
+def machine_numbers(count):
+    return [f"BENCH-{i:04d}" for i in range(count)]
+
+
+def bench_machines(count):
+    account, _ = XYAccount.objects.get_or_create(username=BENCH_ACCOUNT, defaults={"password": ""})
+    numbers = machine_numbers(count)
+    existing = set(Machine.objects.filter(number__in=numbers).values_list("number", flat=True))
+    Machine.objects.bulk_create([
+        Machine(number=n, name=f"Bench {n}", xy_account=account) for n in numbers if n not in existing
+    ])
+    return list(Machine.objects.filter(number__in=numbers).order_by("number"))
+
+
+def seed_orders(count, machines=50, days=365, end=None, batch_size=5000, seed=0, log=None):
+    """
+    Top the bench data up to `count` orders spread uniformly over the `days`
+    before `end` (default now), ~70% of them "Goods Shipped", and rebuild the
+    DailyMachineSales rollup for the bench machines. Returns the number added.
+    """
+    log = log or (lambda msg: None)
+    rng = random.Random(seed)
+    have = Order.objects.filter(uuid__startswith=UUID_PREFIX).count()
+    if have >= count:
+        return 0
+    pool = bench_machines(machines)
+    end = end or timezone.now()
+    span = int(timedelta(days=days).total_seconds())
+
+    added = 0
+    for batch_start in range(have, count, batch_size):
+        batch = []
+        for n in range(batch_start, min(count, batch_start + batch_size)):
+            chzt = SHIPPED_CHZT if rng.random() < 0.7 else rng.choice(OTHER_CHZT)
+            machine = rng.choice(pool)
+            amount = Decimal(rng.randint(500, 5000)) / 100
+            payment_time = end - timedelta(seconds=rng.randrange(span))
+            batch.append(Order(
+                uuid=f"{UUID_PREFIX}{n}",
+                source_order_no=f"B{n}",
+                machine=machine,
+                product_name="Bench item",
+                slot_number=str(rng.randint(1, 60)),
+                payment_amount=amount,
+                payment_time=payment_time,
+                payment_type="wallet",
+                delivery_state=DELIVERY_STATE_MAP[chzt],
+                source_payload=_payload(n, machine.number, machine.name, amount, payment_time, chzt),
+            ))
+        with transaction.atomic():
+            Order.objects.bulk_create(batch, batch_size=1000, ignore_conflicts=True)
+            OrderPayload.objects.bulk_create(OrderPayload.for_orders(batch), batch_size=1000, ignore_conflicts=True)
+        added += len(batch)
+        log(f"[SEED] {have + added}/{count} orders")
+    rebuild(timezone.localtime(end - timedelta(seconds=span)).date(), timezone.localtime(end).date(),
+            machine_ids=[m.pk for m in pool])
+    return added
+
+
+def xy_rows(machines=50, days=30, per_day=20, end=None, seed=0, prefix="xy-"):
+    """
+    Raw XY rows for `machines` machines over the `days` local days up to `end`
+    (default now): `per_day` orders per machine and day on average, with
+    busier and quieter machines, ~70% shipped, the rest in random delivery states. uuids are
+    "bench-<prefix><n>", so they never clash with seed_orders().
+    """
+    rng = random.Random(seed)
+    end = timezone.localtime(end or timezone.now())
+    first = end - timedelta(days=days)
+    span = int((end - first).total_seconds())
+    per_machine = days * per_day
+    n = 0
+    for number in machine_numbers(machines):
+        for _ in range(rng.randint(0, 2 * per_machine)):
+            payment_time = first + timedelta(seconds=rng.randrange(span))
+            chzt = SHIPPED_CHZT if rng.random() < 0.7 else rng.choice(list(DELIVERY_STATE_MAP))
+            amount = Decimal(rng.randint(500, 5000)) / 100
+            yield _payload(f"{prefix}{n}", number, f"Bench {number}", amount, payment_time, chzt, str(rng.randint(1, 60)))
+            n += 1
+
+
+@transaction.atomic
+def clear():
+    """Remove all bench orders, machines and the bench account."""
+    Order.objects.filter(uuid__startswith=UUID_PREFIX).delete()
+    XYAccount.objects.filter(username=BENCH_ACCOUNT).delete()
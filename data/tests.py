@@ -1,3 +1,1088 @@
-from django.test import TestCase
+import csv
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DataError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, Max, Min, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache as sales_cache, ingest, partitions, payloads, synthetic
+from .backfill import BulkLoader, NULL, _copy_value, copy_in
+from .chunker import AdaptiveChunker
+from .dates import parse_date_range, payment_time_filter
+from .ingest import MachineRegistry, ingest_page, insert_orders, parse_row
+from .metrics import Metrics, metrics
+from .management.commands.sync_orders import AccountFetch, Chunk, Command as SyncOrdersCommand
+from .models import PUSH_QUEUE_STATES, SHIPPED_STATE, xy_account, machine as Machine, DailyMachineSales, Order, OrderPayload, SyncCursor
+from .odoo_client import OdooClient, order_payload
+from .outbound import ERROR, FAILED, SENT, PushResult, claim_batch, push, push_queue, record_results, renew_lease
+from .retry import CircuitBreaker, RetryPolicy
+from .rollup import apply_orders
+from .serializers import OrderReadSerializer
+from .stubs import OdooStubServer, XYStubServer
+from .xy_client import LOGIN_PATH, AsyncLoopThread, AsyncXYApiClient, XYApiClient, _is_auth_failure
+
+
+def postgresql_only(cls):
+    return skipUnless(connection.vendor == "postgresql", "needs PostgreSQL")(cls)
+
+
+def xy_rows(count, prefix="t-", days=30, machines=3, seed=0):
+    """`count` raw XY rows from the synthetic generator."""
+    rows = list(synthetic.xy_rows(machines=machines, days=days, per_day=max(1, count // (machines * days) + 1), seed=seed, prefix=prefix))
+    return rows[:count]
+
+
+def rollup_totals():
+    """{machine_id: (amount, count)} from DailyMachineSales."""
+    return {
+        r["machine_id"]: (r["amount"], r["count"])
+        for r in DailyMachineSales.objects.values("machine_id").annotate(amount=Sum("total_amount"), count=Sum("order_count"))
+    }
+
+
+def order_totals():
+    """{machine_id: (amount, count)} straight from data_order."""
+    return {
+        r["machine_id"]: (r["amount"], r["count"])
+        for r in Order.objects.exclude(machine=None).values("machine_id").annotate(amount=Sum("payment_amount"), count=Count("id"))
+    }
+
+
+@postgresql_only
+class PartitionedOrderTests(TestCase):
+    def setUp(self):
+        self.account = xy_account.objects.create(username="part", password="")
+        self.rows = xy_rows(60, prefix="part-", days=70)
+        ingest_page(self.rows[:30], self.account)
+        partitions.convert(ahead=1)
+
+    def test_convert_keeps_orders_checks_and_payloads(self):
+        self.assertTrue(partitions.is_partitioned())
+        self.assertEqual(Order.objects.count(), 30)
+        with connection.cursor() as cur:
+            cur.execute(f"SELECT count(*) FROM pg_constraint WHERE conrelid = to_regclass('{partitions.PARENT}') AND contype = 'c'")
+            self.assertGreater(cur.fetchone()[0], 0)  # attempts >= 0
+            cur.execute(f"SELECT count(*) FROM {partitions.UUID_TABLE}")
+            self.assertEqual(cur.fetchone()[0], 30)
+        order = Order.objects.get(uuid=self.rows[0]["uuid"])
+        self.assertEqual(order.source_payload, self.rows[0])
+
+    def test_ingest_on_partitioned_table_skips_stored_uuids(self):
+        result = ingest_page(self.rows, self.account)
+        self.assertEqual((result.inserted, result.skipped), (30, 30))
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertEqual(rollup_totals(), order_totals())
+
+        # a stored uuid re-sent with another payment_time misses the pruned lookup; the trigger skips it
+        moved = Order(uuid=self.rows[0]["uuid"], payment_time=timezone.now() - timedelta(days=400))
+        self.assertEqual(insert_orders([moved]), set())
+        self.assertEqual(Order.objects.filter(uuid=self.rows[0]["uuid"]).count(), 1)
+
+
+@postgresql_only
+class QueryPlanTests(TestCase):
+    """The hot queries use their indexes (the checks of `bench query-plans`)."""
+
+    def setUp(self):
+        synthetic.seed_orders(3000, machines=10, days=30)
+        with connection.cursor() as cur:
+            cur.execute("ANALYZE data_order")
+            cur.execute("SET LOCAL enable_seqscan = off")  # a test-sized table is cheaper to scan
+        today = timezone.localdate()
+        self.bounds = payment_time_filter(parse_date_range((today - timedelta(days=6)).isoformat(), today.isoformat()))
+        self.number = synthetic.machine_numbers(1)[0]
+
+    def assertUsesIndex(self, qs, index):
+        plan = qs.explain(analyze=True)
+        self.assertIn(index, plan, plan)
+
+    def test_sales_report_uses_machine_paytime_index(self):
+        qs = Order.objects.filter(machine__number=self.number, **self.bounds).order_by("-payment_time")
+        self.assertUsesIndex(qs, "order_machine_paytime_idx")
+
+    def test_shipped_sales_sum_uses_shipped_sales_index(self):
+        qs = Order.objects.filter(machine__number=self.number, delivery_state=SHIPPED_STATE, **self.bounds).values_list("payment_amount")
+        self.assertUsesIndex(qs, "order_shipped_sales_idx")
+
+    def test_push_queue_uses_push_queue_index(self):
+        self.assertUsesIndex(push_queue(timezone.now())[:100], "order_push_queue_idx")
+
+
+class MachinesTotalSalesInputTests(TestCase):
+    url = "/api/machines-total-sales/"
+    dates = {"start_date": "2025-03-01", "end_date": "2025-03-31"}
+
+    def post(self, body):
+        return self.client.post(self.url, body, content_type="application/json")
+
+    def test_rejects_bad_machine_numbers_and_non_object_bodies(self):
+        for body in ({"machine_numbers": 12345, **self.dates}, {"machine_numbers": ["M1", 2], **self.dates}, [1, 2], '"M1"'):
+            with self.subTest(body=body):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+    def test_accepts_a_string_or_a_list_of_strings(self):
+        for numbers in ("M1, M2", ["M1", "M2"]):
+            with self.subTest(numbers=numbers):
+                response = self.post({"machine_numbers": numbers, **self.dates})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["machine_numbers"], ["M1", "M2"])
+        response = self.client.get(self.url, {"machine_numbers": "M1,M2", **self.dates})
+        self.assertEqual(response.status_code, 200)
+
+
+class DateRangeTests(TestCase):
+    def test_local_days_become_half_open_bounds(self):
+        cairo = ZoneInfo(settings.TIME_ZONE)
+        date_range = parse_date_range(" 2026-03-01", "2026-03-02 ")
+        self.assertEqual((date_range.start_date.isoformat(), date_range.end_date.isoformat()), ("2026-03-01", "2026-03-02"))
+        self.assertEqual((date_range.start, date_range.end), (datetime(2026, 3, 1, tzinfo=cairo), datetime(2026, 3, 3, tzinfo=cairo)))
+        with timezone.override(ZoneInfo("Europe/Berlin")):
+            date_range = parse_date_range("2026-03-29", "2026-03-29")  # clocks go forward: a 23-hour day
+        self.assertEqual(date_range.end.timestamp() - date_range.start.timestamp(), timedelta(hours=23).total_seconds())
+
+    def test_sales_report_covers_both_end_days_exactly(self):
+        cairo = ZoneInfo(settings.TIME_ZONE)
+        machine = Machine.objects.create(name="Edges", number="EDGES")
+        times = {
+            "before": datetime(2026, 2, 28, 23, 59, 59, 999999, tzinfo=cairo),
+            "first": datetime(2026, 3, 1, tzinfo=cairo),
+            "last": datetime(2026, 3, 2, 23, 59, 59, 999999, tzinfo=cairo),
+            "after": datetime(2026, 3, 3, tzinfo=cairo),
+        }
+        for uuid, paid in times.items():
+            Order.objects.create(uuid=uuid, machine=machine, payment_time=paid, payment_amount=Decimal("1.00"))
+        response = self.client.get("/api/sales-report/", {"machine_number": "EDGES", "start_date": "2026-03-01", "end_date": "2026-03-02"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["uuid"] for row in response.json()], ["last", "first"])
+
+    def test_malformed_or_reversed_dates_are_a_400(self):
+        endpoints = {
+            "/api/total-sales/": {"machine_number": "M1"},
+            "/api/machines-total-sales/": {"machine_numbers": "M1"},
+            "/api/sales-report/": {"machine_number": "M1"},
+        }
+        dates = (
+            ("2026-03-1x", "2026-03-02", "start_date"),
+            ("2026-03-01", "2026-02-30", "end_date"),
+            ("01/03/2026", "2026-03-02", "start_date"),
+            ("2026-03-02", "2026-03-01", "after end_date"),
+        )
+        for url, params in endpoints.items():
+            for start, end, named in dates:
+                with self.subTest(url=url, start=start, end=end):
+                    response = self.client.get(url, {**params, "start_date": start, "end_date": end})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(named, response.json()["error"])
+
+
+class BulkLoaderTests(TestCase):
+    """COPY + ON CONFLICT on PostgreSQL (with the driver Django runs on), insert_orders elsewhere."""
+
+    def setUp(self):
+        self.account = xy_account.objects.create(username="bulk", password="")
+        self.rows = xy_rows(120, prefix="bulk-")
+
+    def test_batches_skip_stored_orders_and_write_payloads_for_new_ones(self):
+        ingest_page(self.rows[:40], self.account)
+        loader = BulkLoader(batch_rows=50)
+        for i in range(0, len(self.rows), 30):
+            loader.add(self.rows[i:i + 30], self.account)
+        self.assertEqual(loader.finish(), 80)
+
+        self.assertEqual(Order.objects.count(), 120)
+        self.assertEqual(OrderPayload.objects.count(), 120)
+        self.assertEqual(Order.objects.get(uuid=self.rows[-1]["uuid"]).source_payload, self.rows[-1])
+        self.assertEqual(rollup_totals(), order_totals())
+        latest = max(o.payment_time for o in Order.objects.filter(machine__number=self.rows[0]["jqbh"]))
+        self.assertEqual(Order.objects.get(uuid=self.rows[0]["uuid"]).machine.last_order, latest)
+
+        loader.add(self.rows, self.account)
+        self.assertEqual(loader.finish(), 0)
+        self.assertEqual(Order.objects.count(), 120)
+
+    def test_a_failed_flush_keeps_the_buffered_rows(self):
+        loader = BulkLoader(batch_rows=1000)
+        loader.add(self.rows[:30], self.account)
+        merge = "_copy_merge" if connection.vendor == "postgresql" else "_bulk_insert"
+        with mock.patch.object(BulkLoader, merge, side_effect=RuntimeError("merge failed")):
+            with self.assertRaisesMessage(RuntimeError, "merge failed"):
+                loader.flush()
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(len(loader.buffer), 30)
+        self.assertEqual(loader.finish(), 30)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertEqual(rollup_totals(), order_totals())
+
+    def test_failed_backfill_cycle_still_writes_staged_rows(self):
+        def failing_cycle(command, *args, **kwargs):
+            command.loader.add(self.rows[:25], self.account)
+            raise RuntimeError("XY went away")
+
+        with mock.patch.object(SyncOrdersCommand, "_run_cycle", failing_cycle), \
+                mock.patch.object(connection, "close"):
+            call_command("sync_orders", "--backfill", "--start", "2025-01-01", "--batch-rows", "1000", stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Order.objects.count(), 25)
+        self.assertEqual(rollup_totals(), order_totals())
+
+
+@postgresql_only
+class CopyDriverTests(TestCase):
+    """copy_in() and the staging merge through psycopg2 (copy_expert) and psycopg 3 (copy)."""
+
+    def check_driver(self, module):
+        try:
+            driver = importlib.import_module(module)
+        except ImportError:
+            self.skipTest(f"{module} is not installed")
+        settings = connection.settings_dict
+        conn = driver.connect(
+            dbname=settings["NAME"], user=settings["USER"], password=settings["PASSWORD"],
+            host=settings["HOST"] or None, port=settings["PORT"] or None,
+        )
+        try:
+            cur = conn.cursor()
+            cur.execute("CREATE TEMP TABLE copy_target (uuid text PRIMARY KEY, paid timestamptz, data bytea, extra jsonb, flag boolean)")
+            cur.execute("CREATE TEMP TABLE copy_stage (LIKE copy_target)")
+            cur.execute("INSERT INTO copy_target (uuid) VALUES ('a')")
+            now = timezone.now()
+            rows = [("a", now, b"\x00\x01", {"k": "v"}, True), ("b", now, b"\xff", None, False), ("c", None, None, [1, "x"], None)]
+            buf = io.StringIO()
+            csv.writer(buf).writerows([_copy_value(v) for v in row] for row in rows)
+            copy_in(cur, f"COPY copy_stage FROM STDIN WITH (FORMAT csv, NULL '{NULL}')", buf.getvalue())
+            cur.execute("INSERT INTO copy_target SELECT * FROM copy_stage ON CONFLICT (uuid) DO NOTHING RETURNING uuid")
+            self.assertEqual(sorted(r[0] for r in cur.fetchall()), ["b", "c"])
+            cur.execute("SELECT data, extra, flag FROM copy_target WHERE uuid = 'b'")
+            data_b, extra_b, flag_b = cur.fetchone()
+            self.assertEqual((bytes(data_b), extra_b, flag_b), (b"\xff", None, False))
+            cur.execute("SELECT extra, paid FROM copy_target WHERE uuid = 'c'")
+            self.assertEqual(cur.fetchone(), ([1, "x"], None))
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def test_psycopg2(self):
+        self.check_driver("psycopg2")
+
+    def test_psycopg3(self):
+        self.check_driver("psycopg")
+
+
+class PayloadArchiveTests(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, "2025-01.zip")
+
+    def test_appends_new_members_and_leaves_no_temp_files(self):
+        self.assertEqual(payloads.write_archive(self.path, {"a": b"1", "b": b"2"}), 2)
+        self.assertEqual(payloads.write_archive(self.path, {"b": b"x", "c": b"3"}), 1)
+        with zipfile.ZipFile(self.path) as zf:
+            self.assertEqual({n: zf.read(n) for n in zf.namelist()}, {"a": b"1", "b": b"2", "c": b"3"})
+        self.assertEqual(os.listdir(self.folder), ["2025-01.zip"])
+
+    def test_failed_write_keeps_the_old_archive(self):
+        payloads.write_archive(self.path, {"a": b"1"})
+        with open(self.path, "rb") as fh:
+            before = fh.read()
+        with mock.patch("data.payloads.os.replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                payloads.write_archive(self.path, {"b": b"2"})
+        with open(self.path, "rb") as fh:
+            self.assertEqual(fh.read(), before)
+        self.assertEqual(os.listdir(self.folder), ["2025-01.zip"])
+
+    def test_reads_keep_the_zip_open_until_it_is_replaced(self):
+        payloads.write_archive(self.path, {"a": b"1"})
+        self.addCleanup(payloads._forget_archive, self.path)
+        paid = timezone.make_aware(datetime(2025, 1, 15, 12, 0))
+        with override_settings(PAYLOAD_ARCHIVE_DIR=self.folder):
+            self.assertEqual(payloads.read_archived("a", paid), b"1")
+            opened = payloads._archives[self.path][1]
+            self.assertIsNone(payloads.read_archived("b", paid))
+            self.assertIs(payloads._archives[self.path][1], opened)
+            payloads.write_archive(self.path, {"b": b"2"})
+            self.assertEqual(payloads.read_archived("b", paid), b"2")
+
+    def test_archive_command_rewrites_each_month_once(self):
+        account = xy_account.objects.create(username="archive", password="")
+        rows = xy_rows(90, prefix="archive-", days=75)
+        ingest_page(rows, account)
+        months = {timezone.localtime(t).strftime("%Y-%m") for t in Order.objects.values_list("payment_time", flat=True)}
+        with override_settings(PAYLOAD_ARCHIVE_DIR=self.folder), \
+                mock.patch("data.management.commands.archive_payloads.write_archive", wraps=payloads.write_archive) as write:
+            call_command("archive_payloads", "--days", "0", "--batch-size", "7", stdout=io.StringIO())
+            self.assertEqual(write.call_count, len(months))
+            self.assertEqual(sorted(os.listdir(self.folder)), sorted(f"{m}.zip" for m in months))
+            self.assertEqual(OrderPayload.objects.count(), 0)
+            self.assertEqual(Order.objects.get(uuid=rows[5]["uuid"]).source_payload, rows[5])
+        for month in months:
+            payloads._forget_archive(os.path.join(self.folder, f"{month}.zip"))
+
+    def test_migration_copies_pack_like_the_live_module(self):
+        migration = importlib.import_module("data.migrations.0010_order_payload")
+        row = xy_rows(1, prefix="pack-")[0]
+        order = Order(**{k: v for k, v in parse_row(row).items() if k in {"uuid", "source_order_no", "payment_time", "payment_amount", "delivery_state"}})
+        mapped = payloads.order_values(order)
+        self.assertEqual(migration.order_values(order), mapped)
+        self.assertEqual(migration.pack(row, mapped), payloads.pack(row, mapped))
+        self.assertEqual(migration.unpack(payloads.pack(row, mapped), mapped), row)
+
+
+class OrderAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pw"))
+        self.account = xy_account.objects.create(username="admin", password="")
+        self.rows = xy_rows(30, prefix="admin-")
+        ingest_page(self.rows, self.account)
+        self.url = reverse("admin:data_order_changelist")
+
+    def test_changelist_keeps_the_date_hierarchy(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["cl"].date_hierarchy, "payment_time")
+        year = timezone.localtime(Order.objects.earliest("payment_time").payment_time).year
+        response = self.client.get(self.url, {"payment_time__year": year})
+        self.assertEqual(response.status_code, 200)
+
+    def test_mark_error_stops_retries(self):
+        uuids = [r["uuid"] for r in self.rows[:5]]
+        Order.objects.filter(uuid__in=uuids).update(sync_status=FAILED, next_retry_at=timezone.now())
+        pks = Order.objects.filter(uuid__in=uuids).values_list("pk", flat=True)
+        response = self.client.post(self.url, {"action": "mark_error", ACTION_CHECKBOX_NAME: list(pks)})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Order.objects.filter(uuid__in=uuids).values_list("sync_status", "next_retry_at")), {(ERROR, None)})
+        self.assertFalse(Order.objects.filter(uuid__in=uuids, sync_status__in=PUSH_QUEUE_STATES).exists())
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "sales": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "sales-tests"},
+})
+class SalesCacheTests(TestCase):
+    def setUp(self):
+        caches["sales"].clear()
+        sales_cache._pending.clear()  # counts other tests left unflushed
+        self.account = xy_account.objects.create(username="cache", password="")
+        self.rows = xy_rows(60, prefix="cache-", days=10, machines=1)
+        self.number = self.rows[0]["jqbh"]
+        days = sorted(timezone.localtime(parse_row(r)["payment_time"]).date() for r in self.rows)
+        self.params = {"machine_number": self.number, "start_date": days[0].isoformat(), "end_date": days[-1].isoformat()}
+        self.range = parse_date_range(self.params["start_date"], self.params["end_date"])
+
+    def total(self, **params):
+        return self.client.get("/api/total-sales/", {**self.params, **params}).json()["total_sales"]
+
+    def shipped_total(self):
+        return DailyMachineSales.objects.filter(delivery_state="Goods Shipped").aggregate(s=Sum("total_amount"))["s"] or 0
+
+    def test_ingest_evicts_the_cached_total(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_page(self.rows[:30], self.account)
+        self.assertEqual(Decimal(str(self.total())), self.shipped_total())
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_page(self.rows[30:], self.account)
+        self.assertEqual(Decimal(str(self.total())), self.shipped_total())
+        self.assertGreater(self.shipped_total(), 0)
+        self.assertGreater(sales_cache.stats()["evicted"], 0)
+
+    def test_machine_number_is_stripped_before_keying(self):
+        self.total()
+        self.total(machine_number=f"  {self.number} ")
+        self.assertEqual((sales_cache.stats()["hits"], sales_cache.stats()["misses"]), (1, 1))
+
+    def test_value_computed_before_an_invalidation_is_not_served(self):
+        machines = sales_cache.normalize_machines([self.number])
+        day = self.range.start_date
+
+        def stale_compute():
+            # an ingest commits and invalidates while this request is still computing
+            sales_cache.invalidate([(self.number, day)])
+            return "stale"
+
+        self.assertEqual(sales_cache.get_or_compute("total", machines, self.range, stale_compute), "stale")
+        self.assertEqual(sales_cache.get_or_compute("total", machines, self.range, lambda: "fresh"), "fresh")
+        self.assertEqual(sales_cache.get_or_compute("total", machines, self.range, lambda: "other"), "fresh")
+
+        sales_cache.invalidate_all()
+        self.assertEqual(sales_cache.get_or_compute("total", machines, self.range, lambda: "rebuilt"), "rebuilt")
+
+    def test_closed_ranges_never_expire(self):
+        self.assertIsNone(sales_cache.timeout_for(self.range.start_date - timedelta(days=400)))
+        self.assertEqual(sales_cache.timeout_for(timezone.localdate()), settings.SALES_CACHE_TTL)
+
+    def test_index_and_versions_survive_a_cleared_cache(self):
+        machines = sales_cache.normalize_machines([self.number])
+        self.assertEqual(sales_cache.get_or_compute("total", machines, self.range, lambda: "first"), "first")
+        caches["sales"].clear()  # the backend culled everything, index included before
+        self.assertEqual(sales_cache.get_or_compute("total", machines, self.range, lambda: "second"), "second")
+        self.assertEqual(sales_cache.invalidate([(self.number, self.range.end_date)]), 1)
+        self.assertEqual(sales_cache.get_or_compute("total", machines, self.range, lambda: "third"), "third")
+        self.assertEqual(sales_cache.stats()["evicted"], 1)
+
+
+class RecordingClient:
+    """Stands in for OdooClient in push(): answers every order with an id."""
+    order_path = "/vending/create_order_by_name"
+
+    def __init__(self):
+        self.sent = []
+
+    def push_batch(self, orders):
+        self.sent.extend(o.uuid for o in orders)
+        return {o.uuid: (f"odoo-{o.uuid}", None, False) for o in orders}
+
+
+class OutboundQueueTests(TestCase):
+    def setUp(self):
+        self.account = xy_account.objects.create(username="push", password="")
+        ingest_page(xy_rows(40, prefix="push-", days=20), self.account)
+        self.retry = RetryPolicy(base_delay=1, max_delay=1)
+
+    def test_claims_are_disjoint_and_bounded_by_since(self):
+        since = timezone.now() - timedelta(days=5)
+        recent = Order.objects.filter(payment_time__gte=since).count()
+        first = claim_batch(recent - 1, lease=60, since=since)
+        second = claim_batch(100, lease=60, since=since)
+        self.assertEqual(len(first) + len(second), recent)
+        self.assertFalse({o.id for o in first} & {o.id for o in second})
+        self.assertTrue(all(o.payment_time >= since for o in first + second))
+        self.assertEqual(claim_batch(100, lease=60, since=since), [])
+
+    def test_a_lost_lease_is_neither_sent_nor_written(self):
+        mine = claim_batch(100, lease=60)
+        # the lease runs out and another worker claims the same orders
+        Order.objects.filter(id__in=[o.id for o in mine]).update(next_retry_at=timezone.now() - timedelta(seconds=1))
+        theirs = claim_batch(100, lease=60)
+        self.assertEqual({o.id for o in theirs}, {o.id for o in mine})
+
+        client = RecordingClient()
+        self.assertEqual(push(client, mine, size=5, lease=60), [])
+        self.assertEqual(client.sent, [])
+        stale = [PushResult(o, None, "timeout", True) for o in mine]
+        self.assertEqual(record_results(stale, self.retry, 8), (0, 0, 0))
+
+        results = push(client, theirs, size=5, lease=60)
+        self.assertEqual(record_results(results, self.retry, 8), (40, 0, 0))
+        self.assertEqual(Order.objects.filter(sync_status=SENT).count(), 40)
+
+    def test_renewal_moves_the_lease_ahead(self):
+        batch = claim_batch(5, lease=1)
+        before = batch[0].next_retry_at
+        kept = renew_lease(batch, 600)
+        self.assertEqual(len(kept), 5)
+        self.assertGreater(Order.objects.get(id=batch[0].id).next_retry_at, before + timedelta(seconds=300))
+        self.assertEqual(record_results([PushResult(o, "x", None, False) for o in kept], self.retry, 8), (5, 0, 0))
+
+    def test_never_tried_orders_are_claimed_first(self):
+        retried = list(Order.objects.order_by("payment_time").values_list("id", flat=True)[:30])
+        Order.objects.filter(id__in=retried).update(sync_status=FAILED, next_retry_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual({o.id for o in claim_batch(10, lease=60)} & set(retried), set())
+        self.assertEqual(len(claim_batch(100, lease=60)), 30)
+
+
+class PushOrdersCommandTests(TransactionTestCase):
+    """push_orders --once against OdooStubServer (worker threads need committed rows)."""
+
+    def setUp(self):
+        self.server = OdooStubServer(flaky={}, reject=()).start()
+        self.addCleanup(self.server.stop)
+        account = xy_account.objects.create(username="odoo", password="")
+        ingest_page(xy_rows(30, prefix="odoo-", days=20), account)
+        self.recent = set(Order.objects.filter(payment_time__gte=timezone.now() - timedelta(days=7)).values_list("uuid", flat=True))
+
+    def run_push(self, *args):
+        call_command("push_orders", "--once", "--workers", "2", "--batch-size", "7", "--push-size", "5",
+                     "--base-url", self.server.url, *args, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_default_window_pushes_recent_orders_in_batches(self):
+        self.run_push()
+        self.assertEqual(set(Order.objects.filter(sync_status=SENT).values_list("uuid", flat=True)), self.recent)
+        self.assertEqual(set(self.server.orders), self.recent)
+        self.assertTrue(all(n == 1 for n in self.server.posts.values()))
+        batches = [payload for path, payload in self.server.requests if path == self.server.batch_path]
+        self.assertTrue(batches and all(len(b["orders"]) <= 5 for b in batches))
+
+        self.run_push("--all")
+        self.assertEqual(Order.objects.exclude(sync_status=SENT).count(), 0)
+
+    def test_flaky_items_are_retried_and_rejected_ones_stop(self):
+        flaky, rejected = sorted(self.recent)[:2]
+        self.server.flaky = {flaky: 1}
+        self.server.reject = {rejected}
+        self.run_push("--retry-base", "0", "--retry-max", "0")
+        self.assertEqual(Order.objects.get(uuid=flaky).sync_status, SENT)
+        self.assertEqual(Order.objects.get(uuid=flaky).attempts, 2)
+        self.assertEqual(Order.objects.get(uuid=rejected).sync_status, ERROR)
+
+
+class FetchWindowTests(TestCase):
+    def test_windows_cover_the_range_without_a_sliver_at_the_end(self):
+        chunker = AdaptiveChunker(100, rate_per_hour=90 / 24)  # about one day per window
+        end = timezone.now().replace(second=0, microsecond=0)
+        for start in (end - timedelta(days=3, minutes=1), end - timedelta(days=3, hours=12), end - timedelta(days=3)):
+            with self.subTest(start=start):
+                windows = list(chunker.windows(start, end))
+                self.assertEqual((windows[0][1], windows[-1][0]), (end, start))
+                self.assertTrue(all(a == d for (a, _), (_, d) in zip(windows, windows[1:])))
+                self.assertGreaterEqual(windows[-1][1] - windows[-1][0], chunker.width * chunker.MERGE_TAIL)
+
+    def test_windows_aim_at_one_page(self):
+        chunker = AdaptiveChunker(100, rate_per_hour=10, max_width=timedelta(days=30))
+        self.assertEqual(chunker.width, timedelta(hours=9))  # 90 orders: one page at fill 0.9
+        start = timezone.now() - chunker.width
+        chunker.observe(start, start + chunker.width, 600)  # six pages: split back to one
+        self.assertEqual(chunker.width, timedelta(hours=9) * 90 / 600)
+        width = chunker.width
+        chunker.observe(start, start + width, 150)  # within max_pages: left alone
+        self.assertEqual(chunker.width, width)
+
+    def test_auto_and_cursor_windows_start_on_a_minute(self):
+        account = xy_account.objects.create(username="window", password="")
+        ingest_page(xy_rows(20, prefix="window-", days=5), account)
+        command = SyncOrdersCommand()
+        start, end = command._compute_window(account)
+        self.assertEqual((start.second, start.microsecond, end.second, end.microsecond), (0, 0, 0, 0))
+        cursor = SyncCursor(xy_account=account, high_water=timezone.now().replace(second=41, microsecond=7))
+        start, _ = command._cursor_window(account, cursor, timedelta(minutes=60))
+        self.assertEqual((start.second, start.microsecond), (0, 0))
+        self.assertLessEqual(start, cursor.high_water - timedelta(minutes=60))
+
+
+class ChunkPagingTests(TestCase):
+    """_iter_pages and _aprefetch_chunk share _page_steps: same pages, same empty-page retries."""
+
+    def setUp(self):
+        self.rows = xy_rows(250, prefix="page-", days=3)
+        self.server = XYStubServer(self.rows, {"pager": "pw"}, empty_next=2).start()
+        self.addCleanup(self.server.stop)
+        self.command = SyncOrdersCommand()
+        self.command.retry = RetryPolicy(base_delay=0, max_delay=0, jitter=0)
+        now = timezone.localtime()
+        self.chunk = Chunk(None, None, (now - timedelta(days=4)).strftime("%Y-%m-%d %H:%M:%S"),
+                           (now + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"), False)
+
+    def fetch(self, client_class):
+        return AccountFetch(client_class("pager", "pw", lambda msg: None, base_url=self.server.url, retry_policy=self.command.retry),
+                            CircuitBreaker(), None, None)
+
+    def test_blocking_and_async_paging_agree(self):
+        fetch = self.fetch(XYApiClient)
+        pages = list(self.command._iter_pages(fetch, self.chunk, 100, lambda msg: None, page_delay=0))
+        self.assertEqual([(p, len(rows), total) for p, rows, total in pages], [(1, 100, 250), (2, 100, 250), (3, 50, 250)])
+        self.assertEqual(self.server.empties, 2)
+        self.assertEqual(fetch.breaker.failures, 0)
+
+        self.server.empty_next = 2
+        runner = AsyncLoopThread()
+        self.addCleanup(runner.close)
+        fetch = self.fetch(AsyncXYApiClient)
+        async_pages, err = runner.submit(self.command._aprefetch_chunk(fetch, self.chunk, 100, lambda msg: None)).result()
+        self.assertIsNone(err)
+        self.assertEqual(async_pages, pages)
+        self.assertEqual(self.server.empties, 4)
+
+    def test_exhausted_empty_retries_fail_the_chunk(self):
+        self.server.empty_next = 100
+        fetch = self.fetch(XYApiClient)
+        pages, err = self.command._prefetch_chunk(fetch, self.chunk, 100, lambda msg: None)
+        self.assertEqual(pages, [])
+        self.assertIn("still 0 rows", str(err))
+        self.assertEqual(fetch.breaker.failures, 1)
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.account = xy_account.objects.create(username="ingest", password="")
+        self.rows = xy_rows(60, prefix="ingest-")
+
+    def test_overlapping_pages_are_stored_and_rolled_up_once(self):
+        first = ingest_page(self.rows[:40], self.account)
+        second = ingest_page(self.rows[20:] + [{"zfsj": "not a date"}], self.account)
+        self.assertEqual((first.inserted, first.skipped), (40, 0))
+        self.assertEqual((second.inserted, second.skipped, second.invalid), (20, 20, 1))
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertEqual(rollup_totals(), order_totals())
+        number = self.rows[0]["jqbh"]
+        latest = Order.objects.filter(machine__number=number).latest("payment_time").payment_time
+        self.assertEqual(Order.objects.filter(machine__number=number).first().machine.last_order, latest)
+
+    def test_a_row_the_database_rejects_only_loses_that_row(self):
+        real_insert = ingest.insert_orders
+        bad = self.rows[5]["uuid"]
+
+        def picky_insert(orders, *args, **kwargs):
+            if any(o.uuid == bad for o in orders):
+                raise DataError("value too long")
+            return real_insert(orders, *args, **kwargs)
+
+        with mock.patch.object(ingest, "insert_orders", picky_insert):
+            result = ingest_page(self.rows[:20], self.account)
+        self.assertEqual((result.inserted, result.skipped, result.invalid), (19, 0, 1))
+        self.assertFalse(Order.objects.filter(uuid=bad).exists())
+        self.assertEqual(rollup_totals(), order_totals())
+
+    def test_orders_a_concurrent_ingest_stored_first_are_not_rolled_up_twice(self):
+        real_insert = ingest.insert_orders
+        raced = []
+
+        def racing_insert(orders, *args, **kwargs):
+            if not raced:
+                # another worker stores part of the page between our lookup and our INSERT
+                raced.append(True)
+                ingest_page(self.rows[:10], self.account)
+            return real_insert(orders, *args, **kwargs)
+
+        with mock.patch.object(ingest, "insert_orders", racing_insert):
+            result = ingest_page(self.rows[:30], self.account)
+        self.assertEqual(result.inserted, 20)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertEqual(rollup_totals(), order_totals())
+
+    def test_rollup_deltas_add_to_rows_stored_meanwhile(self):
+        ingest_page(self.rows, self.account)
+        rows = DailyMachineSales.objects.count()
+        before = rollup_totals()
+        # the same deltas again, as a second writer would apply them: added in place, no duplicate rows
+        self.assertEqual(apply_orders(list(Order.objects.all())), rows)
+        self.assertEqual(DailyMachineSales.objects.count(), rows)
+        self.assertEqual(rollup_totals(), {m: (amount * 2, count * 2) for m, (amount, count) in before.items()})
+
+
+class MetricsExportTests(TestCase):
+    def setUp(self):
+        self.metrics = Metrics(recent=2)
+        self.metrics.incr("orders", 3, account="a", result="inserted")
+        self.metrics.incr("orders", 2, account="a", result="inserted")
+        self.metrics.gauge("last_cycle_seconds", 1.5)
+        self.metrics.observe("phase", 0.5, phase="fetch", account='q"t')
+        self.metrics.observe("phase", 1.5, phase="fetch", account='q"t')
+        for n in range(3):
+            self.metrics.record("chunk", n=n)
+
+    def test_prometheus_text_keeps_each_family_together(self):
+        self.assertEqual(self.metrics.to_prometheus().splitlines(), [
+            "# TYPE xy_sync_orders_total counter",
+            'xy_sync_orders_total{account="a",result="inserted"} 5',
+            "# TYPE xy_sync_last_cycle_seconds gauge",
+            "xy_sync_last_cycle_seconds 1.5",
+            "# TYPE xy_sync_phase_seconds summary",
+            'xy_sync_phase_seconds_count{account="q\\"t",phase="fetch"} 2',
+            'xy_sync_phase_seconds_sum{account="q\\"t",phase="fetch"} 2.000000',
+            "# TYPE xy_sync_phase_seconds_max gauge",
+            'xy_sync_phase_seconds_max{account="q\\"t",phase="fetch"} 1.500000',
+        ])
+
+    def test_snapshot_is_written_as_json_or_prometheus_by_extension(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        for name in ("metrics.json", "metrics.prom"):
+            self.metrics.write(os.path.join(folder, name))
+        self.assertEqual(sorted(os.listdir(folder)), ["metrics.json", "metrics.prom"])
+        with open(os.path.join(folder, "metrics.prom"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), self.metrics.to_prometheus())
+        with open(os.path.join(folder, "metrics.json"), encoding="utf-8") as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot["timers"], [
+            {"name": "phase", "labels": {"account": 'q"t', "phase": "fetch"}, "count": 2, "sum": 2.0, "max": 1.5, "avg": 1.0},
+        ])
+        self.assertEqual([r["n"] for r in snapshot["recent"]], [1, 2])
+
+
+class MachineRegistryTests(TestCase):
+    def setUp(self):
+        self.account = xy_account.objects.create(username="registry", password="")
+        Machine.objects.create(name="Known", number="KNOWN", xy_account=self.account)
+
+    def test_numbers_are_looked_up_once_per_cycle(self):
+        registry = MachineRegistry(self.account).load()
+        with self.assertNumQueries(3):  # unknown numbers: look up, create, read back
+            machines = registry.resolve({"KNOWN": "Known", "NEW": "New"})
+        self.assertEqual(set(machines), {"KNOWN", "NEW"})
+        self.assertEqual(Machine.objects.get(number="NEW").xy_account, self.account)
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.resolve({"KNOWN": "", "NEW": ""}), machines)
+
+    def test_upkeep_is_written_with_one_update_per_page(self):
+        registry = MachineRegistry(self.account).load()
+        machines = registry.resolve({"KNOWN": "Known", "NEW": "New"})
+        Machine.objects.filter(number="KNOWN").update(is_broken=True)
+        machines["KNOWN"].is_broken = True
+        paid = timezone.now()
+        for m in machines.values():
+            registry.touch(m, m.name, paid)
+            registry.touch(m, m.name, paid - timedelta(hours=1))
+        with self.assertNumQueries(1):
+            self.assertEqual(registry.flush(), 2)
+        self.assertEqual(set(Machine.objects.values_list("last_order", "is_broken")), {(paid, False)})
+        self.assertEqual(registry.flush(), 0)
+
+
+class MachineDedupeMigrationTests(TransactionTestCase):
+    """0008 merges machines sharing a number before 0009 makes numbers unique."""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("data", target)])
+        return executor.loader.project_state([("data", target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes("data"))
+
+    def test_duplicates_are_merged_into_the_oldest_machine(self):
+        apps = self.migrate("0007_order_query_indexes")
+        Machine, Order = apps.get_model("data", "machine"), apps.get_model("data", "Order")
+        DailyMachineSales = apps.get_model("data", "DailyMachineSales")
+        account = apps.get_model("data", "xy_account").objects.create(username="dupes", password="")
+        paid = timezone.now()
+        keeper = Machine.objects.create(name="", number="DUP", is_broken=True)
+        extra = Machine.objects.create(name="Dup", number="DUP", xy_account=account, last_order=paid, is_online=True)
+        solo = Machine.objects.create(name="Solo", number="SOLO")
+        for i, m in enumerate([keeper, extra, extra, solo]):
+            Order.objects.create(uuid=f"dup-{i}", machine=m, payment_time=paid - timedelta(days=i),
+                                 payment_amount=Decimal("2.50"), delivery_state=SHIPPED_STATE)
+        DailyMachineSales.objects.create(machine=extra, date=timezone.localdate(paid), delivery_state=SHIPPED_STATE,
+                                         total_amount=Decimal("99"), order_count=9)
+
+        apps = self.migrate("0008_dedupe_machine_numbers")
+        Machine, Order = apps.get_model("data", "machine"), apps.get_model("data", "Order")
+        DailyMachineSales = apps.get_model("data", "DailyMachineSales")
+        self.assertEqual(set(Machine.objects.values_list("id", flat=True)), {keeper.id, solo.id})
+        merged = Machine.objects.get(number="DUP")
+        self.assertEqual(
+            (merged.name, merged.xy_account_id, merged.last_order, merged.is_online, merged.is_broken),
+            ("Dup", account.id, paid, True, False),
+        )
+        self.assertEqual(Order.objects.filter(machine_id=keeper.id).count(), 3)
+        self.assertEqual(
+            DailyMachineSales.objects.filter(machine_id=keeper.id).aggregate(amount=Sum("total_amount"), count=Sum("order_count")),
+            {"amount": Decimal("7.50"), "count": 3},
+        )
+
+
+@mock.patch.object(RetryPolicy, "_next_delay", return_value=0)
+class SyncCursorTests(TestCase):
+    """sync_orders cycles from the account's cursor against XYStubServer."""
+
+    def setUp(self):
+        self.account = xy_account.objects.create(username="cursor", password="pw")
+        now = timezone.now()
+        self.old = list(synthetic.xy_rows(machines=2, days=3, per_day=6, end=now - timedelta(days=1), prefix="cur-a"))
+        self.new = list(synthetic.xy_rows(machines=2, days=1, per_day=6, end=now - timedelta(minutes=5), prefix="cur-b"))
+        self.server = XYStubServer(self.old, {"cursor": "pw"}).start()
+        self.addCleanup(self.server.stop)
+
+    def sync(self, *args):
+        with override_settings(XY_BASE_URL=self.server.url), mock.patch.object(connection, "close"):
+            call_command("sync_orders", "--once", "--account", "cursor", "--page-delay", "0", "--page-size", "20", *args,
+                         stdout=io.StringIO(), stderr=io.StringIO())
+        return SyncCursor.objects.get(xy_account=self.account)
+
+    def test_cursor_advances_to_the_newest_stored_order(self, _delay):
+        cursor = self.sync()
+        self.assertTrue(cursor.complete)
+        self.assertEqual(Order.objects.count(), len(self.old))
+        self.assertEqual(cursor.high_water, Order.objects.latest("payment_time").payment_time)
+
+        self.server.set_rows(self.old + self.new)
+        cursor = self.sync()
+        self.assertTrue(cursor.complete)
+        self.assertEqual(Order.objects.count(), len(self.old) + len(self.new))
+        self.assertEqual(cursor.high_water, Order.objects.latest("payment_time").payment_time)
+        self.assertEqual(rollup_totals(), order_totals())
+
+    def test_a_failed_window_keeps_the_cursor(self, _delay):
+        high_water = self.sync().high_water
+        self.server.set_rows(self.old + self.new)
+        self.server.empty_next = 1000  # every page comes back empty although the total says otherwise
+        cursor = self.sync()
+        self.assertFalse(cursor.complete)
+        self.assertEqual(cursor.high_water, high_water)
+
+    def test_metrics_file_counts_the_cycle_and_its_orders(self, _delay):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, "sync.prom")
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.sync("--metrics-file", path)
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        self.assertIn('xy_sync_cycles_total{outcome="ok"} 1\n', text)
+        self.assertIn(f'xy_sync_orders_total{{account="cursor",result="inserted"}} {len(self.old)}\n', text)
+        self.assertIn('xy_sync_phase_seconds_count{account="cursor",phase="fetch"}', text)
+        self.assertFalse(os.path.exists(f"{path}.tmp"))
+
+
+class MachineFlagTests(TestCase):
+    def setUp(self):
+        self.account = xy_account.objects.create(username="flags", password="")
+        now = timezone.now()
+        self.recent = now - timedelta(minutes=10)
+        specs = {
+            "never-sold": dict(last_order=None, is_online=True),
+            "came-back": dict(last_order=self.recent, is_broken=True),
+            "stale": dict(last_order=now - timedelta(days=60)),
+            "quiet": dict(last_order=now - timedelta(days=5), is_online=True),
+            "settled": dict(last_order=self.recent, is_online=True, last_online=self.recent),
+        }
+        for number, fields in specs.items():
+            Machine.objects.create(name=number, number=number, xy_account=self.account, **fields)
+        Machine.objects.create(name="other", number="other", xy_account=xy_account.objects.create(username="o", password=""))
+        self.command = SyncOrdersCommand()
+
+    def flags(self):
+        return {m.number: (m.is_broken, m.is_online) for m in Machine.objects.filter(xy_account=self.account)}
+
+    def test_flags_are_set_with_one_update_per_direction(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.command._mark_broken_flags(self.account), (2, 1))
+        with self.assertNumQueries(2):
+            self.assertEqual(self.command._mark_online_flags(self.account), (1, 2))
+        self.assertEqual(self.flags(), {
+            "never-sold": (True, False),
+            "came-back": (False, True),
+            "stale": (True, False),
+            "quiet": (False, False),
+            "settled": (False, True),
+        })
+        self.assertEqual(Machine.objects.get(number="came-back").last_online, self.recent)
+        self.assertEqual(Machine.objects.get(number="other").is_broken, False)
+
+        self.assertEqual(self.command._mark_broken_flags(self.account), (0, 0))
+        self.assertEqual(self.command._mark_online_flags(self.account), (0, 0))
+
+
+@override_settings(XY_AUTH_FAILURE_CODES=["H0401"])  # what XYStubServer answers for an unknown session key
+class XYClientRetryTests(TestCase):
+    def setUp(self):
+        self.server = XYStubServer(xy_rows(30, prefix="client-"), {"client": "pw"}).start()
+        self.addCleanup(self.server.stop)
+        self.retry = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0, jitter=0)
+        now = timezone.localtime()
+        self.range = ((now - timedelta(days=40)).strftime("%Y-%m-%d %H:%M:%S"), now.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def logins(self):
+        return sum(1 for path, _ in self.server.requests if path == LOGIN_PATH)
+
+    def test_expired_session_logs_in_again(self):
+        client = XYApiClient("client", "pw", lambda msg: None, base_url=self.server.url, retry_policy=self.retry)
+        self.assertEqual(client.query_orders(*self.range)[1], 30)
+        self.server.sessions.clear()  # XY forgets the session key
+        rows, total = client.query_orders(*self.range, page_size=10)
+        self.assertEqual((len(rows), total), (10, 30))
+        self.assertEqual(self.logins(), 2)
+
+    def test_async_client_logs_in_again(self):
+        runner = AsyncLoopThread()
+        self.addCleanup(runner.close)
+        client = AsyncXYApiClient("client", "pw", lambda msg: None, base_url=self.server.url, retry_policy=self.retry)
+        self.assertEqual(runner.submit(client.query_orders(*self.range)).result()[1], 30)
+        self.server.sessions.clear()
+        self.assertEqual(runner.submit(client.query_orders(*self.range)).result()[1], 30)
+        self.assertEqual(self.logins(), 2)
+
+    def test_only_configured_codes_mean_a_rejected_session(self):
+        expired = {"code": "H0401", "msg": "session expired"}
+        self.assertTrue(_is_auth_failure(200, expired))
+        with override_settings(XY_AUTH_FAILURE_CODES=[]):
+            self.assertFalse(_is_auth_failure(200, expired))
+            self.assertFalse(_is_auth_failure(200, {"code": "H0500", "msg": "please login"}))
+            self.assertTrue(_is_auth_failure(401))
+            self.assertTrue(_is_auth_failure(403))
+
+    def test_gives_up_after_max_attempts(self):
+        client = XYApiClient("client", "wrong", lambda msg: None, base_url=self.server.url, retry_policy=self.retry)
+        with self.assertRaisesMessage(Exception, "after 3 attempts"):
+            client.query_orders(*self.range)
+        self.assertEqual(self.logins(), 3)
+
+
+class OdooBatchPushTests(TestCase):
+    def setUp(self):
+        account = xy_account.objects.create(username="batch", password="")
+        ingest_page(xy_rows(12, prefix="batch-", days=2), account)
+        self.retry = RetryPolicy(base_delay=1, max_delay=1)
+
+    def push_all(self, server):
+        client = OdooClient(base_url=server.url)
+        self.addCleanup(client.close)
+        batch = claim_batch(100, lease=60)
+        return record_results(push(client, batch, size=5, lease=60), self.retry, 8)
+
+    def test_orders_go_in_batches_of_push_size(self):
+        server = OdooStubServer(reject=[]).start()
+        self.addCleanup(server.stop)
+        self.assertEqual(self.push_all(server), (12, 0, 0))
+        # one request per machine and 5 orders; a single leftover order goes to the plain endpoint
+        sizes = [len(body["orders"]) if path == server.batch_path else 1 for path, body in server.requests]
+        self.assertEqual(sum(sizes), 12)
+        self.assertTrue(all(size <= 5 for size in sizes))
+        self.assertLess(len(sizes), 12)
+        self.assertEqual(set(server.posts.values()), {1})
+        for order in Order.objects.all():
+            self.assertEqual(order.external_id, str(server.orders[order.uuid][0]))
+
+    def test_purchase_date_is_local_time(self):
+        order = Order.objects.first()
+        order.payment_time = datetime(2026, 3, 2, 10, 0, tzinfo=ZoneInfo("Africa/Cairo"))
+        with timezone.override("Africa/Cairo"):
+            self.assertEqual(order_payload(order)["purchase_date"], "2026-03-02 10:00:00")
+
+    def test_falls_back_to_one_request_per_order_without_a_batch_endpoint(self):
+        server = OdooStubServer(batch_path=None).start()
+        self.addCleanup(server.stop)
+        self.assertEqual(self.push_all(server), (12, 0, 0))
+        self.assertEqual(sum(1 for path, _ in server.requests if path == server.order_path), 12)
+
+
+class KeysetPaginationTests(TestCase):
+    url = "/api/sales-report/"
+
+    def setUp(self):
+        account = xy_account.objects.create(username="keyset", password="")
+        rows = xy_rows(45, prefix="keyset-", machines=1)
+        ingest_page(rows, account)
+        self.number = rows[0]["jqbh"]
+        # a run of equal payment_times: the id breaks the tie
+        tie = Order.objects.order_by("payment_time")[10].payment_time
+        Order.objects.filter(id__in=list(Order.objects.order_by("payment_time").values_list("id", flat=True)[10:18])).update(payment_time=tie)
+        days = Order.objects.aggregate(first=Min("payment_time"), last=Max("payment_time"))
+        self.params = {
+            "machine_number": self.number,
+            "start_date": timezone.localtime(days["first"]).date().isoformat(),
+            "end_date": timezone.localtime(days["last"]).date().isoformat(),
+        }
+
+    def test_pages_cover_every_order_once_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            params = {**self.params, "limit": 7, **({"cursor": cursor} if cursor else {})}
+            body = self.client.get(self.url, params).json()
+            self.assertLessEqual(len(body["results"]), 7)
+            seen += [r["uuid"] for r in body["results"]]
+            cursor = body["next_cursor"]
+            if not cursor:
+                break
+        expected = list(Order.objects.order_by("-payment_time", "-id").values_list("uuid", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_bad_limit_or_cursor_is_a_400(self):
+        for extra in ({"limit": 0}, {"limit": "x"}, {"limit": 5, "cursor": "garbage"}):
+            with self.subTest(extra=extra):
+                self.assertEqual(self.client.get(self.url, {**self.params, **extra}).status_code, 400)
+
+    def test_streamed_filename_keeps_only_safe_characters(self):
+        for number, expected in ((self.number, self.number), ('a"; filename=x.exe\r\nX: y', "a_filename_x_exe_X_y")):
+            with self.subTest(number=number):
+                response = self.client.get(self.url, {**self.params, "machine_number": number, "stream": "csv"})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    response["Content-Disposition"],
+                    f'attachment; filename="sales-{expected}-{self.params["start_date"]}-{self.params["end_date"]}.csv"',
+                )
+
+
+class SalesReportFieldsTests(TestCase):
+    url = "/api/sales-report/"
+
+    def setUp(self):
+        account = xy_account.objects.create(username="fields", password="")
+        self.rows = {r["uuid"]: r for r in xy_rows(12, prefix="fields-", machines=1)}
+        ingest_page(list(self.rows.values()), account)
+        days = Order.objects.aggregate(first=Min("payment_time"), last=Max("payment_time"))
+        self.params = {
+            "machine_number": next(iter(self.rows.values()))["jqbh"],
+            "start_date": timezone.localtime(days["first"]).date().isoformat(),
+            "end_date": timezone.localtime(days["last"]).date().isoformat(),
+        }
+
+    def get(self, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {**self.params, **extra})
+        return response, " ".join(q["sql"] for q in queries.captured_queries)
+
+    def test_default_fields_leave_the_payload_out(self):
+        response, _ = self.get()
+        body = response.json()
+        self.assertEqual(len(body), len(self.rows))
+        self.assertEqual(list(body[0]), list(OrderReadSerializer.DEFAULT_FIELDS))
+
+    def test_fields_and_expand_pick_the_columns_read(self):
+        response, sql = self.get(fields="uuid, payment_amount", expand="source_payload")
+        self.assertEqual(response.status_code, 200)
+        for row in response.json():
+            self.assertEqual(list(row), ["uuid", "payment_amount", "source_payload"])
+            self.assertEqual(row["source_payload"], self.rows[row["uuid"]])
+        self.assertNotIn('"product_name"', sql)
+
+        response, sql = self.get(fields="uuid")
+        self.assertEqual([list(row) for row in response.json()], [["uuid"]] * len(self.rows))
+        self.assertNotIn('"data_orderpayload"', sql)
+
+    def test_unknown_names_are_a_400(self):
+        for extra, named in (({"fields": "uuid,nope"}, "nope"), ({"expand": "machine"}, "machine")):
+            with self.subTest(extra=extra):
+                response, _ = self.get(**extra)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(named, response.json()["error"])
+
+
+class OrderAdminSearchTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("searcher", "s@example.com", "pw"))
+        account = xy_account.objects.create(username="search", password="")
+        self.rows = xy_rows(30, prefix="search-", machines=3)
+        ingest_page(self.rows, account)
+        self.url = reverse("admin:data_order_changelist")
+
+    def search(self, term):
+        response = self.client.get(self.url, {"q": term})
+        self.assertEqual(response.status_code, 200)
+        return set(response.context["cl"].queryset.values_list("uuid", flat=True))
+
+    def test_an_id_is_matched_exactly_then_by_prefix(self):
+        uuid = self.rows[3]["uuid"]
+        self.assertEqual(self.search(uuid), {uuid})
+        self.assertEqual(self.search(f"  {uuid} "), {uuid})
+        order_no = self.rows[4]["ddbh"]
+        self.assertEqual(self.search(order_no), set(Order.objects.filter(source_order_no=order_no).values_list("uuid", flat=True)))
+        prefix = uuid[:-1]
+        self.assertEqual(self.search(prefix), set(Order.objects.filter(uuid__startswith=prefix).values_list("uuid", flat=True)))
+
+    def test_words_match_machine_names_and_order_fields(self):
+        number = self.rows[0]["jqbh"]
+        self.assertEqual(self.search(number), set(Order.objects.filter(machine__number=number).values_list("uuid", flat=True)))
+        self.assertEqual(self.search(f'"{self.rows[0]["jqmc"]}" item'), set(Order.objects.filter(machine__number=number).values_list("uuid", flat=True)))
+        self.assertEqual(self.search("no such thing"), set())
+
+
+class SyntheticDataTests(TestCase):
+    def test_seeded_delivery_states_follow_the_payload(self):
+        synthetic.seed_orders(200, machines=4, days=10)
+        orders = Order.objects.filter(uuid__startswith=synthetic.UUID_PREFIX)
+        self.assertEqual(orders.count(), 200)
+        for order in orders:
+            self.assertEqual(order.delivery_state, ingest.DELIVERY_STATE_MAP[int(order.source_payload["chzt"])])
+        self.assertTrue(orders.exclude(delivery_state=SHIPPED_STATE).exists())
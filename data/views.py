@@ -1,18 +1,22 @@
-from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.db.models import Sum
-from .models import Order, machine
-from .serializers import OrderSerializer
-from datetime import datetime
+from .models import Order, DailyMachineSales, SHIPPED_STATE
+from .serializers import OrderReadSerializer, InvalidFields
+from . import cache as sales_cache
+from .dates import DateRangeError, parse_date_range, payment_time_filter
+from .pagination import InvalidPage, KeysetPagination
+from .rollup import BREAKDOWNS, breakdown, sales_by_machine_day
+from .streaming import STREAM_FORMATS, stream_queryset
 
 # Create your views here.
 
 class TotalSalesView(APIView):
     def get(self, request):
-        machine_number = request.query_params.get('machine_number')
+        # stripped like machines-total-sales, so both share cache keys and index entries
+        machine_number = (request.query_params.get('machine_number') or '').strip()
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
 
@@ -23,21 +27,23 @@ class TotalSalesView(APIView):
             )
 
         try:
-            # Look up machine by number assuming 'number' field
-            # The model has 'number' field.
-            # Convert strings to date objects if necessary or rely on Django's field lookup
-            
-            # Using __date range or simple range depending on if input is datetime or date
-            # Assuming input is YYYY-MM-DD
-            
-            sales = Order.objects.filter(
-                machine__number=machine_number,
-                payment_time__date__gte=start_date,
-                payment_time__date__lte=end_date,
-                delivery_state='Goods Shipped'
-            ).aggregate(total_sales=Sum('payment_amount'))
-
-            total = sales['total_sales'] or 0.00
+            date_range = parse_date_range(start_date, end_date)
+        except DateRangeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Read the DailyMachineSales rollup (one row per machine/day/state)
+            # instead of summing raw orders.
+            def compute():
+                sales = DailyMachineSales.objects.filter(
+                    machine__number=machine_number,
+                    date__gte=date_range.start_date,
+                    date__lte=date_range.end_date,
+                    delivery_state=SHIPPED_STATE
+                ).aggregate(total_sales=Sum('total_amount'))
+                return sales['total_sales'] or 0.00
+
+            total = sales_cache.get_or_compute("total", sales_cache.normalize_machines([machine_number]), date_range, compute)
 
             return Response({"machine_number": machine_number, "total_sales": total})
 
@@ -46,10 +52,25 @@ class TotalSalesView(APIView):
 
 
 class MachinesTotalSalesView(APIView):
+    """
+    Combined shipped sales of several machines.
+    GET takes query parameters; POST takes the same keys in a JSON body
+    (machine_numbers may be a list there), for fleets too large for a URL.
+    Optional breakdown=machine, day or machine,day adds per-machine and/or
+    per-day sums and counts from the same single GROUP BY query.
+    """
     def get(self, request):
-        machine_numbers_param = request.query_params.get('machine_numbers')
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
+        return self.respond(request.query_params)
+
+    def post(self, request):
+        return self.respond(request.data)
+
+    def respond(self, params):
+        if not hasattr(params, 'get'):
+            return Response({"error": "The request body must be a JSON object."}, status=status.HTTP_400_BAD_REQUEST)
+        machine_numbers_param = params.get('machine_numbers')
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
 
         if not all([machine_numbers_param, start_date, end_date]):
             return Response(
@@ -57,17 +78,48 @@ class MachinesTotalSalesView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
+        if isinstance(machine_numbers_param, str):
             machine_numbers = [num.strip() for num in machine_numbers_param.split(',')]
-            
-            sales = Order.objects.filter(
-                machine__number__in=machine_numbers,
-                payment_time__date__gte=start_date,
-                payment_time__date__lte=end_date,
-                delivery_state='Goods Shipped'
-            ).aggregate(total_sales=Sum('payment_amount'))
+        elif isinstance(machine_numbers_param, list) and all(isinstance(num, str) for num in machine_numbers_param):
+            machine_numbers = [num.strip() for num in machine_numbers_param]
+        else:
+            return Response(
+                {"error": "machine_numbers must be a comma separated string or a list of strings."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-            total = sales['total_sales'] or 0.00
+        try:
+            date_range = parse_date_range(start_date, end_date)
+        except DateRangeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        by = [b.strip() for b in str(params.get('breakdown') or '').split(',') if b.strip()]
+        if any(b not in BREAKDOWNS for b in by):
+            return Response(
+                {"error": f"breakdown must be a comma separated subset of: {', '.join(BREAKDOWNS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            machines = sales_cache.normalize_machines(machine_numbers)
+
+            if by:
+                rows = sales_cache.get_or_compute(
+                    "machine_day", machines, date_range,
+                    lambda: sales_by_machine_day(machines, date_range.start_date, date_range.end_date),
+                )
+                return Response({"machine_numbers": machine_numbers, **breakdown(rows, machines, by)})
+
+            def compute():
+                sales = DailyMachineSales.objects.filter(
+                    machine__number__in=machines,
+                    date__gte=date_range.start_date,
+                    date__lte=date_range.end_date,
+                    delivery_state=SHIPPED_STATE
+                ).aggregate(total_sales=Sum('total_amount'))
+                return sales['total_sales'] or 0.00
+
+            total = sales_cache.get_or_compute("total", machines, date_range, compute)
 
             return Response({"machine_numbers": machine_numbers, "total_sales": total})
 
@@ -75,30 +127,77 @@ class MachinesTotalSalesView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CacheStatsView(APIView):
+    def get(self, request):
+        return Response(sales_cache.stats())
+
+
 class SalesReportView(ListAPIView):
-    serializer_class = OrderSerializer
+    """
+    Orders of one machine in a date range, newest first.
+    Optional: `fields` / `expand=source_payload` to pick columns, `limit` (+ `cursor`)
+    for keyset pages, `stream=ndjson|csv` for a streamed export.
+    """
+    serializer_class = OrderReadSerializer
+    pagination_class = KeysetPagination
+    date_range = None
+    fields = None
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.fields)
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
         machine_number = self.request.query_params.get('machine_number')
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
 
-        if not all([machine_number, start_date, end_date]):
+        if not machine_number or self.date_range is None:
             return Order.objects.none()
 
-        return Order.objects.filter(
+        # payment_time >= start AND < end+1day: uses the payment_time index
+        queryset = Order.objects.filter(
             machine__number=machine_number,
-            payment_time__date__gte=start_date,
-            payment_time__date__lte=end_date
-        ).order_by('-payment_time')
+            **payment_time_filter(self.date_range)
+        ).order_by('-payment_time', '-id')
+        return OrderReadSerializer.optimize(queryset, self.fields or OrderReadSerializer.DEFAULT_FIELDS)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        if not queryset.exists() and not all([request.query_params.get('machine_number'), request.query_params.get('start_date'), request.query_params.get('end_date')]):
+        if not all([request.query_params.get('machine_number'), request.query_params.get('start_date'), request.query_params.get('end_date')]):
              return Response(
                 {"error": "machine_number, start_date, and end_date are required parameters."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-            
+
+        try:
+            self.date_range = parse_date_range(request.query_params['start_date'], request.query_params['end_date'])
+        except DateRangeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            self.fields = OrderReadSerializer.select_fields(request.query_params.get('fields'), request.query_params.get('expand'))
+        except InvalidFields as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        stream = request.query_params.get('stream')
+        if stream and stream not in STREAM_FORMATS:
+            return Response(
+                {"error": f"stream must be one of: {', '.join(STREAM_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = self.get_queryset()
+
+        if stream:
+            serializer = self.get_serializer()
+            filename = f"sales-{request.query_params['machine_number']}-{self.date_range.start_date}-{self.date_range.end_date}"
+            return stream_queryset(queryset, serializer.to_representation, stream, list(serializer.fields), filename=filename)
+
+        try:
+            page = self.paginate_queryset(queryset)
+        except InvalidPage as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
@@ -0,0 +1,550 @@
+# data/xy_client.py
+"""
+XY vending API clients (login + orders).
+
+XYApiClient is the blocking requests-based client used by sync_orders.
+AsyncXYApiClient has the same authenticate/query_orders contract on asyncio;
+its connections come from one long-lived HTTP/2 pool per host so keep-alive
+survives between cycles (see AsyncLoopThread).
+
+Both clients can take a SessionCache so a session key outlives the client
+and login only happens again on expiry or when the API rejects the key.
+"""
+import asyncio
+import hashlib
+import importlib.util
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from .metrics import metrics
+from .models import XYSession
+from .retry import RetryPolicy, BudgetExceeded
+
+try:
+    import httpx
+except ImportError:  # optional: only needed for the async client
+    httpx = None
+
+
+DEFAULT_BASE_URL = "https://xcx.xynetweb.com"
+CHECK_CODE_PATH = "/sram/comm/login/getCheckCode"
+LOGIN_PATH = "/sram/comm/login/onLogin"
+ORDERS_PATH = "/service-order/ddxx/queryDdxx"
+SUMMARY_ROW = "本页小计"
+
+
+
+def _base_url(base_url=None):
+    return (base_url or getattr(settings, "XY_BASE_URL", None) or DEFAULT_BASE_URL).rstrip("/")
+
+def _md5(s: str) -> str:
+    return hashlib.md5(s.encode("utf-8")).hexdigest()
+
+def _login_payload(username, password, check_code):
+    i1 = _md5(username + password)
+    return {
+        "password": _md5(username + i1 + str(check_code)),
+        "account": username,
+        "checkCode": str(check_code),
+        "language": "en",
+        "channel": "1",
+    }
+
+def _orders_payload(start, end, page_num, page_size, shbh=None, userid=None):
+    payload = {
+        "jyz": -1, "ycd": -1, "orderBy": "cjsj desc",
+        "pageNum": page_num, "pageSize": page_size,
+        "shmc": "", "zjzt": "", "ywlx": "", "queryType": 0,
+        "dsfshdh": "", "dsfjybh": "", "zfzt": "", "zffs": "", "zfzh": "",
+        "chzt": "", "starttime": start, "endtime": end,
+        "spxx": "", "language": "en", "channel": "1",
+    }
+    if shbh:
+        payload["shbh"] = shbh
+    if userid:
+        payload["userid"] = userid
+    return payload
+
+def _parse_orders(data):
+    """queryDdxx body -> (rows, total), summary row dropped."""
+    block = data.get("data") or {}
+    rows = block.get("data") or block.get("list") or []
+    total = block.get("total") or len(rows)
+    # drop summary row ""
+    rows = [r for r in rows if r.get("shmc") != SUMMARY_ROW]
+    return rows, int(total)
+
+def _is_auth_failure(status_code, data=None):
+    """
+    HTTP 401/403, or a queryDdxx `code` listed in XY_AUTH_FAILURE_CODES. XY does
+    not document its session errors, so no body code counts unless configured.
+    """
+    if status_code in (401, 403):
+        return True
+    code = str((data or {}).get("code") or "")
+    return bool(code) and code in getattr(settings, "XY_AUTH_FAILURE_CODES", ())
+
+
+# -----------------------------
+# Session key cache
+# -----------------------------
+class SessionCache:
+    """
+    Session key of one account, persisted in XYSession with a TTL.
+    Clients only record login events in memory (safe from worker threads and
+    the async loop); load() and flush() hit the DB on the command thread.
+    """
+
+    def __init__(self, account, ttl=None):
+        self.account = account
+        self.ttl = timedelta(seconds=ttl if ttl is not None else getattr(settings, "XY_SESSION_TTL", 6 * 3600))
+        self.session_key = None
+        self.events = []
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Cached key if it has not expired yet, else None."""
+        row = XYSession.objects.filter(xy_account=self.account).first()
+        if row and row.session_key and row.expires_at and row.expires_at > timezone.now():
+            self.session_key = row.session_key
+        return self.session_key
+
+    def _record(self, kind, value=None, latency_ms=None):
+        with self.lock:
+            self.events.append((kind, value, latency_ms, timezone.now()))
+
+    def logged_in(self, key, latency_ms):
+        self.session_key = key
+        self._record("login", key, latency_ms)
+
+    def login_failed(self, error):
+        self._record("failure", str(error)[:500])
+
+    def rejected(self, key):
+        if self.session_key == key:
+            self.session_key = None
+        self._record("rejected", key)
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if not events:
+            return
+        row, _ = XYSession.objects.get_or_create(xy_account=self.account)
+        for kind, value, latency_ms, at in events:
+            if kind == "login":
+                row.session_key = value
+                row.obtained_at = at
+                row.expires_at = at + self.ttl
+                row.logins += 1
+                row.last_login_ms = latency_ms
+                row.consecutive_failures = 0
+            elif kind == "failure":
+                row.failures += 1
+                row.consecutive_failures += 1
+                row.last_error = value
+                row.last_failure_at = at
+            elif kind == "rejected" and row.session_key == value:
+                row.session_key = None
+                row.expires_at = None
+        row.save()
+
+
+# -----------------------------
+# Rate limiters (concurrent mode)
+# -----------------------------
+class RateLimiter:
+    """Thread-safe token bucket shared by every XY client in a cycle."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self):
+        """Take a token if one is available; else return seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AsyncRateLimiter(RateLimiter):
+    """Same token bucket, awaited instead of slept on."""
+
+    async def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+# -----------------------------
+# Blocking client
+# -----------------------------
+class XYApiClient:
+    BASE_URL = DEFAULT_BASE_URL
+    HEADERS = {
+        "Accept": "application/json, text/plain, */*",
+        "Origin": "https://www.xynetweb.com",
+        "Referer": "https://www.xynetweb.com/",
+        "Content-Type": "application/json;charset=UTF-8",
+    }
+
+    def __init__(self, username, password, logger, rate_limiter=None, max_in_flight=None, base_url=None,
+                 session_cache=None, retry_policy=None):
+        self.username = username
+        self.password = password
+        self.base_url = _base_url(base_url)
+        self.session = requests.Session()
+        self.session.headers.update(self.HEADERS)
+        self.session_key = None
+        self.logger = logger
+        # concurrent mode: global request rate + per-account in-flight cap
+        self.rate_limiter = rate_limiter
+        self._gate = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._auth_lock = threading.Lock()
+        self.retry = retry_policy or RetryPolicy()
+        self.session_cache = session_cache
+        if session_cache is not None and session_cache.session_key:
+            self._use_key(session_cache.session_key)
+
+    def _use_key(self, key):
+        self.session_key = key
+        self.session.headers.update({"Authorization": key})
+
+    def _drop_session(self):
+        key, self.session_key = self.session_key, None
+        self.session.headers.pop("Authorization", None)
+        if self.session_cache is not None and key:
+            self.session_cache.rejected(key)
+
+    def _backoff(self, attempt, max_retries):
+        if attempt < max_retries:
+            metrics.observe("phase", self.retry.backoff(attempt), phase="sleep_backoff", account=self.username)
+
+    def _send(self, method, url, **kwargs):
+        if self.rate_limiter is not None or self._gate is not None:
+            with metrics.timer("phase", phase="throttle", account=self.username):
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                if self._gate is not None:
+                    self._gate.acquire()
+        metrics.incr("requests", account=self.username)
+        try:
+            with metrics.timer("phase", phase="fetch", account=self.username):
+                return self.session.request(method, url, **kwargs)
+        finally:
+            if self._gate is not None:
+                self._gate.release()
+
+    def _get_check_code(self):
+        url = f"{self.base_url}{CHECK_CODE_PATH}"
+        r = self._send("GET", url, timeout=10)
+        r.raise_for_status()
+        j = r.json()
+        return j.get("data")
+
+    def authenticate(self) -> bool:
+        if self.session_key:
+            return True
+        with self._auth_lock, metrics.timer("phase", phase="auth", account=self.username):
+            return self._login()
+
+    def _login(self) -> bool:
+        if self.session_key:  # another thread logged in while we waited
+            return True
+        started = time.monotonic()
+        try:
+            check_code = self._get_check_code()
+        except Exception as e:
+            self.logger(f"[AUTH] getCheckCode failed: {e}")
+            self._login_failed(e)
+            return False
+
+        try:
+            url = f"{self.base_url}{LOGIN_PATH}"
+            payload = _login_payload(self.username, self.password, check_code)
+            r = self._send("POST", url, json=payload, timeout=15)
+            r.raise_for_status()
+            data = r.json()
+            if data.get("code") == "H0000" and data.get("data", {}).get("session_key"):
+                self._use_key(data["data"]["session_key"])
+                latency_ms = int((time.monotonic() - started) * 1000)
+                if self.session_cache is not None:
+                    self.session_cache.logged_in(self.session_key, latency_ms)
+                self.logger(f"[AUTH] OK for {self.username} in {latency_ms}ms")
+                return True
+            self.logger(f"[AUTH] Failed: {data.get('msg')} (code={data.get('code')})")
+            self._login_failed(f"{data.get('msg')} (code={data.get('code')})")
+            return False
+        except Exception as e:
+            self.logger(f"[AUTH] onLogin failed: {e}")
+            self._login_failed(e)
+            return False
+
+    def _login_failed(self, error):
+        if self.session_cache is not None:
+            self.session_cache.login_failed(error)
+
+    def query_orders(self, start: str, end: str, page_num=1, page_size=100, shbh=None, userid=None):
+        """
+        Returns (rows, total).
+        Raises Exception if all retries fail.
+        """
+        max_retries = self.retry.max_attempts
+
+        for attempt in range(1, max_retries + 1):
+            self.retry.check_budget()
+            if not self.authenticate():
+                self.logger(f"[ORDERS] Auth failed, retrying... ({attempt}/{max_retries})")
+                self._backoff(attempt, max_retries)
+                continue
+
+            url = f"{self.base_url}{ORDERS_PATH}"
+            payload = _orders_payload(start, end, page_num, page_size, shbh, userid)
+
+            try:
+                r = self._send("POST", url, json=payload, timeout=60)
+                if _is_auth_failure(r.status_code):
+                    self.logger(f"[ORDERS] Session rejected (HTTP {r.status_code}), logging in again ({attempt}/{max_retries})")
+                    self._drop_session()
+                    continue
+                r.raise_for_status()
+                data = r.json() or {}
+
+                if data.get("code") != "H0000":
+                    msg = data.get("msg")
+                    code = data.get("code")
+                    if _is_auth_failure(r.status_code, data):
+                        self.logger(f"[ORDERS] Session rejected: {msg} (code={code}), logging in again ({attempt}/{max_retries})")
+                        self._drop_session()
+                        continue
+                    self.logger(f"[ORDERS] API error: {msg} (code={code}). Retrying... ({attempt}/{max_retries})")
+                    self._backoff(attempt, max_retries)
+                    continue
+
+                return _parse_orders(data)
+
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                self.logger(f"[ORDERS] Request failed: {e}. Retrying... ({attempt}/{max_retries})")
+                self._backoff(attempt, max_retries)
+
+        raise Exception(f"Failed to query orders after {max_retries} attempts")
+
+
+# -----------------------------
+# Async client + pooled transports
+# -----------------------------
+_TRANSPORTS = {}
+
+
+def _shared_transport(base_url):
+    """
+    One pooled transport per host, shared by every account's AsyncClient.
+    Accounts keep their own client (headers, cookies); only sockets are shared.
+    Must be used from a single event loop (AsyncLoopThread).
+    """
+    transport = _TRANSPORTS.get(base_url)
+    if transport is None:
+        transport = httpx.AsyncHTTPTransport(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+            retries=1,
+        )
+        _TRANSPORTS[base_url] = transport
+    return transport
+
+
+async def aclose_transports():
+    while _TRANSPORTS:
+        _, transport = _TRANSPORTS.popitem()
+        await transport.aclose()
+
+
+class AsyncXYApiClient:
+    """asyncio counterpart of XYApiClient with the same authenticate/query_orders contract."""
+    HEADERS = XYApiClient.HEADERS
+
+    def __init__(self, username, password, logger, rate_limiter=None, max_in_flight=None, base_url=None,
+                 session_cache=None, retry_policy=None):
+        if httpx is None:
+            raise RuntimeError("AsyncXYApiClient needs httpx (pip install 'httpx[http2]')")
+        self.username = username
+        self.password = password
+        self.base_url = _base_url(base_url)
+        self.session_key = None
+        self.logger = logger
+        self.rate_limiter = rate_limiter
+        self._gate = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self._auth_lock = asyncio.Lock()
+        self.retry = retry_policy or RetryPolicy()
+        # never closed per account: closing would close the shared transport
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url, headers=self.HEADERS, transport=_shared_transport(self.base_url),
+        )
+        self.session_cache = session_cache
+        if session_cache is not None and session_cache.session_key:
+            self._use_key(session_cache.session_key)
+
+    def _use_key(self, key):
+        self.session_key = key
+        self.http.headers["Authorization"] = key
+
+    def _drop_session(self):
+        key, self.session_key = self.session_key, None
+        self.http.headers.pop("Authorization", None)
+        if self.session_cache is not None and key:
+            self.session_cache.rejected(key)
+
+    async def _backoff(self, attempt, max_retries):
+        if attempt < max_retries:
+            metrics.observe("phase", await self.retry.abackoff(attempt), phase="sleep_backoff", account=self.username)
+
+    def _login_failed(self, error):
+        if self.session_cache is not None:
+            self.session_cache.login_failed(error)
+
+    async def _send(self, method, path, timeout, **kwargs):
+        if self.rate_limiter is not None or self._gate is not None:
+            with metrics.timer("phase", phase="throttle", account=self.username):
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                if self._gate is not None:
+                    await self._gate.acquire()
+        metrics.incr("requests", account=self.username)
+        try:
+            with metrics.timer("phase", phase="fetch", account=self.username):
+                return await self.http.request(method, path, timeout=timeout, **kwargs)
+        finally:
+            if self._gate is not None:
+                self._gate.release()
+
+    async def _get_check_code(self):
+        r = await self._send("GET", CHECK_CODE_PATH, timeout=10)
+        r.raise_for_status()
+        return r.json().get("data")
+
+    async def authenticate(self) -> bool:
+        if self.session_key:
+            return True
+        async with self._auth_lock:
+            if self.session_key:
+                return True
+            with metrics.timer("phase", phase="auth", account=self.username):
+                return await self._login()
+
+    async def _login(self) -> bool:
+        started = time.monotonic()
+        try:
+            check_code = await self._get_check_code()
+        except Exception as e:
+            self.logger(f"[AUTH] getCheckCode failed: {e}")
+            self._login_failed(e)
+            return False
+
+        try:
+            payload = _login_payload(self.username, self.password, check_code)
+            r = await self._send("POST", LOGIN_PATH, timeout=15, json=payload)
+            r.raise_for_status()
+            data = r.json()
+            if data.get("code") == "H0000" and data.get("data", {}).get("session_key"):
+                self._use_key(data["data"]["session_key"])
+                latency_ms = int((time.monotonic() - started) * 1000)
+                if self.session_cache is not None:
+                    self.session_cache.logged_in(self.session_key, latency_ms)
+                self.logger(f"[AUTH] OK for {self.username} in {latency_ms}ms")
+                return True
+            self.logger(f"[AUTH] Failed: {data.get('msg')} (code={data.get('code')})")
+            self._login_failed(f"{data.get('msg')} (code={data.get('code')})")
+            return False
+        except Exception as e:
+            self.logger(f"[AUTH] onLogin failed: {e}")
+            self._login_failed(e)
+            return False
+
+    async def query_orders(self, start: str, end: str, page_num=1, page_size=100, shbh=None, userid=None):
+        """
+        Returns (rows, total).
+        Raises Exception if all retries fail.
+        """
+        max_retries = self.retry.max_attempts
+
+        for attempt in range(1, max_retries + 1):
+            self.retry.check_budget()
+            if not await self.authenticate():
+                self.logger(f"[ORDERS] Auth failed, retrying... ({attempt}/{max_retries})")
+                await self._backoff(attempt, max_retries)
+                continue
+
+            payload = _orders_payload(start, end, page_num, page_size, shbh, userid)
+            try:
+                r = await self._send("POST", ORDERS_PATH, timeout=60, json=payload)
+                if _is_auth_failure(r.status_code):
+                    self.logger(f"[ORDERS] Session rejected (HTTP {r.status_code}), logging in again ({attempt}/{max_retries})")
+                    self._drop_session()
+                    continue
+                r.raise_for_status()
+                data = r.json() or {}
+
+                if data.get("code") != "H0000":
+                    if _is_auth_failure(r.status_code, data):
+                        self.logger(f"[ORDERS] Session rejected: {data.get('msg')} (code={data.get('code')}), logging in again ({attempt}/{max_retries})")
+                        self._drop_session()
+                        continue
+                    self.logger(f"[ORDERS] API error: {data.get('msg')} (code={data.get('code')}). Retrying... ({attempt}/{max_retries})")
+                    await self._backoff(attempt, max_retries)
+                    continue
+
+                return _parse_orders(data)
+
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                self.logger(f"[ORDERS] Request failed: {e}. Retrying... ({attempt}/{max_retries})")
+                await self._backoff(attempt, max_retries)
+
+        raise Exception(f"Failed to query orders after {max_retries} attempts")
+
+
+class AsyncLoopThread:
+    """
+    Long-lived event loop in a daemon thread.
+    Sync code submits coroutines and gets concurrent.futures.Future back, so the
+    pooled connections stay open across sync_orders cycles.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="xy-async", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self):
+        self.submit(aclose_transports()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -135,6 +135,48 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# XY vending API (order source); point at a local stub for offline runs
+XY_BASE_URL = os.getenv('XY_BASE_URL', 'https://xcx.xynetweb.com')
+# seconds a cached XY session key is reused before logging in again
+XY_SESSION_TTL = int(os.getenv('XY_SESSION_TTL', 6 * 3600))
+# queryDdxx `code` values that mean the session key was rejected (comma-separated, e.g. H0401).
+# XY does not document them, so none are assumed; HTTP 401/403 always count.
+XY_AUTH_FAILURE_CODES = [c.strip() for c in os.getenv('XY_AUTH_FAILURE_CODES', '').split(',') if c.strip()]
+
+# Odoo vending endpoint for the outbound order push (push_orders)
+ODOO_BASE_URL = os.getenv('ODOO_BASE_URL', '')
+ODOO_API_KEY = os.getenv('ODOO_API_KEY', '')
+ODOO_ORDER_PATH = os.getenv('ODOO_ORDER_PATH', '/vending/create_order_by_name')
+# many-orders-per-request endpoint; empty = one request per order
+ODOO_BATCH_PATH = os.getenv('ODOO_BATCH_PATH', '/vending/create_orders_by_name')
+ODOO_TIMEOUT = float(os.getenv('ODOO_TIMEOUT', 10))
+ODOO_POS_ID = int(os.getenv('ODOO_POS_ID', 1))
+ODOO_PAYMENT_METHOD_ID = int(os.getenv('ODOO_PAYMENT_METHOD_ID', 2))
+# product name sent for every order; empty = the order's own product_name
+ODOO_PRODUCT_NAME = os.getenv('ODOO_PRODUCT_NAME', '')
+
+# Sales aggregate cache. File-based by default so the sync process (which
+# invalidates on ingest) and the web workers share it; any Django cache
+# backend works (e.g. SALES_CACHE_BACKEND=django.core.cache.backends.locmem.LocMemCache).
+# It only holds the values: the key index and version tokens are database
+# rows (data.cache), so culling an entry just costs a recompute.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sales': {
+        'BACKEND': os.getenv('SALES_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('SALES_CACHE_LOCATION', str(BASE_DIR / '.cache' / 'sales')),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+# seconds a sales total is cached while its range includes today; closed ranges (past days only)
+# stay cached until an ingest for one of their machines and days invalidates them
+SALES_CACHE_TTL = int(os.getenv('SALES_CACHE_TTL', 60))
+
+# `manage.py archive_payloads` moves old Order payloads here (one zip per month)
+PAYLOAD_ARCHIVE_DIR = os.getenv('PAYLOAD_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'payloads'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 